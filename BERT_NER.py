@@ -1,52 +1,40 @@
-from transformers import AutoTokenizer, AutoModelForTokenClassification, pipeline
-import re
+from transformers import AutoTokenizer
 
-# Load tokenizer and model
-tokenizer = AutoTokenizer.from_pretrained("dslim/bert-base-NER")
-model = AutoModelForTokenClassification.from_pretrained("dslim/bert-base-NER")
-
-# Initialize the pipeline with aggregation strategy
-nlp = pipeline("ner", model=model, tokenizer=tokenizer, aggregation_strategy="first")
-
-# Preprocess the text
-def preprocess_text(text):
-    text = re.sub(r'([.,;:])', r' \1 ', text)  # Add space around punctuation
-    text = re.sub(r'\s+', ' ', text)  # Replace multiple spaces with a single space
-    return text.strip()
-
-# Split the text into manageable chunks
-def split_text(text, tokenizer, max_length=512, overlap=50):
-    tokens = tokenizer.encode(text, add_special_tokens=False)
-    chunks = []
-    for i in range(0, len(tokens), max_length - overlap):
-        chunk = tokens[i:i + max_length]
-        chunks.append(tokenizer.decode(chunk, skip_special_tokens=True))
-    return chunks
+from ner_backends import BACKEND_PATHS, load_backend
+from ner_rules import RuleTagger, collect_entity_bank, run_with_rules
+from prediction_cache import PredictionCache
 
-# Manual chunking to handle grouped entities
-def manual_chunking(ner_results):
-    chunks = []
-    for entity in ner_results:
-        word = entity["word"]
-        label = entity["entity_group"]  # Use "entity_group" instead of "entity"
-        score = entity["score"] * 100  # Probability of the entity
-        start = entity["start"]
-        end = entity["end"]
+# Inference backend: "torch" (fp32), "int8" (quantize_model.py) or "onnx" (export_onnx.py)
+BACKEND = "torch"
+model_path = "dslim/bert-base-NER" if BACKEND == "torch" else BACKEND_PATHS[BACKEND]
 
-        # Append the entity to the results
-        chunks.append({"word": word, "label": label, "score": score, "start": start, "end": end})
-
-    return chunks
-
-# Filter entities based on context
-def filter_entities(chunked_results):
-    filtered_results = []
-    for chunk in chunked_results:
-        word = chunk["word"]
-        label = chunk["label"]
-        score = chunk["score"]
-        filtered_results.append(chunk)
-    return filtered_results
+# Load tokenizer and model
+tokenizer = AutoTokenizer.from_pretrained(model_path)
+model = load_backend(BACKEND, model_path)
+
+# Token budget for each padded batch of windows sent through the model
+MAX_TOKENS_PER_BATCH = 8192
+# Long documents are cut into MAX_LENGTH-subword windows sharing WINDOW_STRIDE subwords
+MAX_LENGTH = 512
+WINDOW_STRIDE = 128
+# How a word's subwords are combined into its label: "first", "average" or "max" (see ner_decode.py)
+AGGREGATION = "first"
+# Entities whose mean probability is below their type's threshold are dropped, e.g. {"PERSON": 0.6}
+ENTITY_THRESHOLDS = {}
+# Rule engine for CASE_NUM, PROM_DATE and RA (see ner_rules.py): "model" (off), "hybrid" (rules merged
+# into the model's entities), "skip" (hybrid, minus windows the rules fully explain) or "rules" (no model)
+RULE_MODE = "model"
+# Optional .iob folder or packed corpus whose recurring CASE_NUM/PROM_DATE/RA phrases are matched too
+RULE_BANK_FOLDER = None
+rule_tagger = RuleTagger(collect_entity_bank(RULE_BANK_FOLDER) if RULE_BANK_FOLDER else None)
+# Documents already seen by this checkpoint (same text, tokenizer and window settings) are read
+# from .cache/predictions instead of being run through the model again
+USE_PREDICTION_CACHE = True
+cache_settings = {"max_length": MAX_LENGTH, "stride": WINDOW_STRIDE, "aggregation": AGGREGATION}
+if RULE_MODE == "skip":
+    cache_settings["rule_mode"] = RULE_MODE  # Skipped windows are stored as all-O
+    cache_settings["rules"] = rule_tagger.fingerprint()  # ... and which windows are skipped depends on the rules and bank
+prediction_cache = PredictionCache(model, tokenizer, model_path, cache_settings) if USE_PREDICTION_CACHE else None
 
 # Full workflow
 example = """
@@ -55,18 +43,19 @@ The decision was promulgated on March 12, 2015. According to Article 7 of the 19
 officials must uphold integrity and accountability. The case involved the Office of the Ombudsman and 
 several government agencies, including the Department of Justice (DOJ) and the Commission on Audit (COA).
 """
-processed_example = preprocess_text(example)
-chunks = split_text(processed_example, tokenizer, overlap=50)
-all_results = []
-for chunk in chunks:
-    ner_results = nlp(chunk)
-    all_results.extend(ner_results)
-chunked_results = manual_chunking(all_results)
-filtered_results = filter_entities(chunked_results)
+documents = [example]
+
+# Each document is tokenized once; its windows are batched with those of the other documents and
+# stitched back together, so Start/End are character offsets into the original document. Entity
+# spans are decoded for all documents at once, with BIO repair and the per-type thresholds applied.
+document_results = run_with_rules(
+    documents, model, tokenizer, rule_tagger, RULE_MODE, max_length=MAX_LENGTH, stride=WINDOW_STRIDE,
+    max_tokens=MAX_TOKENS_PER_BATCH, cache=prediction_cache, aggregation=AGGREGATION, thresholds=ENTITY_THRESHOLDS
+)
 
 # Write final results to a text file
 with open("ner_results.txt", "w", encoding="utf-8") as file:
-    for chunk in filtered_results:
-        file.write(f"Entity: {chunk['word']}, Label: {chunk['label']}, Probability: {chunk['score']:.2f}%, Start: {chunk['start']}, End: {chunk['end']}\n")
+    for entity in (entity for results in document_results for entity in results):
+        file.write(f"Entity: {entity['word']}, Label: {entity['entity_group']}, Probability: {entity['score'] * 100:.2f}%, Start: {entity['start']}, End: {entity['end']}\n")
 
 print("Results saved to ner_results.txt")
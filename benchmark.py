@@ -0,0 +1,227 @@
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import time
+
+import numpy as np
+
+# === CONFIG ===
+QUEUE_FOLDER = "queue"
+BATCH_SIZES = [1, 8, 32]  # Documents per batch
+THREAD_COUNTS = [1, 2, 4]
+REPORT_FILE = "benchmark.json"
+TOLERANCE = 0.10  # Relative slowdown vs the baseline that counts as a regression
+STAGES = ["parse", "tokenize", "forward", "align", "metrics"]
+
+
+# test-model.py can't be imported by name (hyphen), so load it from its path.
+# Its evaluation code lives behind a __main__ guard, so nothing runs on load.
+def load_test_model_script():
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-model.py")
+    spec = importlib.util.spec_from_file_location("test_model", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile_ms(latencies, q):
+    return round(float(np.percentile(latencies, q)) * 1000, 3) if latencies else None
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # bytes on macOS, KiB on Linux
+
+
+# One benchmark configuration, run in a fresh process so peak RSS and thread
+# settings belong to this configuration alone. Files are processed the way
+# test-model.py does it, batch_size files at a time; every file in a batch gets
+# the batch's wall time as its latency.
+def run_config(options):
+    import torch
+    from sklearn.metrics import classification_report
+    from transformers import AutoTokenizer
+
+    from iob_pack import read_document_sentences
+    from ner_backends import load_backend
+    from ner_eval import entity_confusion_matrix
+
+    torch.set_num_threads(options["threads"])
+    tm = load_test_model_script()
+    tm.model = load_backend(options["backend"], options["model"], options["threads"])
+    tm.tokenizer = AutoTokenizer.from_pretrained(options["model"])
+    tm.prediction_cache = None  # Measure the model, not the cache
+    tm.MAX_BATCH_SIZE = options["batch_size"]
+    tm.MAX_TOKENS_PER_BATCH = options["batch_size"] * tm.tokenizer.model_max_length
+    files = options["files"]
+    batch_size = options["batch_size"]
+
+    def process(batch_files, stage_times):
+        started = time.perf_counter()
+        sentences, labels = [], []
+        for file_path in batch_files:
+            file_tokens, file_labels = read_document_sentences(file_path)
+            sentences.extend(file_tokens)
+            labels.extend(file_labels)
+        parsed = time.perf_counter()
+        tokenized_inputs = tm.tokenizer(sentences, truncation=True, is_split_into_words=True)
+        tokenized = time.perf_counter()
+        predictions = tm.predict_sentences(tokenized_inputs, sentences)
+        predicted = time.perf_counter()
+        aligned = tm.align_predictions(predictions, tokenized_inputs)
+        done = time.perf_counter()
+
+        stage_times["parse"] += parsed - started
+        stage_times["tokenize"] += tokenized - parsed
+        stage_times["forward"] += predicted - tokenized
+        stage_times["align"] += done - predicted
+        n_subwords = sum(len(ids) for ids in tokenized_inputs["input_ids"])
+        return labels, aligned, n_subwords, done - started
+
+    batches = [files[i:i + batch_size] for i in range(0, len(files), batch_size)]
+    for batch_files in batches[:options["warmup"]]:
+        process(batch_files, dict.fromkeys(STAGES, 0.0))
+
+    stage_times = dict.fromkeys(STAGES, 0.0)
+    latencies = []
+    true_sentences, pred_sentences = [], []
+    n_tokens = n_subwords = 0
+    started = time.perf_counter()
+    for batch_files in batches:
+        labels, aligned, batch_subwords, elapsed = process(batch_files, stage_times)
+        latencies.extend([elapsed] * len(batch_files))
+        for true, pred in zip(labels, aligned):
+            length = min(len(true), len(pred))
+            true_sentences.append(true[:length])
+            pred_sentences.append(pred[:length])
+        n_tokens += sum(len(sentence) for sentence in labels)
+        n_subwords += batch_subwords
+
+    metrics_started = time.perf_counter()
+    if not options["skip_metrics"]:
+        from evaluate import load
+        load("seqeval").compute(predictions=pred_sentences, references=true_sentences)
+        flat_true = [label for sentence in true_sentences for label in sentence]
+        flat_pred = [label for sentence in pred_sentences for label in sentence]
+        classification_report(flat_true, flat_pred, digits=4, zero_division=0)
+        entity_confusion_matrix(flat_true, flat_pred)
+    stage_times["metrics"] = time.perf_counter() - metrics_started
+    wall = time.perf_counter() - started
+
+    return {
+        "batch_size": batch_size,
+        "threads": options["threads"],
+        "documents": len(files),
+        "wall_s": round(wall, 4),
+        "docs_per_sec": round(len(files) / wall, 3),
+        "tokens_per_sec": round(n_tokens / wall, 1),
+        "subwords_per_sec": round(n_subwords / wall, 1),
+        "latency_ms": {f"p{q}": percentile_ms(latencies, q) for q in (50, 95, 99)},
+        "stages_s": {stage: round(seconds, 4) for stage, seconds in stage_times.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# Compare each configuration against the baseline run with the same batch size
+# and thread count; returns human-readable regression messages
+def compare_to_baseline(report, baseline, tolerance=TOLERANCE):
+    baseline_runs = {(run["batch_size"], run["threads"]): run for run in baseline["runs"]}
+    regressions = []
+    for run in report["runs"]:
+        old = baseline_runs.get((run["batch_size"], run["threads"]))
+        if old is None:
+            continue
+        name = f"batch {run['batch_size']}, {run['threads']} threads"
+        checks = [
+            ("docs/s", old["docs_per_sec"], run["docs_per_sec"], True),
+            ("p95 latency", old["latency_ms"]["p95"], run["latency_ms"]["p95"], False),
+            ("peak RSS", old["peak_rss_mb"], run["peak_rss_mb"], False),
+        ]
+        for metric, before, after, higher_is_better in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            marker = "❌" if worse > tolerance else "✅"
+            print(f"{marker} {name}: {metric} {before} → {after} ({change:+.1%})")
+            if worse > tolerance:
+                regressions.append(f"{name}: {metric} {before} → {after} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    from iob_pack import list_documents
+    from ner_backends import BACKEND_PATHS
+
+    parser = argparse.ArgumentParser(description="Benchmark NER evaluation throughput and latency over an .iob folder or packed corpus.")
+    parser.add_argument("--folder", default=QUEUE_FOLDER)
+    parser.add_argument("--backend", default="torch", choices=sorted(BACKEND_PATHS))
+    parser.add_argument("--model", default=None, help="Model folder (default: the backend's usual location)")
+    parser.add_argument("--batch-sizes", default=",".join(map(str, BATCH_SIZES)))
+    parser.add_argument("--threads", default=",".join(map(str, THREAD_COUNTS)))
+    parser.add_argument("--max-docs", type=int, default=None, help="Only use the first N files")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed batches before each measurement")
+    parser.add_argument("--skip-metrics", action="store_true")
+    parser.add_argument("--output", default=REPORT_FILE)
+    parser.add_argument("--baseline", default=None, help="Earlier report to compare against")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    files = sorted(list_documents(args.folder))
+    files = files[:args.max_docs] if args.max_docs else files
+    model_path = args.model or BACKEND_PATHS[args.backend]
+    configs = [
+        (int(batch_size), int(threads))
+        for batch_size in args.batch_sizes.split(",") for threads in args.threads.split(",")
+    ]
+    print(f"⏱️ Benchmarking {len(files)} files from '{args.folder}' with {args.backend} ({model_path})")
+
+    import torch
+    import transformers
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "transformers": transformers.__version__,
+            "cpu_count": os.cpu_count(),
+            "backend": args.backend,
+            "model": model_path,
+        },
+        "corpus": {"folder": args.folder, "documents": len(files)},
+        "runs": [],
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for batch_size, threads in configs:
+        options = {
+            "files": files, "backend": args.backend, "model": model_path, "batch_size": batch_size,
+            "threads": threads, "warmup": args.warmup, "skip_metrics": args.skip_metrics,
+        }
+        with context.Pool(1) as pool:
+            run = pool.apply(run_config, (options,))
+        report["runs"].append(run)
+        print(f"🔹 batch {batch_size:>3}, {threads} threads: {run['docs_per_sec']:.2f} docs/s, "
+              f"{run['tokens_per_sec']:.0f} tokens/s, p95 {run['latency_ms']['p95']} ms, "
+              f"peak RSS {run['peak_rss_mb']} MB, stages {run['stages_s']}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"✅ Benchmark report saved to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%} vs {args.baseline}")
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.tolerance:.0%} vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
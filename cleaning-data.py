@@ -1,40 +1,39 @@
 import json
 import os
 import re
+from bisect import bisect_left
+from itertools import islice
+from multiprocessing import Pool
+
+from queue_manifest import file_hash, load_manifest, output_stat, save_manifest, text_hash
 
 # Define input and output folders
 input_folder = "raw_data"  # Folder containing raw JSONL files
 output_folder = "queue"  # Folder to save cleaned IOB files
 error_log_folder = "error_logs"  # Folder to save error logs
+progress_interval = 100  # Report progress every N entries per file
+workers = 1  # Set above 1 to convert entries in a process pool; output is identical to the serial run
+chunk_size = 64  # JSONL lines handed to a worker at a time
+incremental = True  # Only rewrite outputs whose source record changed (tracked in queue_manifest.json)
 
-# Ensure output directories exist
-os.makedirs(output_folder, exist_ok=True)
-os.makedirs(error_log_folder, exist_ok=True)
+CONVERTER_VERSION = 2  # Bump whenever a change here would change the .iob output
+REUSED = "reused"  # Marker for records whose existing output can be kept (compare with ==; it crosses processes)
 
-# Clear the error logs folder before starting
-for error_file in os.listdir(error_log_folder):
-    error_file_path = os.path.join(error_log_folder, error_file)
-    if os.path.isfile(error_file_path):
-        os.remove(error_file_path)  # Delete the file
-print("🗑️ Cleared error logs before starting data cleaning.")
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")  # Splits words and punctuation separately
 
 # Function to tokenize text and calculate token offsets
 def tokenize_with_offsets(text):
-    tokens = re.findall(r"\w+|[^\w\s]", text)  # Splits words and punctuation separately
-    token_offsets = []
-    start = 0
-
-    for token in tokens:
-        start = text.find(token, start)  # Find token's exact start position
-        token_offsets.append((start, start + len(token)))
-        start += len(token)  # Move start index forward
-
+    tokens, token_offsets = [], []
+    for match in TOKEN_PATTERN.finditer(text):
+        tokens.append(match.group())
+        token_offsets.append((match.start(), match.end()))
     return tokens, token_offsets
 
 # Function to convert JSONL annotations to IOB format
 def jsonl_to_iob(data):
     text = data["text"]
     tokens, token_offsets = tokenize_with_offsets(text)
+    token_starts = [start for start, _ in token_offsets]
     iob_tags = ['O'] * len(tokens)
 
     # Extract labels from different possible formats
@@ -49,114 +48,234 @@ def jsonl_to_iob(data):
                 continue  # Skip malformed entities
             labels.append([entity["start_offset"], entity["end_offset"], entity["label"]])
 
-    # Assign IOB tags based on extracted labels
+    # Assign IOB tags based on extracted labels. Tokens are sorted and don't overlap, so the tokens
+    # inside a span are a contiguous run starting at the first token that begins at or after it.
     for start_offset, end_offset, label in labels:
-        for i, (token_start, token_end) in enumerate(token_offsets):
-            if token_start >= start_offset and token_end <= end_offset:
-                if token_start == start_offset:
-                    iob_tags[i] = f'B-{label}'
-                else:
-                    iob_tags[i] = f'I-{label}'
+        i = bisect_left(token_starts, start_offset)
+        while i < len(tokens) and token_offsets[i][1] <= end_offset:
+            iob_tags[i] = f'B-{label}' if token_starts[i] == start_offset else f'I-{label}'
+            i += 1
 
     # Combine tokens and IOB tags
     iob_lines = [f"{token}\t{tag}" for token, tag in zip(tokens, iob_tags)]
     return iob_lines
 
-# Process each file in the input folder
-print(f"🔍 Checking for JSONL files in: {input_folder}")
-files = os.listdir(input_folder)
-print(f"📂 Found {len(files)} files: {files}")
-
-for filename in files:
-    if filename.endswith(".jsonl"):
-        print(f"📄 Processing file: {filename}")  # Ensure we're detecting JSONL files
-        
-        input_file = os.path.join(input_folder, filename)
-        base_filename = os.path.splitext(filename)[0]  # Remove extension for naming cleaned files
-        error_log_file = os.path.join(error_log_folder, f"{base_filename}_errors.log")
-        valid_entries = []  # Store cleaned data entries separately
-        errors = []  # Store errors
-        total_processed = 0
-        total_errors = 0
-
-        with open(input_file, "r", encoding="utf-8") as file:
-            for i, line in enumerate(file):
-                try:
-                    total_processed += 1
-                    print(f"🔄 Processing entry {total_processed} in {filename}...")  # Progress tracking
-
-                    data = json.loads(line.strip())  # Parse JSON
-                    
-                    # Validate the structure
-                    if "text" not in data:
-                        error_msg = f"Line {i+1}: Missing 'text'."
-                        errors.append(error_msg)
-                        total_errors += 1
-                        print(f"❌ {error_msg}")  # Print errors live
-                        continue
-
-                    # Extract labels from different possible formats
-                    labels = []
-                    if "label" in data:
-                        labels = data["label"]
-                    elif "labels" in data:
-                        labels = data["labels"]
-                    elif "entities" in data:
-                        labels = []
-                        for entity in data["entities"]:
-                            if not isinstance(entity, dict) or not all(k in entity for k in ["start_offset", "end_offset", "label"]):
-                                error_msg = f"Line {i+1}: Invalid entity format {entity}. Expected dictionary with 'start_offset', 'end_offset', and 'label'."
-                                errors.append(error_msg)
-                                total_errors += 1
-                                print(f"❌ {error_msg}")  # Print errors live
-                                continue
-                            labels.append([entity["start_offset"], entity["end_offset"], entity["label"]])
-
-                    # Validate labels
-                    for label in labels:
-                        if not isinstance(label, (list, tuple)) or len(label) != 3:
-                            error_msg = f"Line {i+1}: Invalid label format {label}. Expected [start, end, label]."
-                            errors.append(error_msg)
-                            total_errors += 1
-                            print(f"❌ {error_msg}")  # Print errors live
-                            continue
-                    
-                    # Convert to IOB format
-                    iob_lines = jsonl_to_iob({"text": data["text"], "label": labels})
-                    valid_entries.append(iob_lines)
-
-                    print(f"✅ Done processing entry {total_processed} in {filename}")  # ✅ Logging when an entry is successfully processed
-                
-                except json.JSONDecodeError:
-                    error_msg = f"Line {i+1}: Invalid JSON format."
-                    errors.append(error_msg)
-                    total_errors += 1
-                    print(f"❌ {error_msg}")  # Print errors live
-
-        # Save each cleaned entry in a separate IOB file
-        for index, iob_lines in enumerate(valid_entries, start=1):
-            output_file = os.path.join(output_folder, f"{base_filename}_{index}.iob")
-            with open(output_file, "w", encoding="utf-8") as file:
-                file.write("\n".join(iob_lines) + "\n\n")  # Add a blank line between documents
-        
-        # Save error logs (if any)
-        if errors:
-            with open(error_log_file, "w", encoding="utf-8") as file:
-                for error in errors:
-                    file.write(error + "\n")
-
-        # Count total cleaned data 
-        total_cleaned_count = len(os.listdir(output_folder))
-
-        # Summary for this file
-        print("--------------------------------------------------\n")        
-        print(f"📊 Summary for {filename}:")
-        print(f"   - Total Entries Processed: {total_processed}")
-        print(f"   - Successful Conversions: {len(valid_entries)}")
-        print(f"   - Errors Found: {total_errors}")
-        print(f"✅ Finished processing {filename}")
-        print("--------------------------------------------------\n")
-
-        # Summary for cleaned_data folder
-        print(f"📊 Total Cleaned Data: {total_cleaned_count}")
-        print("--------------------------------------------------\n")
+# Validate and convert one JSONL line. Returns the IOB lines (None if the entry
+# is skipped) and the error messages for the line.
+def convert_line(i, line):
+    errors = []
+    try:
+        data = json.loads(line.strip())  # Parse JSON
+    except json.JSONDecodeError:
+        return None, [f"Line {i+1}: Invalid JSON format."]
+
+    # Validate the structure
+    if "text" not in data:
+        return None, [f"Line {i+1}: Missing 'text'."]
+
+    # Extract labels from different possible formats
+    labels = []
+    if "label" in data:
+        labels = data["label"]
+    elif "labels" in data:
+        labels = data["labels"]
+    elif "entities" in data:
+        for entity in data["entities"]:
+            if not isinstance(entity, dict) or not all(k in entity for k in ["start_offset", "end_offset", "label"]):
+                errors.append(f"Line {i+1}: Invalid entity format {entity}. Expected dictionary with 'start_offset', 'end_offset', and 'label'.")
+                continue
+            labels.append([entity["start_offset"], entity["end_offset"], entity["label"]])
+
+    # Validate labels; invalid ones are logged and left out of the conversion
+    valid_labels = []
+    for label in labels:
+        if not isinstance(label, (list, tuple)) or len(label) != 3:
+            errors.append(f"Line {i+1}: Invalid label format {label}. Expected [start, end, label].")
+            continue
+        valid_labels.append(label)
+
+    # Convert to IOB format
+    return jsonl_to_iob({"text": data["text"], "label": valid_labels}), errors
+
+# Worker task: convert a chunk of (line number, line, known) triples. Lines whose
+# content is already known from the manifest are not converted again.
+def convert_chunk(chunk):
+    return [(REUSED, []) if known else convert_line(i, line) for i, line, known in chunk]
+
+# (line number, line, record hash, IOB lines or REUSED, errors) for every line in
+# file order. With a pool, chunks are converted in parallel a wave at a time (so
+# memory stays bounded) and their results come back in order.
+def converted_lines(file, pool, known_hashes):
+    numbered = ((i, line, text_hash(line.strip())) for i, line in enumerate(file))
+    if pool is None:
+        for i, line, record_hash in numbered:
+            iob_lines, errors = (REUSED, []) if record_hash in known_hashes else convert_line(i, line)
+            yield i, line, record_hash, iob_lines, errors
+        return
+    while True:
+        wave = list(islice(numbered, chunk_size * workers * 4))
+        if not wave:
+            return
+        chunks = [
+            [(i, line, record_hash in known_hashes) for i, line, record_hash in wave[k:k + chunk_size]]
+            for k in range(0, len(wave), chunk_size)
+        ]
+        results = [result for chunk_results in pool.map(convert_chunk, chunks) for result in chunk_results]
+        for (i, line, record_hash), (iob_lines, errors) in zip(wave, results):
+            yield i, line, record_hash, iob_lines, errors
+
+# Convert one JSONL file, writing each entry's IOB file as soon as it is converted.
+# Output files are numbered in line order, so every run produces the same names.
+# An output is left untouched when the manifest shows it was written from the same
+# record by the same converter version; outputs the file no longer produces are deleted.
+def convert_file(filename, manifest, pool=None):
+    input_file = os.path.join(input_folder, filename)
+    base_filename = os.path.splitext(filename)[0]  # Remove extension for naming cleaned files
+    error_log_file = os.path.join(error_log_folder, f"{base_filename}_errors.log")
+    error_log = None  # Opened on the first error
+    total_processed = 0
+    total_converted = 0
+    total_reused = 0
+    total_errors = 0
+
+    previous_outputs = manifest["sources"].get(filename, {}).get("outputs", [])
+    known_hashes = {
+        manifest["outputs"][name]["record_hash"] for name in previous_outputs if name in manifest["outputs"]
+    } if incremental else set()
+    outputs = []
+
+    with open(input_file, "r", encoding="utf-8") as file:
+        for i, line, record_hash, iob_lines, errors in converted_lines(file, pool, known_hashes):
+            total_processed += 1
+            if total_processed % progress_interval == 0:
+                print(f"🔄 {filename}: {total_processed} entries processed ({total_errors} errors)")
+
+            if iob_lines == REUSED:
+                name = f"{base_filename}_{len(outputs) + 1}.iob"
+                entry = manifest["outputs"].get(name)
+                if entry is not None and entry["record_hash"] == record_hash and os.path.exists(os.path.join(output_folder, name)):
+                    errors = entry["errors"]
+                else:
+                    iob_lines, errors = convert_line(i, line)  # Known record that moved to a new position
+
+            # Worker errors are merged into the file's log in line order
+            for error_msg in errors:
+                if error_log is None:
+                    error_log = open(error_log_file, "w", encoding="utf-8")
+                error_log.write(error_msg + "\n")
+                print(f"❌ {error_msg}")  # Print errors live
+            total_errors += len(errors)
+
+            if iob_lines is None:
+                continue
+            name = f"{base_filename}_{len(outputs) + 1}.iob"
+            outputs.append(name)
+            if iob_lines == REUSED:
+                total_reused += 1
+                continue
+
+            # Save each cleaned entry in its own file right away
+            total_converted += 1
+            output_file = os.path.join(output_folder, name)
+            content = "\n".join(iob_lines) + "\n\n"  # Add a blank line between documents
+            # Replaced, not rewritten in place: split_balance.py hard-links queue files into train_data/
+            tmp_file = f"{output_file}.tmp{os.getpid()}"
+            with open(tmp_file, "w", encoding="utf-8") as out:
+                out.write(content)
+            os.replace(tmp_file, output_file)
+            manifest["outputs"][name] = {
+                "source": filename, "record_hash": record_hash, "errors": errors, **output_stat(output_file, content)
+            }
+
+    if error_log is not None:
+        error_log.close()
+    elif os.path.exists(error_log_file):
+        os.remove(error_log_file)  # Errors from an earlier run are fixed
+
+    remove_outputs([name for name in previous_outputs if name not in set(outputs)], manifest)
+    manifest["sources"][filename] = {"file_hash": file_hash(input_file), "outputs": outputs}
+    return total_processed, total_converted, total_reused, total_errors
+
+# Delete outputs that no source produces anymore
+def remove_outputs(names, manifest):
+    for name in names:
+        output_file = os.path.join(output_folder, name)
+        if os.path.exists(output_file):
+            os.remove(output_file)
+            print(f"🗑️ Removed orphaned {name}")
+        manifest["outputs"].pop(name, None)
+
+def main():
+    # Ensure output directories exist
+    os.makedirs(output_folder, exist_ok=True)
+    os.makedirs(error_log_folder, exist_ok=True)
+
+    manifest = load_manifest()
+    if manifest["converter_version"] != CONVERTER_VERSION:
+        manifest["converter_version"] = CONVERTER_VERSION
+        # Older outputs can't be trusted. Their names are kept until the end of a complete run,
+        # when the ones this version didn't write again are removed.
+        manifest["stale_outputs"] = sorted(set(manifest.get("stale_outputs", [])).union(manifest["outputs"]))
+        manifest["sources"], manifest["outputs"] = {}, {}
+
+    if not incremental:
+        # Clear the error logs folder before starting
+        for error_file in os.listdir(error_log_folder):
+            error_file_path = os.path.join(error_log_folder, error_file)
+            if os.path.isfile(error_file_path):
+                os.remove(error_file_path)  # Delete the file
+        print("🗑️ Cleared error logs before starting data cleaning.")
+
+    # Process each file in the input folder
+    print(f"🔍 Checking for JSONL files in: {input_folder}")
+    files = os.listdir(input_folder)
+    print(f"📂 Found {len(files)} files: {files}")
+
+    # Sources that disappeared from the input folder take their outputs and error log with them
+    for filename in [name for name in manifest["sources"] if name not in files]:
+        remove_outputs(manifest["sources"].pop(filename)["outputs"], manifest)
+        error_log_file = os.path.join(error_log_folder, f"{os.path.splitext(filename)[0]}_errors.log")
+        if os.path.exists(error_log_file):
+            os.remove(error_log_file)
+
+    pool = Pool(workers) if workers > 1 else None
+    try:
+        for filename in files:
+            if filename.endswith(".jsonl"):
+                source = manifest["sources"].get(filename)
+                if incremental and source is not None and source["file_hash"] == file_hash(os.path.join(input_folder, filename)) \
+                        and all(os.path.exists(os.path.join(output_folder, name)) for name in source["outputs"]):
+                    print(f"⏭️ Unchanged, skipping: {filename}")
+                    continue
+
+                print(f"📄 Processing file: {filename}")  # Ensure we're detecting JSONL files
+                total_processed, total_converted, total_reused, total_errors = convert_file(filename, manifest, pool)
+                save_manifest(manifest)
+
+                # Count total cleaned data
+                total_cleaned_count = len(os.listdir(output_folder))
+
+                # Summary for this file
+                print("--------------------------------------------------\n")
+                print(f"📊 Summary for {filename}:")
+                print(f"   - Total Entries Processed: {total_processed}")
+                print(f"   - Successful Conversions: {total_converted}")
+                print(f"   - Unchanged Outputs Kept: {total_reused}")
+                print(f"   - Errors Found: {total_errors}")
+                print(f"✅ Finished processing {filename}")
+                print("--------------------------------------------------\n")
+
+                # Summary for cleaned_data folder
+                print(f"📊 Total Cleaned Data: {total_cleaned_count}")
+                print("--------------------------------------------------\n")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Outputs of an older converter version that no source produces anymore
+    remove_outputs([name for name in manifest.pop("stale_outputs", []) if name not in manifest["outputs"]], manifest)
+    save_manifest(manifest)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+from collections import Counter
+from multiprocessing import Pool
+
+import numpy as np
+
+from iob_format import LABELS, count_labels, entity_spans, format_iob, parse_iob_text
+from iob_pack import list_documents, read_document, split_document_path
+from queue_manifest import text_hash
+
+CACHE_DIR = ".cache/stats"
+CACHE_VERSION = 3  # Bump when what is stored per file changes
+MAX_CACHE_BYTES = 256 * 1024 * 1024  # Least recently used entries are evicted past this size
+LOW_WATER = 0.9  # ... down to this share of it, so eviction doesn't run again on the next write
+MAX_LENGTH = 512  # Model input limit, special tokens included
+
+# Entity types the tallies report, with the names count.py and split_balance.py always used (CNS excluded)
+ENTITY_KEYS = {
+    'CASE_NUM': 'case_nums', 'PERSON': 'persons', 'INS': 'institutions',
+    'PROM_DATE': 'prom_dates', 'RA': 'republic_acts', 'STA': 'statutes',
+}
+
+# Everything known about one file comes from a single read of it:
+#   tokens, sentences       sizes
+#   sentence_tokens         tokens per sentence (a sentence is one model input sequence)
+#   entities                B- tag count per type (CNS included), what count.py and split_balance.py always counted
+#   spans                   decoded entity count per type, which also counts I- runs without a B- tag
+#   span_lengths            per type, how many spans are 1, 2, 3, ... tokens long ([0, n1, n2, ...])
+#   case_number             the decision's caption case number (see caption_case_number)
+#   sentence_subwords       subwords per sentence, without special tokens (only with a tokenizer)
+
+
+# The decision's own case number (the first CASE_NUM, from the caption) with spacing and punctuation
+# dropped, so two annotations of the same decision get the same key; None if there is no case number
+def caption_case_number(document, spans=None):
+    for entity_type, start, stop in spans if spans is not None else entity_spans(document):
+        if entity_type == 'CASE_NUM':
+            return re.sub(r'\W', '', ''.join(document.tokens(start, stop))).upper()
+    return None
+
+
+def document_stats(document, tokenizer=None):
+    spans = entity_spans(document)
+    types = [entity_type for entity_type, _, _ in spans]
+    lengths = np.array([stop - start for _, start, stop in spans], dtype=np.int64)
+    label_counts = count_labels(document).tolist()
+    stats = {
+        'tokens': len(document),
+        'sentences': document.num_sentences,
+        'sentence_tokens': np.diff(document.sentence_starts).tolist(),
+        'entities': {LABELS[i][2:]: n for i, n in enumerate(label_counts) if n and LABELS[i].startswith("B-")},
+        'spans': dict(Counter(types)),
+        'span_lengths': {
+            entity_type: np.bincount(lengths[[t == entity_type for t in types]]).tolist() for entity_type in set(types)
+        },
+        'case_number': caption_case_number(document, spans),
+    }
+    if tokenizer is not None:
+        sentences = document.token_lists()
+        encodings = tokenizer(sentences, is_split_into_words=True, add_special_tokens=False, verbose=False) if sentences else {'input_ids': []}
+        stats['sentence_subwords'] = [len(ids) for ids in encodings['input_ids']]
+    return stats
+
+
+# B- tag counts of one file's stats under the ENTITY_KEYS names
+def entity_tally(stats):
+    return {key: stats['entities'].get(entity_type, 0) for entity_type, key in ENTITY_KEYS.items()}
+
+
+_tokenizer = None
+_entries_dir = None  # Where cache entries are looked up and written; None without the cache
+
+
+def _init_worker(tokenizer_path, entries_dir=None):
+    global _tokenizer, _entries_dir
+    _entries_dir = entries_dir
+    _tokenizer = None
+    if tokenizer_path:
+        from transformers import AutoTokenizer
+        _tokenizer = AutoTokenizer.from_pretrained(tokenizer_path)
+
+
+# Content hash (see iob_pack.document_hash) and a loader for the document, from
+# one read of the file; a plain file is only parsed if its stats aren't cached
+def _hashed_document(path):
+    if split_document_path(path) is not None:
+        document = read_document(path)
+        return text_hash(format_iob(document.sentences())), lambda: document
+    with open(path, "rb") as f:
+        data = f.read()
+    text = data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")  # Newlines as read_iob reads them
+    return hashlib.sha256(data).hexdigest(), lambda: parse_iob_text(text, source=path)
+
+
+# Stats of one file, and whether a cache entry was written for it
+def _file_stats(path):
+    content_hash, load = _hashed_document(path)
+    entry_path = _entries_dir and os.path.join(_entries_dir, f"{content_hash}.json")
+    if entry_path:
+        try:
+            with open(entry_path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+            os.utime(entry_path)  # Recently used
+            return stats, False
+        except (FileNotFoundError, ValueError):
+            pass
+
+    stats = document_stats(load(), _tokenizer)
+    if entry_path:
+        os.makedirs(_entries_dir, exist_ok=True)
+        tmp_path = f"{entry_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, entry_path)
+    return stats, bool(entry_path)
+
+
+def _settings_key(tokenizer):
+    parts = [str(CACHE_VERSION)]
+    if tokenizer is not None:
+        from prediction_cache import tokenizer_fingerprint
+        parts.append(tokenizer_fingerprint(tokenizer))
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+# Stats of many documents (plain, packed or listed paths), in path order. Every
+# file's stats are cached as one small JSON entry per content hash (and
+# tokenizer). Each file is read once, by one of `workers` processes, which
+# hashes it and only parses it if there is no entry for that hash yet. Reading
+# an entry marks it as recently used; once the cache grows past max_bytes the
+# least recently used entries go first, until it is down to LOW_WATER of max_bytes.
+def collect_stats(paths, tokenizer_path=None, workers=1, use_cache=True, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    global _entries_dir
+    _init_worker(tokenizer_path)
+    _entries_dir = entries_dir = os.path.join(cache_dir, _settings_key(_tokenizer)) if use_cache else None
+    if workers > 1 and len(paths) > 1:
+        with Pool(min(workers, len(paths)), initializer=_init_worker, initargs=(tokenizer_path, entries_dir)) as pool:
+            results = pool.map(_file_stats, paths, chunksize=max(1, len(paths) // (4 * workers)))
+    else:
+        results = [_file_stats(path) for path in paths]
+    if any(written for _, written in results):
+        evict(cache_dir, max_bytes)
+    return [stats for stats, _ in results]
+
+
+# Drop least recently used entries (of any tokenizer or cache version) until the cache is down to LOW_WATER of max_bytes
+def evict(cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+    entries = sorted(
+        (entry for folder, _, _ in os.walk(cache_dir) for entry in os.scandir(folder)
+         if entry.is_file() and ".tmp" not in entry.name),
+        key=lambda entry: entry.stat().st_mtime
+    )
+    total_bytes = sum(entry.stat().st_size for entry in entries)
+    if total_bytes <= max_bytes:
+        return
+    for entry in entries:
+        if total_bytes <= max_bytes * LOW_WATER:
+            break
+        try:
+            size = entry.stat().st_size
+            os.remove(entry.path)
+        except FileNotFoundError:
+            continue  # Evicted by another process
+        total_bytes -= size
+
+
+def describe(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return {'count': 0}
+    p50, p90, p99 = np.percentile(values, [50, 90, 99])
+    return {
+        'count': len(values), 'min': int(values.min()), 'mean': round(float(values.mean()), 2),
+        'p50': round(float(p50), 2), 'p90': round(float(p90), 2), 'p99': round(float(p99), 2), 'max': int(values.max()),
+    }
+
+
+# Subwords of every sentence past what fits in one max_length input (what truncation loses)
+def truncated_subwords(sentence_subwords, max_length=MAX_LENGTH):
+    return int(np.maximum(np.asarray(sentence_subwords, dtype=np.int64) - (max_length - 2), 0).sum())
+
+
+# One file's stats without the per-sentence lists, for per-file reports
+def file_summary(stats, max_length=MAX_LENGTH):
+    summary = {key: stats[key] for key in ('tokens', 'sentences', 'entities', 'spans', 'case_number')}
+    if 'sentence_subwords' in stats:
+        subwords = sum(stats['sentence_subwords'])
+        summary['subwords'] = subwords
+        summary['beyond_max_length'] = round(truncated_subwords(stats['sentence_subwords'], max_length) / max(subwords, 1), 4)
+    return summary
+
+
+# Corpus-level report over many files' stats
+def summarize(all_stats, max_length=MAX_LENGTH):
+    entities, spans, span_lengths = Counter(), Counter(), {}
+    for stats in all_stats:
+        entities.update(stats['entities'])
+        spans.update(stats['spans'])
+        for entity_type, histogram in stats['span_lengths'].items():
+            total = span_lengths.setdefault(entity_type, np.zeros(0, dtype=np.int64))
+            if len(histogram) > len(total):
+                total = np.pad(total, (0, len(histogram) - len(total)))
+            total[:len(histogram)] += histogram
+            span_lengths[entity_type] = total
+
+    summary = {
+        'files': len(all_stats),
+        'tokens': sum(stats['tokens'] for stats in all_stats),
+        'sentences': sum(stats['sentences'] for stats in all_stats),
+        'entities': dict(sorted(entities.items())),
+        'tally': {key: entities.get(entity_type, 0) for entity_type, key in ENTITY_KEYS.items()},
+        'spans': dict(sorted(spans.items())),
+        'span_lengths': {entity_type: span_lengths[entity_type].tolist() for entity_type in sorted(span_lengths)},
+        'document_tokens': describe([stats['tokens'] for stats in all_stats]),
+        'sentence_tokens': describe([n for stats in all_stats for n in stats['sentence_tokens']]),
+    }
+    if all_stats and all('sentence_subwords' in stats for stats in all_stats):
+        document_subwords = np.array([sum(stats['sentence_subwords']) for stats in all_stats])
+        sentence_subwords = np.array([n for stats in all_stats for n in stats['sentence_subwords']], dtype=np.int64)
+        truncated = np.array([truncated_subwords(stats['sentence_subwords'], max_length) for stats in all_stats])
+        summary['document_subwords'] = describe(document_subwords)
+        summary['sentence_subwords'] = describe(sentence_subwords)
+        summary['beyond_max_length'] = {
+            'max_length': max_length,
+            'documents': round(float((truncated > 0).mean()), 4),  # Share of documents with a sentence that doesn't fit
+            'sentences': round(float((sentence_subwords > max_length - 2).mean()), 4) if len(sentence_subwords) else 0.0,
+            'subwords': round(float(truncated.sum() / max(document_subwords.sum(), 1)), 4),  # Share of all subwords
+        }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Corpus statistics for .iob folders, packed corpora or document lists, as JSON.")
+    parser.add_argument("corpora", nargs="+", help="One or more corpora, e.g. train_data/train train_data/eval train_data/test")
+    parser.add_argument("--tokenizer", help="Tokenizer (model folder or hub id) for subword statistics, e.g. ./bert-legal-ner")
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--per-file", action="store_true", help="Also report every file")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--output", help="Write the JSON here instead of to stdout")
+    args = parser.parse_args()
+
+    report = {'settings': {'tokenizer': args.tokenizer, 'max_length': args.max_length}, 'corpora': {}}
+    everything, files = [], {}
+    for corpus in args.corpora:
+        paths = sorted(list_documents(corpus))
+        all_stats = collect_stats(paths, args.tokenizer, args.workers, not args.no_cache)
+        report['corpora'][corpus] = summarize(all_stats, args.max_length)
+        everything.extend(all_stats)
+        if args.per_file:
+            files.update((path, file_summary(stats, args.max_length)) for path, stats in zip(paths, all_stats))
+    if len(args.corpora) > 1:
+        report['total'] = summarize(everything, args.max_length)
+    if args.per_file:
+        report['files'] = files
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📊 Statistics for {len(everything)} files saved to {args.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,31 @@
-import os 
+import os
+import sys
 
-def count_in_file(file_path):
-    # init counters
+from corpus_stats import ENTITY_KEYS, collect_stats, entity_tally
+from iob_pack import is_list, is_pack, list_documents
 
-    counters = {
-        'case_nums': 0,
-        'persons': 0,
-        'institutions': 0,
-        'prom_dates': 0,
-        'republic_acts': 0,
-        'statutes': 0,
-    }
-
-    # map from entity class to counter key
-    entity_map = {
-        'CASE_NUM': 'case_nums',
-        'PERSON': 'persons',
-        'INS': 'institutions',
-        'PROM_DATE': 'prom_dates',
-        'RA': 'republic_acts',
-        'STA': 'statutes',
-    }
-
-    # check if currently inside an entity
-    inside_entity = {key: False for key in entity_map.keys()}
-
-    with open(file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            parts = line.strip().split()
-            if len(parts) < 2:
-                continue
-
-            token, tag = parts
-
-            for entity_type in entity_map:
-                if tag == f'B-{entity_type}':
-                    counters[entity_map[entity_type]] += 1
-                    inside_entity[entity_type] = True
-                elif tag != f'I-{entity_type}':
-                    inside_entity[entity_type] = False
-
-    return counters
+WORKERS = os.cpu_count() or 1  # Files not in .cache/stats yet are read by this many processes
+# For distributions, span lengths and subword counts as JSON, see corpus_stats.py
 
+# Entity counts of every .iob file in a folder (or packed corpus, or document list), read once and cached
 def tally_folder(folder_path):
-    file_count = 0
-    file_total = {}
-    combined_totals = {
-        'case_nums': 0,
-        'persons': 0,
-        'institutions': 0,
-        'prom_dates': 0,
-        'republic_acts': 0,
-        'statutes': 0,
+    paths = sorted(list_documents(folder_path))
+    file_total = {
+        os.path.basename(path): entity_tally(stats) for path, stats in zip(paths, collect_stats(paths, workers=WORKERS))
     }
-
-    for filename in os.listdir(folder_path):
-
-        file_count +=1
-
-        if filename.endswith('.iob'): 
-            file_path = os.path.join(folder_path, filename)
-            counts = count_in_file(file_path)
-            file_total[filename] = counts
-
-        # get totals
-        for key in combined_totals:
-            combined_totals[key] += counts.get(key, 0)
-
-    return file_total, combined_totals, file_count
+    combined_totals = {key: sum(counts[key] for counts in file_total.values()) for key in ENTITY_KEYS.values()}
+    return file_total, combined_totals, len(file_total)
 
 # main
 if __name__ == "__main__":
 
     while True:
-        folder = input("Folder name: ").strip()
+        # python count.py <folder> runs once, without asking
+        folder = sys.argv[1] if len(sys.argv) > 1 else input("Folder name: ").strip()
 
-        if not os.path.isdir(folder):
+        if not (os.path.isdir(folder) or is_pack(folder) or is_list(folder)):
+            if len(sys.argv) > 1:
+                sys.exit(f"Folder not found: {folder}")
             print("Folder not found or invalid input. Please try again.\n")
             continue
 
@@ -92,5 +42,8 @@ if __name__ == "__main__":
         print("\n\n")
         print(f"\"{folder}\" Summary:")
         for entity, count in summary.items():
-            print(f" {entity}: {count}")  
-        print(f"\nNum of Files tallied: {totalfiles}")
\ No newline at end of file
+            print(f" {entity}: {count}")
+        print(f"\nNum of Files tallied: {totalfiles}")
+
+        if len(sys.argv) > 1:
+            break
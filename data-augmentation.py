@@ -1,72 +1,63 @@
 import os
-import random
-from collections import defaultdict
+from multiprocessing import Pool
 from pathlib import Path
 
+from iob_augment import SEED, SpanBank, augment_document, is_original
+from iob_format import read_iob, write_document
+from queue_manifest import folder_digest, load_manifest, mark_step_done, step_is_current
+
 # === CONFIG ===
 TRAIN_FOLDER = "queue"
 AUG_PER_FILE = 2  # All files now use the same count
+STEP_NAME = "data-augmentation"  # Key in queue_manifest.json
+WORKERS = 1  # Set above 1 to write the augmented files from a process pool; the files are the same either way
+# fine-tuning.py can instead make the same variants in memory (STREAM_AUGMENTATION), with no files at all
 
 # === STEP 1: COLLECT ENTITY BANK FROM TRAINING FILES (excluding CNS) ===
+# One pass over the originals; entities are kept as whole spans, keyed by type and length
 def extract_entities_from_files(folder):
-    entity_bank = defaultdict(set)
-    for filename in os.listdir(folder):
-        if not filename.endswith(".iob"):
-            continue
-        with open(os.path.join(folder, filename), "r", encoding="utf-8") as f:
-            for line in f:
-                if line.strip() == "":
-                    continue
-                parts = line.strip().split()
-                if len(parts) != 2:
-                    continue
-                token, label = parts
-                if label.startswith("B-") or label.startswith("I-"):
-                    entity_type = label.split("-")[1]
-                    if entity_type != "CNS":  # 🧼 Exclude CNS tokens
-                        entity_bank[entity_type].add(token)
-    return {k: list(v) for k, v in entity_bank.items()}
+    return SpanBank.from_corpus(folder, include=is_original)
 
 # === STEP 2: AUGMENT A SINGLE FILE ===
-def augment_file(file_path, entity_bank, aug_id):
-    with open(file_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
+entity_bank = None  # Set in every worker by init_worker
 
-    augmented_lines = []
-    for line in lines:
-        if line.strip() == "":
-            augmented_lines.append("\n")
-            continue
-        parts = line.strip().split()
-        if len(parts) != 2:
-            augmented_lines.append(line)
-            continue
-        token, label = parts
-        if label.startswith("B-") or label.startswith("I-"):
-            entity_type = label.split("-")[1]
-            if entity_type != "CNS" and entity_type in entity_bank and entity_bank[entity_type]:
-                token = random.choice(entity_bank[entity_type])
-        augmented_lines.append(f"{token}\t{label}\n")
+def init_worker(bank):
+    global entity_bank
+    entity_bank = bank
 
-    base_filename = Path(file_path).stem
-    new_filename = f"{base_filename}_aug{aug_id}.iob"
-    new_filepath = os.path.join(Path(file_path).parent, new_filename)
-    with open(new_filepath, "w", encoding="utf-8") as f:
-        f.writelines(augmented_lines)
+# Write all AUG_PER_FILE variants of one file next to it
+def augment_file(file_path):
+    for document in augment_document(read_iob(file_path), entity_bank, AUG_PER_FILE, SEED):
+        write_document(os.path.join(Path(file_path).parent, document.source), document)
+    return AUG_PER_FILE
 
 # === STEP 3: MAIN DRIVER ===
 def main():
-    entity_bank = extract_entities_from_files(TRAIN_FOLDER)
-    print(f"Collected entities from {len(entity_bank)} types (excluding CNS).")
-
-    for filename in os.listdir(TRAIN_FOLDER):
-        if not filename.endswith(".iob"):
-            continue
-        file_path = os.path.join(TRAIN_FOLDER, filename)
-        for aug_id in range(1, AUG_PER_FILE + 1):
-            augment_file(file_path, entity_bank, aug_id)
-
-    print(f"✅ Data augmentation completed (excluding CNS). Files saved in '{TRAIN_FOLDER}'.")
+    # Skip when the original files are the same ones the augmented copies were made from
+    manifest = load_manifest()
+    digest = folder_digest(TRAIN_FOLDER, manifest, include=is_original)
+    originals = [f for f in os.listdir(TRAIN_FOLDER) if f.endswith(".iob") and is_original(f)]
+    if step_is_current(manifest, STEP_NAME, digest) and all(
+        os.path.exists(os.path.join(TRAIN_FOLDER, f"{Path(f).stem}_aug{aug_id}.iob"))
+        for f in originals for aug_id in range(1, AUG_PER_FILE + 1)
+    ):
+        print(f"⏭️ '{TRAIN_FOLDER}' is unchanged since the last augmentation, skipping.")
+        return
+
+    bank = extract_entities_from_files(TRAIN_FOLDER)
+    print(f"Collected {len(bank)} entity spans from {len(bank.types)} types (excluding CNS).")
+
+    # Only originals are augmented; earlier _aug files are overwritten, not augmented again
+    file_paths = [os.path.join(TRAIN_FOLDER, f) for f in originals]
+    if WORKERS > 1:
+        with Pool(WORKERS, initializer=init_worker, initargs=(bank,)) as pool:
+            written = sum(pool.imap_unordered(augment_file, file_paths, chunksize=16))
+    else:
+        init_worker(bank)
+        written = sum(map(augment_file, file_paths))
+
+    mark_step_done(STEP_NAME, digest)
+    print(f"✅ Data augmentation completed (excluding CNS): {written} files saved in '{TRAIN_FOLDER}'.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,80 @@
+import argparse
+import os
+
+import numpy as np
+import torch
+from transformers import AutoTokenizer, AutoModelForTokenClassification
+
+from ner_backends import BACKEND_PATHS, ONNX_MODEL_FILE, load_backend
+
+# === CONFIG ===
+MODEL_PATH = BACKEND_PATHS["torch"]
+ONNX_MODEL_PATH = BACKEND_PATHS["onnx"]
+OPSET = 17
+
+
+# Export the model with dynamic batch and sequence axes so one graph serves
+# every batch shape the inference engine produces
+def export_onnx(model_path=MODEL_PATH, output_path=ONNX_MODEL_PATH, opset=OPSET):
+    model = AutoModelForTokenClassification.from_pretrained(model_path)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    model.eval()
+    model.config.return_dict = False  # Trace a plain (logits,) tuple
+
+    sample = tokenizer(["Republic Act No. 6713", "G.R. No. 123456"], padding=True, return_tensors="pt")
+    dynamic_axes = {
+        "input_ids": {0: "batch", 1: "sequence"},
+        "attention_mask": {0: "batch", 1: "sequence"},
+        "logits": {0: "batch", 1: "sequence"},
+    }
+    os.makedirs(output_path, exist_ok=True)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            os.path.join(output_path, ONNX_MODEL_FILE),
+            input_names=["input_ids", "attention_mask"],
+            output_names=["logits"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+        )
+
+    model.config.return_dict = True
+    model.config.save_pretrained(output_path)
+    tokenizer.save_pretrained(output_path)
+
+
+# Compare ONNX Runtime logits against eager PyTorch on a batch with padding
+def verify_export(model_path=MODEL_PATH, output_path=ONNX_MODEL_PATH):
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    inputs = tokenizer(
+        ["The Supreme Court ruled in G.R. No. 123456.", "Section 5 of Republic Act No. 6713 is constitutional."],
+        padding=True, return_tensors="pt"
+    )
+    inputs = {k: inputs[k] for k in ["input_ids", "attention_mask"]}
+    with torch.no_grad():
+        expected = load_backend("torch", model_path)(**inputs).logits.numpy()
+    actual = load_backend("onnx", output_path)(**inputs).logits.numpy()
+    mask = inputs["attention_mask"].numpy().astype(bool)
+    max_diff = float(np.abs(expected - actual)[mask].max())
+    same_labels = bool((expected.argmax(-1) == actual.argmax(-1))[mask].all())
+    return max_diff, same_labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the fine-tuned NER model to ONNX.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--output", default=ONNX_MODEL_PATH)
+    parser.add_argument("--opset", type=int, default=OPSET)
+    args = parser.parse_args()
+
+    export_onnx(args.model, args.output, args.opset)
+    print(f"✅ ONNX model saved to {os.path.join(args.output, ONNX_MODEL_FILE)}")
+
+    max_diff, same_labels = verify_export(args.model, args.output)
+    print(f"🔹 Max |logit difference| vs PyTorch: {max_diff:.2e}")
+    print(f"🔹 Same predicted labels: {'✅' if same_labels else '❌'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,19 +6,28 @@ import torch
 from datasets import Dataset, load_dataset
 import evaluate
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import confusion_matrix
-from sklearn.metrics import classification_report
-import pandas as pd
 from transformers import (
     AutoTokenizer,
     AutoModelForTokenClassification,
     TrainingArguments,
     Trainer,
+    TrainerCallback,
+    DataCollatorForTokenClassification,
     pipeline
 )
+from transformers.trainer_pt_utils import LengthGroupedSampler
 
 import random
 
+from iob_augment import AugmentedTrainingSet, SpanBank, is_original
+from iob_cache import load_or_build
+from iob_pack import document_hash, list_documents, read_document, read_document_sentences
+from ner_eval import (
+    classification_report_from_ids, entity_confusion_counts, flatten_token_predictions, group_mismatches,
+    label_tables, ner_confusion_2x2
+)
+from ner_windows import build_windowed_examples
+
 SEED = 42
 random.seed(SEED)
 np.random.seed(SEED)
@@ -27,59 +36,64 @@ torch.cuda.manual_seed_all(SEED)
 torch.backends.cudnn.deterministic = True
 torch.backends.cudnn.benchmark = False
 
+# Split documents into overlapping windows instead of truncating them at MAX_LENGTH
+# (subword_profile.py measures windows, padding waste and the batch size that fits for these settings)
+USE_SLIDING_WINDOWS = True
+MAX_LENGTH = 512
+WINDOW_STRIDE = 128  # Subwords shared by consecutive windows
+
+# Pad each batch only to its longest example and batch examples of similar length together
+USE_DYNAMIC_PADDING = False
+PADDING = False if USE_DYNAMIC_PADDING else "max_length"
+
+# Reuse tokenized examples from .cache/tokenized; only new or changed .iob files are parsed and tokenized
+USE_TOKENIZATION_CACHE = True
+
+# Also train on AUG_PER_FILE entity-swapped copies of every training window (the entity swapping of
+# data-augmentation.py, from the training split's own entities). Copies are made and tokenized as the trainer
+# asks for them, with new entities every epoch, by AUGMENTATION_WORKERS forked dataloader processes; nothing
+# is written to disk or to the tokenization cache. Don't also train on _aug files.
+STREAM_AUGMENTATION = False
+AUG_PER_FILE = 2
+AUGMENTATION_WORKERS = 2
+
 
 ###################################################################################################################################
 #UPDATED
 # 📌 Step 1: Load IOB Files
-# Separate folders for training and evaluation
+# Separate folders for training and evaluation (a packed corpus file, e.g. "train_data/train.iobpack", works too)
 train_folder = "train_data/train"
 eval_folder = "train_data/eval"
 
-train_files = [os.path.join(train_folder, f) for f in os.listdir(train_folder) if f.endswith(".iob")]
-eval_files = [os.path.join(eval_folder, f) for f in os.listdir(eval_folder) if f.endswith(".iob")]
+train_files = list_documents(train_folder)
+eval_files = list_documents(eval_folder)
 
 file_count = len(train_files)  # Only count training files
 ###################################################################################################################################
 def parse_iob_file(file_path, return_sources=False):
-    tokens, labels = [], []
-    sources = []
-    with open(file_path, "r", encoding="utf-8") as f:
-        token_list, label_list = [], []
-        for line in f:
-            line = line.strip()
-            if line:
-                token, label = line.split("\t")
-                token_list.append(token)
-                label_list.append(label)
-            else:
-                tokens.append(token_list)
-                labels.append(label_list)
-                if return_sources:
-                    sources.append(os.path.basename(file_path))
-                token_list, label_list = [], []
-        if token_list:
-            tokens.append(token_list)
-            labels.append(label_list)
-            if return_sources:
-                sources.append(os.path.basename(file_path))
+    tokens, labels = read_document_sentences(file_path)
     if return_sources:
-        return {"tokens": tokens, "ner_tags": labels, "sources": sources}
+        return {"tokens": tokens, "ner_tags": labels, "sources": [os.path.basename(file_path)] * len(tokens)}
     return {"tokens": tokens, "ner_tags": labels}
 
 
 ###################################################################################################################################
 #UPDATED
-# Parse training data
-train_tokens, train_labels = [], []
-for file_path in train_files:
-    data = parse_iob_file(file_path)
-    train_tokens.extend(data["tokens"])
-    train_labels.extend(data["ner_tags"])
-
-# Parse evaluation data
+# Parse training data (with the tokenization cache, files are parsed only when their cache entry is missing)
+train_tokens, train_labels, train_sources = [], [], []
+if not USE_TOKENIZATION_CACHE:
+    for file_path in train_files:
+        data = parse_iob_file(file_path, return_sources=True)
+        train_tokens.extend(data["tokens"])
+        train_labels.extend(data["ner_tags"])
+        train_sources.extend(data["sources"])
+
+# Parse evaluation data (always: the analysis steps need the words)
 eval_tokens, eval_labels, eval_sources = [], [], []
+eval_doc_start = {}  # source file -> index of its first sequence in eval_tokens
 for file_path in eval_files:
     data = parse_iob_file(file_path, return_sources=True)
+    eval_doc_start[os.path.basename(file_path)] = len(eval_tokens)
     eval_tokens.extend(data["tokens"])
     eval_labels.extend(data["ner_tags"])
     eval_sources.extend(data["sources"])
@@ -125,7 +139,7 @@ model = AutoModelForTokenClassification.from_pretrained(
 # 📌 Step 6: Tokenization & Label Alignment
 def tokenize_and_align_labels(examples):
     tokenized_inputs = tokenizer(
-        examples["tokens"], truncation=True, padding="max_length", max_length=512, is_split_into_words=True
+        examples["tokens"], truncation=True, padding=PADDING, max_length=MAX_LENGTH, is_split_into_words=True
     )
     labels = []
     ##############
@@ -152,20 +166,95 @@ def tokenize_and_align_labels(examples):
 
     tokenized_inputs["labels"] = labels
     return tokenized_inputs
+
+# Tokenized examples for a single file; the tokenization cache calls this only for new or changed files
+def encode_file(file_path, mask_overlap=False):
+    data = parse_iob_file(file_path, return_sources=True)
+    if USE_SLIDING_WINDOWS:
+        return build_windowed_examples(
+            data["tokens"], data["ner_tags"], data["sources"], tokenizer, label2id, max_length=MAX_LENGTH,
+            stride=WINDOW_STRIDE, mask_overlap=mask_overlap, padding=PADDING
+        )
+    return dict(tokenize_and_align_labels(data))
+
 # Debug
-if not train_tokens:
+if not train_files or not (train_tokens or USE_TOKENIZATION_CACHE):
     print("❌ No training tokens loaded. Check file paths or data parsing.")
     exit()
-print("\n📝 Sentence:", " ".join(train_tokens[0]))
-tokenized_output = tokenizer(train_tokens[0], is_split_into_words=True)
+first_sentence = train_tokens[0] if train_tokens else parse_iob_file(train_files[0])["tokens"][0]
+print("\n📝 Sentence:", " ".join(first_sentence))
+tokenized_output = tokenizer(first_sentence, is_split_into_words=True)
 tokens = tokenizer.convert_ids_to_tokens(tokenized_output["input_ids"])
 word_ids = tokenized_output.word_ids()
 print("Tokens:", tokens)
 print("Word IDs:", word_ids)
 
 
-train_dataset = train_dataset.map(tokenize_and_align_labels, batched=True)
-val_dataset = val_dataset.map(tokenize_and_align_labels, batched=True)
+if USE_TOKENIZATION_CACHE:
+    cache_settings = {
+        "tokenizer": model_name, "max_length": MAX_LENGTH, "label_map": LABEL_MAP, "padding": PADDING,
+        "sliding_windows": USE_SLIDING_WINDOWS, "stride": WINDOW_STRIDE,
+    }
+    train_dataset = load_or_build(
+        train_files, dict(cache_settings, mask_overlap=False), encode_file, hash_fn=document_hash
+    )
+    val_dataset = load_or_build(
+        eval_files, dict(cache_settings, mask_overlap=True), lambda path: encode_file(path, mask_overlap=True),
+        hash_fn=document_hash
+    )
+    if USE_SLIDING_WINDOWS:
+        # Cached windows number their sequences per file; map them back to positions in eval_tokens
+        eval_windows = {
+            "doc_index": [eval_doc_start[src] + idx for src, idx in zip(val_dataset["source"], val_dataset["doc_index"])],
+            "word_ids": val_dataset["word_ids"],
+        }
+elif USE_SLIDING_WINDOWS:
+    # Every subword is trained on; in eval each subword is scored only by the window where it has the most context
+    train_dataset = Dataset.from_dict(build_windowed_examples(
+        train_tokens, train_labels, train_sources, tokenizer, label2id, max_length=MAX_LENGTH, stride=WINDOW_STRIDE,
+        padding=PADDING
+    ))
+    eval_windows = build_windowed_examples(
+        eval_tokens, eval_labels, eval_sources, tokenizer, label2id, max_length=MAX_LENGTH, stride=WINDOW_STRIDE,
+        mask_overlap=True, padding=PADDING
+    )
+    val_dataset = Dataset.from_dict(eval_windows)
+    print(f"🪟 Windows: {len(train_dataset)} train from {len(train_tokens)} sequences, "
+          f"{len(val_dataset)} eval from {len(eval_tokens)} sequences")
+else:
+    train_dataset = train_dataset.map(tokenize_and_align_labels, batched=True)
+    val_dataset = val_dataset.map(tokenize_and_align_labels, batched=True)
+
+if USE_DYNAMIC_PADDING:
+    # Precomputed lengths let the length-grouped sampler skip a full pass over the dataset
+    train_dataset = train_dataset.map(lambda example: {"length": len(example["input_ids"])})
+    data_collator = DataCollatorForTokenClassification(tokenizer)
+else:
+    data_collator = None
+
+if STREAM_AUGMENTATION:
+    train_documents = [read_document(path) for path in train_files if is_original(os.path.basename(path))]
+    span_bank = SpanBank.from_documents(train_documents)
+    train_dataset = AugmentedTrainingSet(
+        train_dataset, train_documents, span_bank, tokenizer, label2id, AUG_PER_FILE, max_length=MAX_LENGTH,
+        stride=WINDOW_STRIDE, windowed=USE_SLIDING_WINDOWS, padding=PADDING, seed=SEED
+    )
+    print(f"🔀 {len(train_dataset.slots) * AUG_PER_FILE} augmented examples per epoch "
+          f"({AUG_PER_FILE} per training window, {len(span_bank)} entity spans to swap in)")
+
+# Gives the augmented copies new entities every epoch
+class NewAugmentationEachEpoch(TrainerCallback):
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        train_dataset.set_epoch(round(state.epoch))
+
+# Subword-to-word mapping (-1 for special tokens and padding) and source sequence of every eval example,
+# computed once for all the analysis steps
+if USE_SLIDING_WINDOWS:
+    eval_word_ids, eval_doc_index = eval_windows["word_ids"], eval_windows["doc_index"]
+else:
+    eval_encodings = tokenizer(eval_tokens, truncation=True, max_length=MAX_LENGTH, is_split_into_words=True)
+    eval_word_ids = [[-1 if w is None else w for w in eval_encodings.word_ids(i)] for i in range(len(eval_tokens))]
+    eval_doc_index = list(range(len(eval_tokens)))
 
 # 📌 Step 7: Training Arguments
 
@@ -179,17 +268,32 @@ training_args = TrainingArguments(
     logging_steps=100,
     evaluation_strategy="steps",
     save_strategy="epoch",
+    group_by_length=USE_DYNAMIC_PADDING,
+    dataloader_num_workers=AUGMENTATION_WORKERS if STREAM_AUGMENTATION else 0,
+    dataloader_prefetch_factor=2 if STREAM_AUGMENTATION and AUGMENTATION_WORKERS else None,
 )
 
 
 
 # 📌 Step 8: Train Model
-trainer = Trainer(
+# With group_by_length, the augmented set hands the sampler the lengths it already knows; otherwise
+# the sampler would build (swap and tokenize) every augmented copy in this process just to measure it
+class AugmentedTrainer(Trainer):
+    def _get_train_sampler(self, *args, **kwargs):
+        if isinstance(self.train_dataset, AugmentedTrainingSet) and self.args.group_by_length:
+            return LengthGroupedSampler(
+                self.args.train_batch_size * self.args.gradient_accumulation_steps, lengths=self.train_dataset.lengths
+            )
+        return super()._get_train_sampler(*args, **kwargs)
+
+trainer = AugmentedTrainer(
     model=model,
     args=training_args,
     train_dataset=train_dataset,
     eval_dataset=val_dataset,
-    tokenizer=tokenizer
+    tokenizer=tokenizer,
+    data_collator=data_collator,
+    callbacks=[NewAugmentationEachEpoch()] if STREAM_AUGMENTATION else None,
 )
 
 trainer.train()
@@ -224,145 +328,21 @@ model.save_pretrained("./bert-legal-ner")
 tokenizer.save_pretrained("./bert-legal-ner")
 
 # 📌 Step 11: Matrix
-# 📌 Step 11: Matrix
-from sklearn.metrics import confusion_matrix
-import pandas as pd
-
-ENTITY_TYPES = ['INS', 'STA', 'RA', 'PROM_DATE', 'CASE_NUM', 'PERSON']
-ENTITY_INDEX = {name: i for i, name in enumerate(ENTITY_TYPES)}
-
-flat_true = []
-flat_pred = []
-mismatch_details = []
-
-# Reconstruct spans for analysis
-for i, (label_seq, pred_seq) in enumerate(zip(labels, np.argmax(predictions, axis=2))):
-    words = eval_tokens[i]
-    
-    tokenized = tokenizer(
-    words,
-    truncation=True,
-    padding="max_length",
-    max_length=512,
-    is_split_into_words=True,
-    return_tensors="pt"
-    )
-    
-    word_ids = tokenized.word_ids()
-    source_file = eval_sources[i]
-
-    for true_id, pred_id, word_id in zip(label_seq, pred_seq, word_ids):
-        if true_id == -100 or word_id is None:
-            continue
-
-        token_text = words[word_id]
-        true_tag = id2label[true_id]
-        pred_tag = id2label[pred_id]
-
-        true_entity = true_tag.replace("B-", "").replace("I-", "")
-        pred_entity = pred_tag.replace("B-", "").replace("I-", "")
-
-        # Skip if both are "O" or not in ENTITY_TYPES
-        if true_tag == "O" and pred_tag == "O":
-            continue
-        if true_entity not in ENTITY_INDEX or pred_entity not in ENTITY_INDEX:
-            continue
-
-        flat_true.append(ENTITY_INDEX[true_entity])
-        flat_pred.append(ENTITY_INDEX[pred_entity])
-
-        if true_entity != pred_entity:
-            mismatch_details.append({
-                "text": token_text,
-                "true": true_entity,
-                "pred": pred_entity,
-                "file": source_file
-            })
+# Every scored subword of the eval split as flat arrays (true id, predicted id, sequence, word)
+flat = flatten_token_predictions(predictions, labels, eval_word_ids, eval_doc_index)
+entity_of_label = label_tables(id2label)["entity"]
 
 # Create and print confusion matrix
-conf_matrix = confusion_matrix(flat_true, flat_pred, labels=list(range(len(ENTITY_TYPES))))
-conf_df = pd.DataFrame(conf_matrix, index=ENTITY_TYPES, columns=ENTITY_TYPES)
-
-missed_counts = []
-for i, entity in enumerate(ENTITY_TYPES):
-    total_true = conf_matrix[i, :].sum()      # Total times the entity appears in ground truth
-    correct = conf_matrix[i, i]               # Correct predictions
-    missed = total_true - correct             # Missed = total - correct
-    missed_counts.append(missed)
-
-conf_df['Missed'] = missed_counts  # This adds the column to the far right
+conf_df = entity_confusion_counts(entity_of_label[flat["true"]], entity_of_label[flat["pred"]])
 
 # Print updated confusion matrix
 print("\n📊 7x7 Confusion Matrix with 'Missed' Column (Rows = True, Columns = Predicted):\n")
 print(conf_df)
 
-# Flatten and decode predicted and true labels
-true_labels_flat = []
-pred_labels_flat = []
-
-label_map = id2label  # from earlier
-
-for label_seq, pred_seq in zip(labels, np.argmax(predictions, axis=2)):
-    for true_id, pred_id in zip(label_seq, pred_seq):
-        if true_id != -100:
-            true_labels_flat.append(label_map[true_id])
-            pred_labels_flat.append(label_map[pred_id])
-
 print("\n🔹 Overall Classification Report:")
-print(classification_report(true_labels_flat, pred_labels_flat, digits=4, zero_division=0))
-
-from collections import defaultdict
-
-from collections import defaultdict
-
-seen_mismatches = set()
-grouped_mismatches = defaultdict(list)
-
-for i, (label_seq, pred_seq) in enumerate(zip(labels, np.argmax(predictions, axis=2))):
-    words = eval_tokens[i]
-    source_file = eval_sources[i]
-
-    tokenized = tokenizer(
-        words,
-        truncation=True,
-        padding="max_length",
-        max_length=512,
-        is_split_into_words=True,
-        return_tensors="pt"
-    )
-
-    word_ids = tokenized.word_ids()
-
-    for true_id, pred_id, word_id in zip(label_seq, pred_seq, word_ids):
-        if true_id == -100 or word_id is None:
-            continue
+print(classification_report_from_ids(flat["true"], flat["pred"], id2label, digits=4))
 
-        token = words[word_id]
-        true_tag = id2label[true_id]
-        pred_tag = id2label[pred_id]
-
-        # Skip both "O"
-        if true_tag == "O" and pred_tag == "O":
-            continue
-
-        # Skip if entity types are the same (B-/I- variants treated as correct)
-        if true_tag != "O" and pred_tag != "O":
-            if true_tag.replace("B-", "").replace("I-", "") == pred_tag.replace("B-", "").replace("I-", ""):
-                continue
-
-        true_entity = true_tag.replace("B-", "").replace("I-", "")
-        pred_entity = pred_tag.replace("B-", "").replace("I-", "")
-
-        # Skip if true label is "O" or if both entities are untracked
-        if true_tag == "O":
-            continue
-        if true_entity not in ENTITY_INDEX and pred_entity not in ENTITY_INDEX:
-            continue
-
-        key = (true_entity, pred_entity, token, source_file)
-        if key not in seen_mismatches:
-            seen_mismatches.add(key)
-            grouped_mismatches[true_entity].append((pred_entity, token, source_file))
+grouped_mismatches = group_mismatches(flat, id2label, eval_tokens, eval_sources)
 
 # Final printout
 if grouped_mismatches:
@@ -375,52 +355,12 @@ else:
     print("\n✅ No misclassifications found.")
 
 # Print total counts of true entity labels
-print("Total true entity labels counted:", len(flat_true))
-print("Breakdown:", np.bincount(flat_true))
+true_entity_counts = conf_df[ENTITY_TYPES].to_numpy().sum(axis=1)
+print("Total true entity labels counted:", int(true_entity_counts.sum()))
+print("Breakdown:", np.trim_zeros(true_entity_counts, "b"))
 
 # 📌 Step 12: Construct NER-style 2x2 Confusion Matrix
-tp = 0  # Correctly predicted entity with correct type
-fp = 0  # Predicted as entity but wrong type or shouldn't be an entity
-fn = 0  # Should be entity but model missed it
-tn = 0  # Correctly predicted non-entity
-
-for i, (label_seq, pred_seq) in enumerate(zip(labels, np.argmax(predictions, axis=2))):
-    words = eval_tokens[i]
-    tokenized = tokenizer(
-        words,
-        truncation=True,
-        padding="max_length",
-        max_length=512,
-        is_split_into_words=True,
-        return_tensors="pt"
-    )
-    word_ids = tokenized.word_ids()
-
-    for true_id, pred_id, word_id in zip(label_seq, pred_seq, word_ids):
-        if word_id is None or true_id == -100:
-            continue
-
-        true_tag = id2label[true_id]
-        pred_tag = id2label[pred_id]
-
-        if true_tag == "O" and pred_tag == "O":
-            tn += 1
-        elif true_tag == "O" and pred_tag != "O":
-            fp += 1
-        elif true_tag != "O" and pred_tag == "O":
-            fn += 1
-        elif true_tag == pred_tag:
-            tp += 1
-        else:
-            fp += 1  # wrong entity type
-
-# Display matrix
-matrix_2x2 = pd.DataFrame(
-    [[tp, fn],
-     [fp, tn]],
-    index=["Actual: Entity", "Actual: Non-Entity"],
-    columns=["Predicted: Entity", "Predicted: Non-Entity"]
-)
+matrix_2x2 = ner_confusion_2x2(flat["true"], flat["pred"], id2label)
 
 print("\n🧮 2x2 NER-Specific Confusion Matrix:\n")
 print(matrix_2x2)
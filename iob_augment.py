@@ -0,0 +1,173 @@
+import os
+import zlib
+from collections import defaultdict
+
+import numpy as np
+
+from iob_format import IOBDocument, entity_spans
+from iob_pack import list_documents, read_document
+from ner_windows import MAX_LENGTH, STRIDE, align_labels, build_windowed_examples, window_starts
+
+EXCLUDED_TYPES = ("CNS",)  # 🧼 Never swapped, never used as replacements
+SEED = 42
+
+# Entity swapping: every entity span is replaced by a random span of the same
+# type and the same number of tokens, so "Republic Act No. 6713" becomes another
+# whole RA and the labels of a variant are exactly those of its original.
+
+
+# Augmented copies are named <original>_aug<N>.iob
+def is_original(filename):
+    return "_aug" not in filename
+
+
+# Distinct entity phrases of a corpus, keyed by (type, length in tokens). Each
+# key holds a [phrases, length] object array, so drawing any number of
+# replacements is a single fancy-indexing operation.
+class SpanBank:
+    def __init__(self, phrases):
+        # Sorted, so the same corpus and seed give the same variants in every process
+        self.phrases = {key: np.array(sorted(values), dtype=object).reshape(len(values), key[1])
+                        for key, values in sorted(phrases.items())}
+
+    @classmethod
+    def from_documents(cls, documents, excluded=EXCLUDED_TYPES):
+        phrases = defaultdict(set)
+        for document in documents:
+            tokens = document.tokens()
+            for entity_type, start, stop in entity_spans(document):
+                if entity_type not in excluded:
+                    phrases[(entity_type, stop - start)].add(tuple(tokens[start:stop]))
+        return cls(phrases)
+
+    # One pass over a folder of .iob files or a packed corpus
+    @classmethod
+    def from_corpus(cls, path, include=None, excluded=EXCLUDED_TYPES):
+        paths = [p for p in list_documents(path) if include is None or include(os.path.basename(p))]
+        return cls.from_documents((read_document(p) for p in paths), excluded)
+
+    @property
+    def types(self):
+        return sorted({entity_type for entity_type, _ in self.phrases})
+
+    def __len__(self):
+        return sum(len(values) for values in self.phrases.values())
+
+
+# Generator for one document: seeded by the document name, so its variants
+# don't depend on which worker makes them or in what order
+def document_rng(source, seed=SEED):
+    return np.random.default_rng([seed, zlib.crc32(os.path.basename(source).encode("utf-8"))])
+
+
+# [n_variants, tokens] object array of entity-swapped copies of a document's tokens
+def augment_tokens(document, bank, rng, n_variants):
+    variants = np.tile(np.array(document.tokens(), dtype=object), (n_variants, 1))
+    groups = defaultdict(list)
+    for entity_type, start, stop in entity_spans(document):
+        if (entity_type, stop - start) in bank.phrases:
+            groups[(entity_type, stop - start)].append(start)
+    for (entity_type, length), starts in groups.items():
+        phrases = bank.phrases[(entity_type, length)]
+        positions = np.array(starts)[:, None] + np.arange(length)  # [spans, length]
+        variants[:, positions] = phrases[rng.integers(len(phrases), size=(n_variants, len(starts)))]
+    return variants
+
+
+# Augmented copies of a document, named <original>_aug<N>.iob like the files data-augmentation.py writes
+def augment_document(document, bank, n_variants, seed=SEED):
+    stem = os.path.splitext(os.path.basename(document.source))[0]
+    variants = augment_tokens(document, bank, document_rng(document.source, seed), n_variants)
+    return [
+        IOBDocument(f"{stem}_aug{aug_id}.iob", tokens.tolist(), document.labels, document.sentence_starts)
+        for aug_id, tokens in enumerate(variants, start=1)
+    ]
+
+
+# Columns of a tokenized training example that the model consumes
+MODEL_COLUMNS = ("input_ids", "attention_mask", "token_type_ids", "labels")
+
+
+# Training set for the Trainer: the tokenized examples of base, followed by
+# n_variants entity-swapped copies of every training window that are made and
+# tokenized only when an example is requested. A copy is drawn from a generator
+# seeded by the epoch and its index, so every epoch sees new entities (set_epoch)
+# while a given epoch is reproducible. Slots are planned once from the original
+# windows; a copy whose swapped entities need more subwords is truncated.
+class AugmentedTrainingSet:
+    def __init__(self, base, documents, bank, tokenizer, label2id, n_variants, max_length=MAX_LENGTH, stride=STRIDE,
+                 windowed=True, padding="max_length", seed=SEED):
+        self.base = base
+        self.columns = [column for column in base.column_names if column in MODEL_COLUMNS]
+        self.bank = bank
+        self.tokenizer = tokenizer
+        self.label2id = label2id
+        self.n_variants = n_variants
+        self.max_length = max_length
+        self.stride = stride
+        self.windowed = windowed
+        self.padding = padding
+        self.seed = seed
+        self.epoch = 0
+
+        self.sentences = [sentence for document in documents for sentence in document.sentences()]
+        self.slots = []  # (sentence, first word, end word) of every original window
+        self.slot_lengths = []  # Subwords of every original window, special tokens included
+        size = max_length - 2
+        encodings = tokenizer([tokens for tokens, _ in self.sentences], is_split_into_words=True, add_special_tokens=False)
+        for i, (tokens, _) in enumerate(self.sentences):
+            word_ids = encodings.word_ids(i)
+            if not windowed:
+                self.slots.append((i, 0, len(tokens)))
+                self.slot_lengths.append(min(len(word_ids), size) + 2)
+                continue
+            word_positions = np.array(word_ids)
+            for start in window_starts(len(word_ids), size, stride) if word_ids else []:
+                first, end = word_ids[start], word_ids[min(start + size, len(word_ids)) - 1] + 1
+                self.slots.append((i, first, end))
+                subwords = np.searchsorted(word_positions, end) - np.searchsorted(word_positions, first)
+                self.slot_lengths.append(min(int(subwords), size) + 2)
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return len(self.base) + len(self.slots) * self.n_variants
+
+    # Length of every example, for length-grouped sampling without building the augmented copies.
+    # A copy is measured on its original window, so it is off by what its swapped-in entities add or remove.
+    @property
+    def lengths(self):
+        if "length" in self.base.column_names:
+            base = self.base["length"]
+        else:
+            base = [len(input_ids) for input_ids in self.base["input_ids"]]
+        slot_lengths = [self.max_length] * len(self.slots) if self.padding == "max_length" else self.slot_lengths
+        return list(base) + [length for length in slot_lengths for _ in range(self.n_variants)]
+
+    def __getitem__(self, i):
+        if i < len(self.base):
+            row = self.base[i]
+            return {column: row[column] for column in self.columns}
+        i -= len(self.base)
+        sentence, first, end = self.slots[i // self.n_variants]
+        tokens, labels = (values[first:end] for values in self.sentences[sentence])
+        rng = np.random.default_rng([self.seed, self.epoch, i])
+        tokens = augment_tokens(IOBDocument(None, tokens, labels, [0, len(tokens)]), self.bank, rng, 1)[0].tolist()
+        return self.encode(tokens, labels)
+
+    # One tokenized example, built the way fine-tuning.py builds the originals
+    def encode(self, tokens, labels):
+        if self.windowed:
+            examples = build_windowed_examples(
+                [tokens], [labels], [None], self.tokenizer, self.label2id, max_length=self.max_length,
+                stride=self.stride, padding=self.padding
+            )
+            return {column: examples[column][0] for column in self.columns}
+        encoding = self.tokenizer(
+            tokens, truncation=True, padding=self.padding, max_length=self.max_length, is_split_into_words=True
+        )
+        word_ids = encoding.word_ids()
+        aligned = iter(align_labels([w for w in word_ids if w is not None], labels, self.label2id))
+        example = dict(encoding, labels=[-100 if w is None else next(aligned) for w in word_ids])
+        return {column: example[column] for column in self.columns}
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import shutil
+
+from datasets import Dataset, concatenate_datasets, load_from_disk
+
+from queue_manifest import file_hash
+
+CACHE_DIR = ".cache/tokenized"
+CACHE_VERSION = 1  # Bump when the encoding of examples changes
+MAX_SPLITS = 4  # Whole-split tables kept (train and eval of the current and the previous run's files)
+
+
+def _key(*parts):
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+# Write a dataset next to its final location, then move it into place, so an
+# interrupted run never leaves a half-written cache entry behind
+def _save(dataset, path):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    dataset.save_to_disk(tmp_path)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+
+# Tokenized examples for a list of .iob files, cached as Arrow tables on disk.
+#
+# Entries are keyed by `settings` (tokenizer name, max length, LABEL_MAP, ...)
+# plus each file's name and content hash (hash_fn, e.g. iob_pack.document_hash
+# for documents inside a packed corpus). When nothing changed, the whole split
+# is a single memory-mapped load; otherwise only files without an entry are
+# passed to build_fn(file_path) -> dict of columns, and the rest is reused.
+def load_or_build(file_paths, settings, build_fn, cache_dir=CACHE_DIR, hash_fn=file_hash):
+    settings_key = _key(str(CACHE_VERSION), json.dumps(settings, sort_keys=True))
+    file_keys = [_key(settings_key, os.path.basename(path), hash_fn(path)) for path in file_paths]
+
+    split_dir = os.path.join(cache_dir, "splits", _key(settings_key, *file_keys))
+    if os.path.exists(split_dir):
+        os.utime(split_dir)  # Recently used
+        print(f"⚡ Tokenization cache hit: {len(file_paths)} files")
+        return load_from_disk(split_dir)
+
+    parts, rebuilt = [], 0
+    for path, file_key in zip(file_paths, file_keys):
+        file_dir = os.path.join(cache_dir, "files", file_key)
+        if not os.path.exists(file_dir):
+            _save(Dataset.from_dict(build_fn(path)), file_dir)
+            rebuilt += 1
+        part = load_from_disk(file_dir)
+        if len(part):
+            parts.append(part)
+    print(f"🔄 Tokenization cache: re-tokenized {rebuilt} of {len(file_paths)} files")
+
+    if not parts:
+        return Dataset.from_dict({})
+    # One contiguous table for the split, so the next unchanged run is a single load, plus the
+    # per-file entries it was built from, so entries no kept split uses can be pruned
+    _save(concatenate_datasets(parts), split_dir)
+    tmp_path = f"{split_dir}.json.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(file_keys, f)
+    os.replace(tmp_path, f"{split_dir}.json")
+    _prune(cache_dir, MAX_SPLITS)
+    return load_from_disk(split_dir)
+
+
+# Remove all but the MAX_SPLITS most recently used split tables, then every
+# per-file entry none of the kept splits was built from. The entries of a kept
+# split stay, so it is rebuilt without re-tokenizing once a file changes; an
+# edited file's old entry goes once no kept split refers to it.
+def _prune(cache_dir, keep):
+    splits_dir = os.path.join(cache_dir, "splits")
+    splits = sorted(
+        (entry for entry in os.scandir(splits_dir) if entry.is_dir() and ".tmp" not in entry.name),
+        key=lambda entry: entry.stat().st_mtime, reverse=True
+    )
+    for entry in splits[keep:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+        if os.path.exists(f"{entry.path}.json"):
+            os.remove(f"{entry.path}.json")
+
+    referenced = set()
+    for entry in splits[:keep]:
+        try:
+            with open(f"{entry.path}.json", "r", encoding="utf-8") as f:
+                referenced.update(json.load(f))
+        except (FileNotFoundError, ValueError):
+            continue  # Written before splits listed their files; the table itself is complete
+    for entry in os.scandir(os.path.join(cache_dir, "files")):
+        if entry.is_dir() and ".tmp" not in entry.name and entry.name not in referenced:
+            shutil.rmtree(entry.path, ignore_errors=True)
@@ -0,0 +1,203 @@
+import os
+import re
+
+import numpy as np
+
+# Label ids shared by every tool. The first 13 are the model's LABEL_MAP (same
+# ids as fine-tuning.py); labels the model doesn't predict, like CNS, come after
+# them, and labels never seen before are appended the first time they are read.
+LABEL_MAP = {
+    "O": 0,
+    "B-INS": 1, "I-INS": 2,
+    "B-STA": 3, "I-STA": 4,
+    "B-RA": 5, "I-RA": 6,
+    "B-PROM_DATE": 7, "I-PROM_DATE": 8,
+    "B-CASE_NUM": 9, "I-CASE_NUM": 10, "B-PERSON": 11, "I-PERSON": 12
+}
+LABELS = list(LABEL_MAP) + ["B-CNS", "I-CNS"]
+LABEL_IDS = {label: i for i, label in enumerate(LABELS)}
+
+# Sentences are separated by one or more blank (or whitespace-only) lines
+SENTENCE_BREAK = re.compile(r"\n\s*\n")
+# Whitespace, a field, whitespace, a field: in a well-formed line the first field starts the line, so this
+# only occurs in a line with three or more fields (or leading whitespace, which the per-line path handles)
+EXTRA_FIELDS = re.compile(r"[^\S\n]\S+[^\S\n]+\S")
+
+# Format rules every reader here follows:
+# - a line is "<token><whitespace><label>"; lines without exactly those two fields are skipped
+# - blank lines end a sentence; runs of blank lines and empty sentences are ignored
+
+
+def label_id(label):
+    if label not in LABEL_IDS:
+        LABEL_IDS[label] = len(LABELS)
+        LABELS.append(label)
+    return LABEL_IDS[label]
+
+
+def label_ids(labels):
+    for label in set(labels).difference(LABEL_IDS):
+        label_id(label)
+    return np.fromiter(map(LABEL_IDS.__getitem__, labels), dtype=np.uint8, count=len(labels))
+
+
+def _line_fields(line):
+    fields = line.split()
+    return fields if len(fields) == 2 else []
+
+
+# One .iob file in columnar form: all token text in a single string with an
+# offset array into it, one small-int label id per token (ids index LABELS) and
+# the index of the first token of every sentence (plus a final end marker).
+class IOBDocument:
+    __slots__ = ("source", "buffer", "offsets", "labels", "sentence_starts")
+
+    def __init__(self, source, tokens, labels, sentence_starts):
+        self.source = source
+        self.buffer = "".join(tokens)
+        self.offsets = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens)), out=self.offsets[1:])
+        self.labels = labels if isinstance(labels, np.ndarray) else label_ids(labels)
+        self.sentence_starts = np.asarray(sentence_starts, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def num_sentences(self):
+        return len(self.sentence_starts) - 1
+
+    def tokens(self, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        buffer, offsets = self.buffer, self.offsets[start:stop + 1].tolist()
+        return [buffer[a:b] for a, b in zip(offsets, offsets[1:])]
+
+    def label_names(self, start=0, stop=None):
+        return [LABELS[i] for i in self.labels[start:stop].tolist()]
+
+    def sentence(self, i):
+        start, stop = int(self.sentence_starts[i]), int(self.sentence_starts[i + 1])
+        return self.tokens(start, stop), self.label_names(start, stop)
+
+    def sentences(self):
+        for i in range(self.num_sentences):
+            yield self.sentence(i)
+
+    # Sentence-level lists, the shape the training and evaluation scripts use
+    def token_lists(self):
+        return [tokens for tokens, _ in self.sentences()]
+
+    def label_lists(self):
+        return [labels for _, labels in self.sentences()]
+
+
+# How often each label id occurs in a document (indexed like LABELS)
+def count_labels(document):
+    return np.bincount(document.labels, minlength=len(LABELS))
+
+
+# Entity spans of a document as (entity type, first token, end token) triples.
+# An I- tag continues the entity before it only if that has the same type and
+# is in the same sentence; otherwise it starts a new one, like a B- tag.
+def entity_spans(document):
+    names = [label[2:] if label.startswith(("B-", "I-")) else None for label in LABELS]
+    type_names = sorted(set(filter(None, names)))
+    type_ids = np.array([type_names.index(name) if name else -1 for name in names], dtype=np.int64)
+    inside = np.array([label.startswith("I-") for label in LABELS])
+
+    labels = document.labels
+    types = type_ids[labels]
+    continues = np.zeros(len(labels), dtype=bool)
+    continues[1:] = inside[labels[1:]] & (types[1:] == types[:-1])
+    continues[document.sentence_starts[:-1]] = False
+    starts = np.flatnonzero((types >= 0) & ~continues)
+    breaks = np.append(np.flatnonzero(~continues), len(labels))  # An entity ends at the next token that doesn't continue it
+    stops = breaks[np.searchsorted(breaks, starts, side="right")]
+    return [(type_names[types[start]], start, stop) for start, stop in zip(starts.tolist(), stops.tolist())]
+
+
+# Tokens, labels and sentence starts of a whole file. Sentences are split off
+# with one regex and their fields with str.split, so well-formed text never
+# goes through a per-line loop.
+def _parse_fields(text):
+    tokens, labels, sentence_starts = [], [], [0]
+    for block in SENTENCE_BREAK.split(text):
+        fields = block.split()
+        if not fields:
+            continue
+        # Every line has at least one field, so twice as many fields as lines and no line with
+        # three or more means every line is exactly a token and a label
+        if len(fields) != 2 * (block.strip().count("\n") + 1) or EXTRA_FIELDS.search(block):
+            # Some line doesn't have exactly a token and a label; only keep the ones that do
+            fields = [field for line in block.split("\n") for field in _line_fields(line)]
+            if not fields:
+                continue
+        tokens.extend(fields[0::2])
+        labels.extend(fields[1::2])
+        sentence_starts.append(len(tokens))
+    return tokens, labels, sentence_starts
+
+
+def parse_iob_text(text, source=None):
+    return IOBDocument(source, *_parse_fields(text))
+
+
+def read_iob(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        return parse_iob_text(f.read(), source=file_path)
+
+
+# (sentences, labels) as lists of token lists and label lists, for callers that
+# hand sentences straight to a tokenizer or seqeval
+def read_sentences(file_path):
+    with open(file_path, "r", encoding="utf-8") as f:
+        tokens, labels, sentence_starts = _parse_fields(f.read())
+    bounds = list(zip(sentence_starts, sentence_starts[1:]))
+    return [tokens[a:b] for a, b in bounds], [labels[a:b] for a, b in bounds]
+
+
+# Stream (tokens, labels) one sentence at a time without holding the file in memory
+def iter_sentences(file_path):
+    tokens, labels = [], []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                if tokens:
+                    yield tokens, labels
+                    tokens, labels = [], []
+                continue
+            fields = _line_fields(line)
+            if fields:
+                tokens.append(fields[0])
+                labels.append(fields[1])
+    if tokens:
+        yield tokens, labels
+
+
+# .iob text for (tokens, labels) sentences: "token<TAB>label" lines with a blank
+# line after every sentence (the layout cleaning-data.py produces). Labels may be
+# names or ids into LABELS.
+def format_iob(sentences):
+    parts = []
+    for tokens, labels in sentences:
+        if len(tokens) == 0:
+            continue
+        if not isinstance(labels[0], str):
+            labels = [LABELS[i] for i in labels]
+        parts.append("".join(f"{token}\t{label}\n" for token, label in zip(tokens, labels)))
+        parts.append("\n")
+    return "".join(parts)
+
+
+# Written to a temporary file first and moved into place, so a file that is a
+# hard link (split_balance.py links split files to queue/) is replaced, never
+# rewritten through the link
+def write_iob(file_path, sentences):
+    tmp_path = f"{file_path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(format_iob(sentences))
+    os.replace(tmp_path, file_path)
+
+
+def write_document(file_path, document):
+    write_iob(file_path, document.sentences())
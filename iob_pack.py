@@ -0,0 +1,296 @@
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+
+import numpy as np
+
+from iob_format import IOBDocument, LABELS, format_iob, label_ids, read_iob, read_sentences, write_document
+from queue_manifest import file_hash, text_hash
+
+PACK_SUFFIX = ".iobpack"
+LIST_SUFFIX = ".list"  # A document list: one document path per line, relative to the list's folder
+MAGIC = b"IOBPACK\0"
+PACK_VERSION = 1
+ALIGNMENT = 64  # Every array starts on a 64-byte boundary so it can be viewed in place
+
+# Packed corpus layout (little-endian):
+#   8 bytes   MAGIC
+#   8 bytes   length of the JSON header
+#   header    {"version", "labels": [...], "sources": [...], "arrays": {name: [offset, dtype, count]}}
+#   arrays    at data_start + offset, data_start being the header end rounded up to ALIGNMENT
+#
+# Arrays:
+#   doc_sentences   int64  [documents + 1]  first sentence of every document, plus an end marker
+#   sentence_starts int64  [sentences + 1]  first token of every sentence, plus an end marker
+#   token_ids       uint32 [tokens]         index into the string table
+#   labels          uint8  [tokens]         index into the header's "labels"
+#   string_offsets  int64  [strings + 1]    byte offsets of every distinct token in string_data
+#   string_data     uint8  [bytes]          UTF-8 text of the distinct tokens
+#
+# Anywhere the tools take an .iob folder they also take a packed file; the
+# documents inside it are addressed as "<pack>/<source>", e.g.
+# "train_data/train.iobpack/052125_1.iob". They also take a document list
+# (LIST_SUFFIX), which names documents that live in other folders or packs.
+
+
+def _align(n):
+    return -(-n // ALIGNMENT) * ALIGNMENT
+
+
+# Write documents (IOBDocument objects) into one packed file. Token text is
+# interned, so a token that occurs many times is stored once.
+def pack_documents(documents, output_path):
+    strings = {}
+    sources, doc_sentences, sentence_starts, token_ids, labels = [], [0], [0], [], []
+    n_tokens = 0
+    for document in documents:
+        sources.append(os.path.basename(document.source))
+        token_ids.append(np.fromiter(
+            (strings.setdefault(token, len(strings)) for token in document.tokens()),
+            dtype=np.uint32, count=len(document)
+        ))
+        labels.append(document.labels)
+        sentence_starts.append(document.sentence_starts[1:] + n_tokens)
+        doc_sentences.append(doc_sentences[-1] + document.num_sentences)
+        n_tokens += len(document)
+
+    encoded = [token.encode("utf-8") for token in strings]
+    string_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=string_offsets[1:])
+    arrays = {
+        "doc_sentences": np.asarray(doc_sentences, dtype=np.int64),
+        "sentence_starts": np.concatenate([[0]] + sentence_starts[1:]).astype(np.int64),
+        "token_ids": np.concatenate(token_ids or [np.zeros(0, dtype=np.uint32)]),
+        "labels": np.concatenate(labels or [np.zeros(0, dtype=np.uint8)]).astype(np.uint8),
+        "string_offsets": string_offsets,
+        "string_data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+    }
+
+    layout, offset = {}, 0
+    for name, array in arrays.items():
+        layout[name] = [offset, array.dtype.str, len(array)]
+        offset = _align(offset + array.nbytes)
+    header = json.dumps({
+        "version": PACK_VERSION, "labels": list(LABELS), "sources": sources, "arrays": layout
+    }).encode("utf-8")
+    data_start = _align(len(MAGIC) + 8 + len(header))
+
+    tmp_path = f"{output_path}.tmp{os.getpid()}"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, array in arrays.items():
+            f.seek(data_start + layout[name][0])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, output_path)
+    return len(sources), len(arrays["sentence_starts"]) - 1, n_tokens
+
+
+# Read-only, memory-mapped view of a packed file. Opening it only parses the
+# header; documents and sentences are decoded on demand, so any one of them is
+# reachable without reading the rest of the corpus.
+class PackedCorpus:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a packed corpus")
+        (header_len,) = struct.unpack("<Q", self._mmap[len(MAGIC):len(MAGIC) + 8])
+        header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + header_len])
+        if header["version"] != PACK_VERSION:
+            raise ValueError(f"{path} has pack version {header['version']}, expected {PACK_VERSION}")
+
+        data_start = _align(len(MAGIC) + 8 + header_len)
+        for name, (offset, dtype, count) in header["arrays"].items():
+            setattr(self, name, np.frombuffer(self._mmap, dtype=dtype, count=count, offset=data_start + offset))
+        self.sources = header["sources"]
+        self.index = {source: i for i, source in enumerate(self.sources)}
+        # Label ids in the file -> ids in this process's LABELS
+        self.label_map = label_ids(header["labels"])
+        self._strings = None
+
+    def __len__(self):
+        return len(self.sources)
+
+    @property
+    def num_sentences(self):
+        return len(self.sentence_starts) - 1
+
+    # The string table holds distinct tokens only, so it is decoded once, on first use
+    def _tokens(self, start, stop):
+        if self._strings is None:
+            data, offsets = bytes(self.string_data), self.string_offsets.tolist()
+            self._strings = np.array([data[a:b].decode("utf-8") for a, b in zip(offsets, offsets[1:])], dtype=object)
+        return self._strings[self.token_ids[start:stop]].tolist()
+
+    def _labels(self, start, stop):
+        return self.label_map[self.labels[start:stop]]
+
+    def _sentence_range(self, i):
+        return int(self.doc_sentences[i]), int(self.doc_sentences[i + 1])
+
+    def document(self, i):
+        if isinstance(i, str):
+            i = self.index[i]
+        first, last = self._sentence_range(i)
+        starts = self.sentence_starts[first:last + 1]
+        start, stop = int(starts[0]), int(starts[-1])
+        return IOBDocument(
+            os.path.join(self.path, self.sources[i]), self._tokens(start, stop), self._labels(start, stop), starts - start
+        )
+
+    def documents(self):
+        for i in range(len(self)):
+            yield self.document(i)
+
+    # (tokens, label names) of the i-th sentence of the whole corpus
+    def sentence(self, i):
+        start, stop = int(self.sentence_starts[i]), int(self.sentence_starts[i + 1])
+        return self._tokens(start, stop), [LABELS[j] for j in self._labels(start, stop).tolist()]
+
+    # (sentences, labels) of a document as lists of token lists and label lists,
+    # the shape iob_format.read_sentences returns
+    def sentence_lists(self, i):
+        if isinstance(i, str):
+            i = self.index[i]
+        first, last = self._sentence_range(i)
+        starts = self.sentence_starts[first:last + 1].tolist()
+        start, stop = starts[0], starts[-1]
+        tokens = self._tokens(start, stop)
+        labels = [LABELS[j] for j in self._labels(start, stop).tolist()]
+        bounds = [(a - start, b - start) for a, b in zip(starts, starts[1:])]
+        return [tokens[a:b] for a, b in bounds], [labels[a:b] for a, b in bounds]
+
+    # Corpus-wide sentence indices belonging to a document
+    def document_sentences(self, i):
+        if isinstance(i, str):
+            i = self.index[i]
+        return range(*self._sentence_range(i))
+
+
+_open_packs = {}
+
+
+# One PackedCorpus per file and process, reopened when the file changes
+def open_pack(path):
+    stat = os.stat(path)
+    stamp = (stat.st_size, stat.st_mtime_ns)
+    cached = _open_packs.get(path)
+    if cached is None or cached[0] != stamp:
+        cached = _open_packs[path] = (stamp, PackedCorpus(path))
+    return cached[1]
+
+
+def is_pack(path):
+    return path.endswith(PACK_SUFFIX) and os.path.isfile(path)
+
+
+# (pack path, source) for a document inside a pack, None for a plain file
+def split_document_path(path):
+    pack_path, source = os.path.split(path)
+    return (pack_path, source) if is_pack(pack_path) else None
+
+
+def is_list(path):
+    return path.endswith(LIST_SUFFIX) and os.path.isfile(path)
+
+
+# Document paths of a corpus: the .iob files of a folder (in listing order,
+# like the scripts always used), the documents of a packed file or the
+# documents named in a document list
+def list_documents(path):
+    if is_pack(path):
+        return [os.path.join(path, source) for source in open_pack(path).sources]
+    if is_list(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return [os.path.normpath(os.path.join(os.path.dirname(path), line)) for line in f.read().splitlines() if line]
+    return [os.path.join(path, f) for f in os.listdir(path) if f.endswith(".iob")]
+
+
+# Write a document list naming the given document paths
+def write_document_list(paths, list_path):
+    folder = os.path.dirname(os.path.abspath(list_path))
+    tmp_path = f"{list_path}.tmp{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.writelines(os.path.relpath(os.path.abspath(path), folder) + "\n" for path in paths)
+    os.replace(tmp_path, list_path)
+
+
+def read_document(path):
+    packed = split_document_path(path)
+    if packed is None:
+        return read_iob(path)
+    pack_path, source = packed
+    return open_pack(pack_path).document(source)
+
+
+# Same as iob_format.read_sentences, for a plain or packed document
+def read_document_sentences(path):
+    packed = split_document_path(path)
+    if packed is None:
+        return read_sentences(path)
+    pack_path, source = packed
+    return open_pack(pack_path).sentence_lists(source)
+
+
+# Content hash of a document. For a packed document it is the hash of the .iob
+# text it unpacks to, which is the file hash of the .iob file it was packed
+# from, so caches keyed by content carry over between the two formats.
+def document_hash(path):
+    if split_document_path(path) is None:
+        return file_hash(path)
+    return text_hash(format_iob(read_document(path).sentences()))
+
+
+# Copy one document, plain or packed, to an .iob file
+def export_document(path, output_path):
+    if split_document_path(path) is None:
+        shutil.copyfile(path, output_path)
+    else:
+        write_document(output_path, read_document(path))
+
+
+def pack_folder(folder, output_path):
+    paths = sorted(list_documents(folder))
+    return pack_documents((read_document(path) for path in paths), output_path)
+
+
+def unpack(pack_path, output_folder):
+    os.makedirs(output_folder, exist_ok=True)
+    corpus = PackedCorpus(pack_path)
+    for document in corpus.documents():
+        write_document(os.path.join(output_folder, os.path.basename(document.source)), document)
+    return len(corpus)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between .iob folders and packed corpus files.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    pack_parser = commands.add_parser("pack", help="Pack the .iob files of a folder into one file")
+    pack_parser.add_argument("folder")
+    pack_parser.add_argument("output", help=f"Packed file to write (usually *{PACK_SUFFIX})")
+    unpack_parser = commands.add_parser("unpack", help="Write every document of a packed file back to .iob")
+    unpack_parser.add_argument("pack")
+    unpack_parser.add_argument("folder")
+    info_parser = commands.add_parser("info", help="Show what a packed file holds")
+    info_parser.add_argument("pack")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        documents, sentences, tokens = pack_folder(args.folder, args.output)
+        size = os.path.getsize(args.output)
+        print(f"📦 Packed {documents} documents ({sentences} sentences, {tokens} tokens) into {args.output} ({size / 1e6:.2f} MB)")
+    elif args.command == "unpack":
+        print(f"📂 Unpacked {unpack(args.pack, args.folder)} documents into {args.folder}")
+    else:
+        corpus = PackedCorpus(args.pack)
+        print(f"📦 {args.pack}: {len(corpus)} documents, {corpus.num_sentences} sentences, "
+              f"{len(corpus.token_ids)} tokens, {len(corpus.string_offsets) - 1} distinct tokens")
+
+
+if __name__ == "__main__":
+    main()
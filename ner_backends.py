@@ -0,0 +1,59 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+from transformers import AutoConfig, AutoModelForTokenClassification
+
+ONNX_MODEL_FILE = "model.onnx"
+
+# Backend name -> where its artifact is written by default
+BACKEND_PATHS = {
+    "torch": "./bert-legal-ner",
+    "int8": "./bert-legal-ner-int8",  # quantize_model.py
+    "onnx": "./bert-legal-ner-onnx",  # export_onnx.py
+}
+
+
+# Runs an exported token-classification graph with ONNX Runtime while looking
+# like a transformers model to the callers: it has .config and .device, and
+# calling it with tensors returns an object with a .logits tensor
+class OnnxTokenClassifier:
+    def __init__(self, path, threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            os.path.join(path, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.config = AutoConfig.from_pretrained(path)
+        self.device = torch.device("cpu")
+
+    def eval(self):
+        return self
+
+    def __call__(self, **inputs):
+        # Inputs the graph was not exported with (e.g. token_type_ids) are dropped
+        feed = {name: value.cpu().numpy().astype(np.int64) for name, value in inputs.items() if name in self.input_names}
+        logits = self.session.run(["logits"], feed)[0]
+        return SimpleNamespace(logits=torch.from_numpy(logits))
+
+
+# Load a token-classification model for the given backend ("torch", "int8" or "onnx")
+def load_backend(backend="torch", path=None, threads=None):
+    path = path or BACKEND_PATHS[backend]
+    if backend == "torch":
+        model = AutoModelForTokenClassification.from_pretrained(path)
+    elif backend == "int8":
+        from quantize_model import load_quantized_model  # Imports the evaluation stack, only needed here
+        model = load_quantized_model(path)
+    elif backend == "onnx":
+        model = OnnxTokenClassifier(path, threads)
+    else:
+        raise ValueError(f"Unknown backend '{backend}'. Expected one of: {', '.join(BACKEND_PATHS)}")
+    model.eval()
+    return model
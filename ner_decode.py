@@ -0,0 +1,145 @@
+import numpy as np
+
+# How the subwords of a word are combined into the word's label and score:
+#   first   - the label and probability of the word's first subword
+#   average - the label with the highest mean probability over the word's subwords
+#   max     - the label of the word's single most confident subword
+AGGREGATIONS = ("first", "average", "max")
+
+# Everything here works on flat arrays covering a whole batch: one row per
+# subword, with word_ids (-1 for special and padding positions) and doc_ids
+# (which document or sentence the subword belongs to). A word is a run of
+# subwords with the same word id in the same document.
+
+
+# None-padded word ids from a tokenizer encoding as an int array (-1 for None)
+def word_id_array(word_ids):
+    return np.fromiter((-1 if w is None else w for w in word_ids), dtype=np.int64, count=len(word_ids))
+
+
+# Positions of the first and last subword of every word
+def word_bounds(word_ids, doc_ids):
+    positions = np.flatnonzero(word_ids >= 0)
+    starts = np.ones(len(positions), dtype=bool)
+    starts[1:] = (word_ids[positions[1:]] != word_ids[positions[:-1]]) | (doc_ids[positions[1:]] != doc_ids[positions[:-1]])
+    ends = np.ones(len(positions), dtype=bool)
+    ends[:-1] = starts[1:]
+    return positions[starts], positions[ends]
+
+
+# Label id and score of every word from subword probabilities ([subwords, labels])
+def aggregate_words(probs, word_ids, doc_ids, aggregation="first"):
+    if aggregation not in AGGREGATIONS:
+        raise ValueError(f"Unknown aggregation '{aggregation}', expected one of {AGGREGATIONS}")
+    first, _ = word_bounds(word_ids, doc_ids)
+    if aggregation == "first":
+        word_probs = probs[first]
+        return word_probs.argmax(-1), word_probs.max(-1)
+
+    positions = np.flatnonzero(word_ids >= 0)
+    word_starts = np.searchsorted(positions, first)
+    if aggregation == "average":
+        sums = np.add.reduceat(probs[positions], word_starts, axis=0)
+        word_probs = sums / np.diff(np.append(word_starts, len(positions)))[:, None]
+        return word_probs.argmax(-1), word_probs.max(-1)
+
+    # max: per word, the subword with the highest probability (the first one on ties)
+    scores, labels = probs[positions].max(-1), probs[positions].argmax(-1)
+    word_of = np.repeat(np.arange(len(first)), np.diff(np.append(word_starts, len(positions))))
+    order = np.lexsort((-scores, word_of))
+    best = order[np.searchsorted(word_of[order], np.arange(len(first)))]
+    return labels[best], scores[best]
+
+
+# Per-subword (label id, score) where every subword of a word carries its
+# word's aggregated values (other positions keep their own argmax), so reading
+# the first subword of each word later gives the aggregated result. This is the
+# compact form the prediction caches store.
+def aggregate_subwords(probs, word_ids, doc_ids, aggregation="first"):
+    label_ids, scores = probs.argmax(-1), probs.max(-1)
+    if aggregation == "first":
+        return label_ids, scores
+    word_labels, word_scores = aggregate_words(probs, word_ids, doc_ids, aggregation)
+    first, _ = word_bounds(word_ids, doc_ids)
+    positions = np.flatnonzero(word_ids >= 0)
+    counts = np.diff(np.append(np.searchsorted(positions, first), len(positions)))
+    label_ids[positions] = np.repeat(word_labels, counts)
+    scores[positions] = np.repeat(word_scores, counts)
+    return label_ids, scores
+
+
+# aggregate_subwords for a padded batch: probs [rows, length, labels] and
+# word_ids [rows, length]; returns [rows, length] label ids and scores
+def aggregate_batch(probs, word_ids, aggregation="first"):
+    label_ids, scores = probs.argmax(-1), probs.max(-1)
+    if aggregation != "first":
+        rows, cols = np.nonzero(word_ids >= 0)
+        label_ids[rows, cols], scores[rows, cols] = aggregate_subwords(
+            probs[rows, cols], word_ids[rows, cols], rows, aggregation
+        )
+    return label_ids, scores
+
+
+# Lookup tables indexed by label id: entity type index (-1 for O), whether the
+# label continues an entity (I-), and the entity type names. Labels without a
+# B-/I- prefix are entity types of their own that start a new entity.
+def label_types(id2label):
+    names = [id2label[i] for i in range(len(id2label))]
+    types, type_index, inside = [], {}, []
+    for name in names:
+        prefix, entity_type = name.split("-", 1) if "-" in name else ("B", name)
+        types.append(-1 if name == "O" else type_index.setdefault(entity_type, len(type_index)))
+        inside.append(prefix == "I")
+    return np.array(types, dtype=np.int64), np.array(inside), list(type_index)
+
+
+# Entity spans from per-subword label ids and scores (only the first subword of
+# each word is read). Invalid BIO sequences are repaired the usual way: an I-
+# tag that doesn't continue an entity of the same type starts a new one. An
+# entity's score is the mean of its word scores and it spans from its first
+# word's first subword to its last word's last subword; entities scoring below
+# thresholds[type] are dropped. Returns parallel arrays (doc, type, start, end,
+# score) in document order plus the type names.
+def decode_spans(label_ids, scores, word_ids, doc_ids, offsets, id2label, thresholds=None):
+    types, inside, type_names = label_types(id2label)
+    first, last = word_bounds(word_ids, doc_ids)
+    word_labels = np.asarray(label_ids)[first]
+    word_type, word_doc = types[word_labels], doc_ids[first]
+
+    continues = np.zeros(len(first), dtype=bool)
+    continues[1:] = (word_type[1:] == word_type[:-1]) & (word_doc[1:] == word_doc[:-1])
+    continues &= inside[word_labels]
+    entity_words = np.flatnonzero(word_type >= 0)
+    begins = ~continues[entity_words]
+    entity_id = np.cumsum(begins) - 1
+    n_entities = int(begins.sum())
+    first_word = entity_words[begins]
+    ends = np.ones(len(begins), dtype=bool)
+    ends[:-1] = begins[1:]
+    last_word = entity_words[ends]
+
+    counts = np.bincount(entity_id, minlength=n_entities)
+    word_scores = np.asarray(scores, dtype=np.float64)[first[entity_words]]
+    spans = {
+        "doc": word_doc[first_word],
+        "type": word_type[first_word],
+        "start": offsets[first[first_word], 0],
+        "end": offsets[last[last_word], 1],
+        "score": np.bincount(entity_id, weights=word_scores, minlength=n_entities) / np.maximum(counts, 1),
+    }
+    if thresholds:
+        minimum = np.array([thresholds.get(name, 0.0) for name in type_names])
+        keep = spans["score"] >= minimum[spans["type"]]
+        spans = {key: values[keep] for key, values in spans.items()}
+    return spans, type_names
+
+
+# Group spans into per-document entity dicts (entity_group, start, end, score, word)
+def spans_to_entities(spans, type_names, texts):
+    entities = [[] for _ in texts]
+    for doc, entity_type, start, end, score in zip(*(spans[key].tolist() for key in ("doc", "type", "start", "end", "score"))):
+        entities[doc].append({
+            "entity_group": type_names[entity_type], "start": start, "end": end, "score": score, "word": texts[doc][start:end],
+        })
+    return entities
+
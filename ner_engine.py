@@ -0,0 +1,145 @@
+import numpy as np
+import torch
+
+from ner_decode import aggregate_subwords, decode_spans, spans_to_entities, word_id_array
+from ner_windows import MAX_LENGTH, STRIDE, owned_ranges, window_starts
+
+# Batching limits: a batch never holds more than MAX_BATCH_SIZE windows and its
+# padded size (windows x longest window) never exceeds MAX_TOKENS_PER_BATCH
+MAX_TOKENS_PER_BATCH = 8192
+MAX_BATCH_SIZE = 32
+
+
+# Group window indices into batches, shortest windows first, so that every batch
+# is padded only up to its own longest window and stays within the token budget
+def plan_batches(lengths, max_tokens=MAX_TOKENS_PER_BATCH, max_batch_size=MAX_BATCH_SIZE):
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    current, current_max = [], 0
+    for idx in order:
+        longest = max(current_max, lengths[idx])
+        if current and (longest * (len(current) + 1) > max_tokens or len(current) >= max_batch_size):
+            batches.append(current)
+            current, longest = [], lengths[idx]
+        current.append(idx)
+        current_max = longest
+    if current:
+        batches.append(current)
+    return batches
+
+
+# Pad a list of id sequences to the longest one in the batch
+def pad_batch(sequences, pad_token_id):
+    longest = max(len(seq) for seq in sequences)
+    input_ids = torch.full((len(sequences), longest), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(sequences), longest), dtype=torch.long)
+    for row, seq in enumerate(sequences):
+        input_ids[row, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+        attention_mask[row, :len(seq)] = 1
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+# Run the model over every window and return per-window label probabilities,
+# trimmed to the window's real length and in the original window order
+def predict_windows(model, windows, pad_token_id, max_tokens=MAX_TOKENS_PER_BATCH, max_batch_size=MAX_BATCH_SIZE):
+    lengths = [len(window) for window in windows]
+    probabilities = [None] * len(windows)
+    model.eval()
+    with torch.inference_mode():
+        for batch in plan_batches(lengths, max_tokens, max_batch_size):
+            inputs = pad_batch([windows[i] for i in batch], pad_token_id)
+            inputs = {k: v.to(model.device) for k, v in inputs.items()}
+            logits = model(**inputs).logits
+            probs = torch.softmax(logits.float(), dim=-1).cpu().numpy()
+            for row, idx in enumerate(batch):
+                probabilities[idx] = probs[row, :lengths[idx]]
+    return probabilities
+
+
+# Cut every document into overlapping id windows from a single tokenizer pass.
+# Returns the windows plus, per document, its encoding and the (window index,
+# start, owned range) triples needed to stitch the window outputs back together.
+def plan_windows(texts, tokenizer, max_length=MAX_LENGTH, stride=STRIDE):
+    size = max_length - 2  # Room for [CLS] and [SEP]
+    encodings = tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+    windows, plans = [], []
+    for doc_idx in range(len(texts)):
+        ids = encodings["input_ids"][doc_idx]
+        starts = window_starts(len(ids), size, stride)
+        plan = []
+        for start, owned in zip(starts, owned_ranges(starts, size, len(ids))):
+            plan.append((len(windows), start, owned))
+            windows.append([tokenizer.cls_token_id] + ids[start:start + size] + [tokenizer.sep_token_id])
+        plans.append(plan)
+    return encodings, windows, plans
+
+
+# Merge window probabilities into one row per document subword. Where windows
+# overlap, each subword keeps the prediction of the window that gives it the
+# most context on both sides.
+def stitch_windows(probabilities, plan, n_tokens):
+    num_labels = probabilities[plan[0][0]].shape[-1]
+    stitched = np.zeros((n_tokens, num_labels), dtype=np.float32)
+    for window_idx, start, (lo, hi) in plan:
+        stitched[lo:hi] = probabilities[window_idx][1 + lo - start:1 + hi - start]  # +1 skips [CLS]
+    return stitched
+
+
+# Run NER over many documents at once. Windows from all documents are batched
+# together by length, stitched back per document and decoded (see ner_decode)
+# into entities whose start/end offsets point into the original document text.
+# With a PredictionCache, documents it already holds skip the model entirely;
+# its settings must include the aggregation, since the stored labels are per word.
+# skip_window(doc_idx, char_start, char_end), if given, is asked about every
+# window; windows it returns True for are not run and read as all "O".
+def run_documents(texts, model, tokenizer, max_length=MAX_LENGTH, stride=STRIDE,
+                  max_tokens=MAX_TOKENS_PER_BATCH, max_batch_size=MAX_BATCH_SIZE, cache=None,
+                  aggregation="first", thresholds=None, skip_window=None):
+    if not texts:
+        return []
+    encodings, windows, plans = plan_windows(texts, tokenizer, max_length, stride)
+    word_ids = [word_id_array(encodings.word_ids(doc_idx)) for doc_idx in range(len(texts))]
+    token_labels = [cache.get(text) if cache is not None else None for text in texts]
+
+    missing = [doc_idx for doc_idx, labels in enumerate(token_labels) if labels is None]
+    needed, skipped = [], []
+    for doc_idx in missing:
+        offsets = encodings["offset_mapping"][doc_idx]
+        for window_idx, start, _ in plans[doc_idx]:
+            window_offsets = offsets[start:start + len(windows[window_idx]) - 2]
+            if skip_window is not None and window_offsets and skip_window(doc_idx, window_offsets[0][0], window_offsets[-1][1]):
+                skipped.append(window_idx)
+            else:
+                needed.append(window_idx)
+    probabilities = dict(zip(
+        needed, predict_windows(model, [windows[i] for i in needed], tokenizer.pad_token_id, max_tokens, max_batch_size)
+    ))
+    if skipped:
+        outside = np.zeros(len(model.config.id2label), dtype=np.float32)
+        outside[model.config.label2id.get("O", 0)] = 1.0
+        probabilities.update((i, np.tile(outside, (len(windows[i]), 1))) for i in skipped)
+    if missing:
+        # Aggregate the subwords of all missed documents in one go
+        lengths = [len(word_ids[doc_idx]) for doc_idx in missing]
+        probs = np.concatenate([stitch_windows(probabilities, plans[doc_idx], n) for doc_idx, n in zip(missing, lengths)])
+        label_ids, scores = aggregate_subwords(
+            probs, np.concatenate([word_ids[doc_idx] for doc_idx in missing]), np.repeat(missing, lengths), aggregation
+        )
+        bounds = np.cumsum([0] + lengths)
+        for k, doc_idx in enumerate(missing):
+            token_labels[doc_idx] = (label_ids[bounds[k]:bounds[k + 1]], scores[bounds[k]:bounds[k + 1]])
+            if cache is not None:
+                # Decode the stored (compact) values, so a later hit gives exactly the same entities
+                token_labels[doc_idx] = cache.put(texts[doc_idx], *token_labels[doc_idx])
+
+    lengths = [len(ids) for ids in word_ids]
+    spans, type_names = decode_spans(
+        np.concatenate([labels for labels, _ in token_labels]),
+        np.concatenate([scores for _, scores in token_labels]),
+        np.concatenate(word_ids),
+        np.repeat(np.arange(len(texts)), lengths),
+        np.array([offset for offsets in encodings["offset_mapping"] for offset in offsets], dtype=np.int64).reshape(-1, 2),
+        model.config.id2label,
+        thresholds,
+    )
+    return spans_to_entities(spans, type_names, texts)
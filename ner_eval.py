@@ -0,0 +1,245 @@
+import os
+
+import numpy as np
+import pandas as pd
+import torch
+import evaluate
+
+from iob_pack import read_document_sentences
+from ner_decode import aggregate_batch, word_bounds, word_id_array
+from ner_engine import MAX_BATCH_SIZE, MAX_TOKENS_PER_BATCH, pad_batch, plan_batches
+
+# Only 7 entity types (excluding 'O')
+ENTITY_TYPES = ['INS', 'STA', 'RA', 'PROM_DATE', 'CASE_NUM', 'PERSON']
+ENTITY_INDEX = {name: i for i, name in enumerate(ENTITY_TYPES)}
+
+
+def strip_prefix(label):
+    return label.replace("B-", "").replace("I-", "")
+
+
+# Word-level label names per sentence, read from the first subword of every word (which
+# carries the word's aggregated label); all sentences are aligned in one array pass
+def align_predictions(model, predictions, tokenized_inputs):
+    if not predictions:
+        return []
+    id2label = model.config.id2label
+    names = np.array([id2label[i] for i in range(len(id2label))], dtype=object)
+    word_ids = [word_id_array(tokenized_inputs.word_ids(batch_index=i)) for i in range(len(predictions))]
+    sentence_ids = np.repeat(np.arange(len(predictions)), [len(ids) for ids in word_ids])
+    first, _ = word_bounds(np.concatenate(word_ids), sentence_ids)
+    labels = names[np.concatenate(predictions)[first]].tolist()
+    bounds = np.cumsum(np.bincount(sentence_ids[first], minlength=len(predictions))).tolist()
+    return [labels[a:b] for a, b in zip([0] + bounds, bounds)]
+
+
+# Predicted label ids per tokenized sentence (unpadded). Sentences of similar length are batched
+# together and only the (word-aggregated) argmax of each batch is kept, so no logits outlive their
+# batch. Sentences found in the prediction cache (keyed by their tab-joined words) skip the model.
+def predict_label_ids(model, tokenizer, tokenized_inputs, sentences, max_tokens=MAX_TOKENS_PER_BATCH,
+                      max_batch_size=MAX_BATCH_SIZE, aggregation="first", cache=None):
+    input_ids = tokenized_inputs["input_ids"]
+    lengths = [len(ids) for ids in input_ids]
+    keys = ["\t".join(sentence) for sentence in sentences]
+    predictions = [None] * len(input_ids)
+    if cache is not None:
+        predictions = [None if hit is None else hit[0] for hit in map(cache.get, keys)]
+    missing = [i for i, pred in enumerate(predictions) if pred is None]
+
+    with torch.inference_mode():
+        for batch in plan_batches([lengths[i] for i in missing], max_tokens, max_batch_size):
+            batch = [missing[i] for i in batch]
+            inputs = pad_batch([input_ids[i] for i in batch], tokenizer.pad_token_id)
+            inputs = {k: v.to(model.device) for k, v in inputs.items()}
+            probs = torch.softmax(model(**inputs).logits.float(), dim=2).cpu().numpy()
+            batch_word_ids = np.full(probs.shape[:2], -1, dtype=np.int64)
+            for row, idx in enumerate(batch):
+                batch_word_ids[row, :lengths[idx]] = word_id_array(tokenized_inputs.word_ids(batch_index=idx))
+            batch_predictions, batch_scores = aggregate_batch(probs, batch_word_ids, aggregation)
+            for row, idx in enumerate(batch):
+                predictions[idx] = batch_predictions[row, :lengths[idx]]
+                if cache is not None:
+                    cache.put(keys[idx], predictions[idx], batch_scores[row, :lengths[idx]])
+    return predictions
+
+
+# Predict the labels of one test file, the way test-model.py scores it: sentences are truncated
+# at the model's maximum length, and the file's true and predicted labels are cut to the shorter
+# of the two. Labels come back as small-int codes into the file's own label list, which keeps the
+# result cheap to send back from a worker process. Gold labels are only compared as names, so
+# labels the model doesn't know (like CNS) need no mapping.
+def predict_file(model, tokenizer, file_path, max_tokens=MAX_TOKENS_PER_BATCH, max_batch_size=MAX_BATCH_SIZE,
+                 aggregation="first", cache=None):
+    test_tokens, test_labels = read_document_sentences(file_path)
+
+    tokenized_inputs = tokenizer(test_tokens, truncation=True, is_split_into_words=True)
+    predictions = predict_label_ids(model, tokenizer, tokenized_inputs, test_tokens, max_tokens, max_batch_size,
+                                    aggregation, cache)
+    cleaned_labels = align_predictions(model, predictions, tokenized_inputs)
+
+    file_tokens = [token for sent_tokens in test_tokens for token in sent_tokens]
+    file_true = [label for sent_labels in test_labels for label in sent_labels]
+    file_pred = [label for sent_labels in cleaned_labels for label in sent_labels]
+
+    min_length = min(len(file_true), len(file_pred), len(file_tokens))
+    label_names, codes = np.unique(file_true[:min_length] + file_pred[:min_length], return_inverse=True)
+    return {
+        "source": os.path.basename(file_path),
+        "tokens": file_tokens[:min_length],
+        "label_names": label_names.tolist(),
+        "true": codes[:min_length].astype(np.uint8),
+        "pred": codes[min_length:].astype(np.uint8),
+    }
+
+
+# (true labels, predicted labels) of a predict_file result, as label names
+def file_labels(result):
+    label_names = result["label_names"]
+    return [label_names[code] for code in result["true"]], [label_names[code] for code in result["pred"]]
+
+
+# Entity-level confusion matrix from entity type indices (-1 for O and untracked
+# types): only tokens where both sides are tracked entities are counted, plus a
+# 'Missed' column (row total minus correct predictions)
+def entity_confusion_counts(true_entities, pred_entities):
+    true_entities, pred_entities = np.asarray(true_entities), np.asarray(pred_entities)
+    both = (true_entities >= 0) & (pred_entities >= 0)
+    n = len(ENTITY_TYPES)
+    conf_matrix = np.bincount(true_entities[both] * n + pred_entities[both], minlength=n * n).reshape(n, n)
+    conf_df = pd.DataFrame(conf_matrix, index=ENTITY_TYPES, columns=ENTITY_TYPES)
+    conf_df["Missed"] = conf_matrix.sum(axis=1) - np.diag(conf_matrix)
+    return conf_df
+
+
+def entity_confusion_matrix(true_labels, pred_labels):
+    entity_of = lambda label: ENTITY_INDEX.get(strip_prefix(label), -1)
+    return entity_confusion_counts(
+        np.fromiter(map(entity_of, true_labels), dtype=np.int64, count=len(true_labels)),
+        np.fromiter(map(entity_of, pred_labels), dtype=np.int64, count=len(pred_labels)),
+    )
+
+
+# Lookup tables indexed by label id: entity type index (-1 for O and untracked
+# types), a group id shared by B-/I- of the same type, and whether the label is O
+def label_tables(id2label):
+    names = [id2label[i] for i in range(len(id2label))]
+    groups = {}
+    return {
+        "entity": np.array([ENTITY_INDEX.get(strip_prefix(name), -1) for name in names]),
+        "group": np.array([groups.setdefault(strip_prefix(name), len(groups)) for name in names]),
+        "is_o": np.array([name == "O" for name in names]),
+        "names": names,
+    }
+
+
+# Flatten Trainer output to the subword positions that are scored (label != -100
+# and not a special token). word_ids holds one row per example (-1 for special
+# and padding positions, rows may be shorter than the predictions) and
+# doc_index the sequence each example came from. Returns parallel arrays in
+# example order: true and predicted label ids, sequence index and word index.
+def flatten_token_predictions(predictions, labels, word_ids, doc_index):
+    pred_ids = predictions.argmax(-1) if predictions.ndim == 3 else predictions
+    word_matrix = np.full(labels.shape, -1, dtype=np.int64)
+    for row, ids in enumerate(word_ids):
+        ids = ids[:labels.shape[1]]
+        word_matrix[row, :len(ids)] = ids
+    rows, cols = np.nonzero((labels != -100) & (word_matrix >= 0))
+    return {
+        "true": labels[rows, cols].astype(np.int64),
+        "pred": pred_ids[rows, cols].astype(np.int64),
+        "doc": np.asarray(doc_index)[rows],
+        "word": word_matrix[rows, cols],
+    }
+
+
+# NER-style 2x2 matrix: an entity counts as correct only with the exact tag;
+# a wrong entity tag is a false positive
+def ner_confusion_2x2(true_ids, pred_ids, id2label):
+    is_o = label_tables(id2label)["is_o"]
+    true_o, pred_o = is_o[true_ids], is_o[pred_ids]
+    tp = int(np.sum(~true_o & (true_ids == pred_ids)))
+    fp = int(np.sum(~pred_o & (true_o | (true_ids != pred_ids))))
+    fn = int(np.sum(~true_o & pred_o))
+    tn = int(np.sum(true_o & pred_o))
+    return pd.DataFrame(
+        [[tp, fn],
+         [fp, tn]],
+        index=["Actual: Entity", "Actual: Non-Entity"],
+        columns=["Predicted: Entity", "Predicted: Non-Entity"]
+    )
+
+
+# Same text as sklearn's classification_report(..., zero_division=0) over the
+# label names, with the per-label counts taken from bincounts of the label ids
+def classification_report_from_ids(true_ids, pred_ids, id2label, digits=4):
+    n_labels = len(id2label)
+    support = np.bincount(true_ids, minlength=n_labels)
+    predicted = np.bincount(pred_ids, minlength=n_labels)
+    correct = np.bincount(true_ids[true_ids == pred_ids], minlength=n_labels)
+
+    present = np.nonzero(support + predicted)[0]
+    names = [id2label[i] for i in present]
+    order = np.argsort(names, kind="stable")  # sklearn sorts the label names
+    present, names = present[order], [names[i] for i in order]
+    support, predicted, correct = support[present], predicted[present], correct[present]
+
+    safe_divide = lambda a, b: np.divide(a, b, out=np.zeros(len(a)), where=b > 0)
+    precision = safe_divide(correct, predicted)
+    recall = safe_divide(correct, support)
+    f1 = safe_divide(2 * correct, predicted + support)
+    total = int(support.sum())
+
+    headers = ["precision", "recall", "f1-score", "support"]
+    width = max(max(len(name) for name in names), len("weighted avg"), digits)
+    row_fmt = "{:>{width}s} " + " {:>9.{digits}f}" * 3 + " {:>9}\n"
+    report = ("{:>{width}s} " + " {:>9}" * len(headers)).format("", *headers, width=width) + "\n\n"
+    for name, p, r, f, s in zip(names, precision, recall, f1, support):
+        report += row_fmt.format(name, p, r, f, int(s), width=width, digits=digits)
+    report += "\n"
+    accuracy = correct.sum() / total if total else 0.0
+    report += ("{:>{width}s} " + " {:>9.{digits}}" * 2 + " {:>9.{digits}f}" + " {:>9}\n").format(
+        "accuracy", "", "", accuracy, total, width=width, digits=digits
+    )
+    weighted = lambda values: np.average(values, weights=support) if total else 0.0
+    for heading, avg in [("macro avg", np.mean), ("weighted avg", weighted)]:
+        report += row_fmt.format(heading, avg(precision), avg(recall), avg(f1), total, width=width, digits=digits)
+    return report
+
+
+# Tokens whose entity type was mispredicted, grouped by true entity type. Tokens
+# truly labelled O and B-/I- confusions within a type are left out; each
+# (true, predicted, token, file) combination is listed once, in eval order.
+def group_mismatches(flat, id2label, eval_tokens, eval_sources):
+    tables = label_tables(id2label)
+    true_ids, pred_ids = flat["true"], flat["pred"]
+    tracked = tables["entity"] >= 0
+    wrong = (
+        ~tables["is_o"][true_ids]
+        & (tables["group"][true_ids] != tables["group"][pred_ids])
+        & (tracked[true_ids] | tracked[pred_ids])
+    )
+
+    names = tables["names"]
+    seen_mismatches = set()
+    grouped_mismatches = {}
+    for true_id, pred_id, doc, word in zip(true_ids[wrong], pred_ids[wrong], flat["doc"][wrong], flat["word"][wrong]):
+        true_entity, pred_entity = strip_prefix(names[true_id]), strip_prefix(names[pred_id])
+        key = (true_entity, pred_entity, eval_tokens[doc][word], eval_sources[doc])
+        if key not in seen_mismatches:
+            seen_mismatches.add(key)
+            grouped_mismatches.setdefault(true_entity, []).append(key[1:])
+    return grouped_mismatches
+
+
+# seqeval scores plus the entity confusion matrix for sentence-level label lists
+def evaluate_predictions(true_sentences, pred_sentences):
+    seqeval = evaluate.load("seqeval")
+    results = seqeval.compute(predictions=pred_sentences, references=true_sentences)
+    flat_true = [label for sentence in true_sentences for label in sentence]
+    flat_pred = [label for sentence in pred_sentences for label in sentence]
+    return {
+        "f1": results["overall_f1"],
+        "precision": results["overall_precision"],
+        "recall": results["overall_recall"],
+        "confusion_matrix": entity_confusion_matrix(flat_true, flat_pred),
+    }
@@ -0,0 +1,179 @@
+import hashlib
+import re
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from iob_format import entity_spans
+from iob_pack import list_documents, read_document
+
+# Entity types regular enough to be found by patterns
+RULE_TYPES = ("CASE_NUM", "PROM_DATE", "RA")
+# How rule matches are combined with the model:
+#   model  - model only (rules unused)
+#   hybrid - model over every window, rule matches merged in (they win where the two overlap)
+#   skip   - like hybrid, but windows with nothing left for the model after the rules are not run
+#   rules  - rules only, no model at all (the cheap fallback)
+RULE_MODES = ("model", "hybrid", "skip", "rules")
+RULE_SCORE = 1.0  # Score reported for rule matches
+
+# Every pattern allows optional whitespace around punctuation, so it matches both
+# raw text ("G.R. No. 123456") and space-joined tokens ("G . R . No . 123456")
+S = r"\s*"
+MONTH = (r"(?:January|February|March|April|May|June|July|August|September|October|November|December"
+         r"|Jan|Feb|Mar|Apr|Jun|Jul|Aug|Sept?|Oct|Nov|Dec)")
+DATE = rf"(?i:{MONTH}{S}\.?{S}\d{{1,2}}{S},{S}\d{{4}}|\d{{1,2}}{S}{MONTH}{S}\d{{4}})"
+NUMBER = r"(?:[A-Z]{1,5}\s*-\s*)*\d[\dA-Z]*(?:\s*-\s*[\dA-Z]+)*"  # 123456, RTJ-09-2183, 00-2-03-SC
+NUMBERS = rf"{NUMBER}(?:{S}(?:,|and|&){S}{NUMBER})*"  # Nos. 0166 and 0169
+DOCKET = rf"(?:NLRC|LAC|NCR|CTA|EB|OMB|SB|CBD|SEC|LRC|OCA|IPI|E{S}\.{S}O{S}\.)"
+CASE_NUMBER = "|".join([
+    rf"(?:CA{S}-{S})?G{S}\.?{S}R{S}\.?{S}(?:(?:SP|CV|CR|HC|CEB|UDK|CR{S}-{S}HC){S}\.?{S})*Nos?{S}\.{S}{NUMBERS}",
+    rf"(?:OCA{S}IPI{S}|A{S}\.{S}M{S}\.{S}|A{S}\.{S}C{S}\.{S})(?:(?:OCA|IPI){S})?(?:Nos?{S}\.{S})?{NUMBERS}",
+    rf"(?:{DOCKET}{S})*(?:(?:Civil|Criminal|Special|Administrative|Adm{S}\.|Crim{S}\.){S})?(?:{DOCKET}{S})*"
+    rf"Case{S}(?:{DOCKET}{S})*Nos?{S}\.{S}{NUMBERS}",
+    rf"(?:{DOCKET}{S})+Nos?{S}\.{S}{NUMBERS}",
+    rf"OMB(?:{S}-{S}[A-Z0-9]+){{2,}}",
+])
+
+# One regex per rule; a rule can tag several entities through its named groups
+# (group names are the entity type, with "__<n>" appended to repeat a type).
+# Most dates in a decision are not its promulgation date, so PROM_DATE is only
+# tagged where the annotators consistently use it: right after the case number
+# in the caption, "[ G.R. No. 242353, February 4, 2020 ]".
+RULES = [
+    rf"(?P<CASE_NUM>{CASE_NUMBER})(?:{S}(?:[\]\)]{S})?,{S}(?P<PROM_DATE>{DATE}))?",
+    rf"(?P<RA>(?:Republic{S}Act|R{S}\.{S}A{S}\.|RA)(?:{S}\(?{S}RA{S}\)?)?{S}(?:\[?{S}No{S}\.{S}\]?{S})?\d{{1,5}})",
+]
+
+# Capitalized words that say nothing about an entity (sentence openers and the
+# like); any other capitalized word outside a rule match is left to the model
+COMMON_WORDS = frozenset("""
+A An And As At But By For From He Her His However I If In It Its Moreover No Nor Of On Or Our She So Such That The
+Their There These They This Those Thus To We When Where Whether Which While Who With Yes
+""".split())
+CAPITALIZED = re.compile(r"\b[A-Z][\w'.-]*")
+
+
+# Regex for a set of token sequences, factored as a trie so that shared
+# prefixes are matched once ("Republic Act No. 9262" and "Republic Act No. 3019"
+# share "Republic Act No ."). Longer phrases win over their own prefixes.
+def _trie_pattern(phrases):
+    trie = {}
+    for tokens in phrases:
+        node = trie
+        for token in tokens:
+            node = node.setdefault(token, {})
+        node[""] = {}
+
+    def pattern(node, previous):
+        branches = []
+        for token, child in sorted(node.items(), key=lambda item: -len(item[0])):
+            if token == "":
+                continue
+            # Two word tokens need whitespace between them; punctuation may or may not have it
+            separator = "" if previous is None else (r"\s+" if previous[-1].isalnum() and token[0].isalnum() else S)
+            rest = pattern(child, token)
+            branches.append(separator + re.escape(token) + (f"(?:{rest})?" if "" in child and rest else rest))
+        return f"(?:{'|'.join(branches)})" if len(branches) > 1 else "".join(branches)
+
+    return pattern(trie, None)
+
+
+# Phrases of the given types that occur at least min_count times in a corpus
+# (folder or packed file), as token tuples keyed by type
+def collect_entity_bank(path, types=RULE_TYPES, min_count=2):
+    counts = defaultdict(Counter)
+    for document_path in list_documents(path):
+        document = read_document(document_path)
+        tokens = document.tokens()
+        for entity_type, start, stop in entity_spans(document):
+            if entity_type in types:
+                counts[entity_type][tuple(tokens[start:stop])] += 1
+    return {entity_type: [phrase for phrase, n in counter.items() if n >= min_count] for entity_type, counter in counts.items()}
+
+
+# All rules (and an optional phrase bank from collect_entity_bank) compiled
+# into a single regex, so tagging a document is one left-to-right scan
+class RuleTagger:
+    def __init__(self, bank=None):
+        rules = list(RULES)
+        for entity_type, phrases in sorted((bank or {}).items()):
+            if phrases:
+                rules.append(f"(?P<{entity_type}__bank>{_trie_pattern(phrases)})")
+        # Named groups must be unique across the alternation
+        seen = Counter()
+
+        def rename(match):
+            seen[match.group(1)] += 1
+            return f"(?P<{match.group(1)}__{seen[match.group(1)]}>"
+        combined = re.sub(r"\(\?P<(\w+?)(?:__\w+)?>", rename, "|".join(f"(?:{rule})" for rule in rules))
+        self.pattern = re.compile(r"(?<!\w)(?:" + combined + r")(?!\w)")
+
+    # Hash of the rules and phrase bank, for caches of results that depend on them
+    def fingerprint(self):
+        return hashlib.sha256(self.pattern.pattern.encode("utf-8")).hexdigest()
+
+    # (type, start, end) character spans of every rule match in a text
+    def find(self, text):
+        spans = []
+        for match in self.pattern.finditer(text):
+            for name, value in match.groupdict().items():
+                if value is not None:
+                    spans.append((name.split("__")[0], match.start(name), match.end(name)))
+        return sorted(spans, key=lambda span: span[1])
+
+    # Entity dicts per document, in the same form as ner_engine.run_documents
+    def tag(self, texts):
+        return [
+            [{"entity_group": t, "start": start, "end": end, "score": RULE_SCORE, "word": text[start:end]}
+             for t, start, end in self.find(text)]
+            for text in texts
+        ]
+
+    # Whether text[start:end] holds anything the rules can't settle, i.e. a
+    # capitalized word (possible PERSON/INS/STA) outside every rule match
+    def needs_model(self, text, start, end, entities):
+        pieces, position = [], start
+        for entity in entities:
+            if entity["end"] <= start or entity["start"] >= end:
+                continue
+            pieces.append(text[position:max(position, entity["start"])])
+            position = max(position, entity["end"])
+        pieces.append(text[position:end])
+        return any(word not in COMMON_WORDS for piece in pieces for word in CAPITALIZED.findall(piece))
+
+
+# Merge rule matches into model entities of one document. Rules are exact for
+# what they match, so a model entity that overlaps a rule match is dropped.
+def merge_entities(model_entities, rule_entities):
+    if not rule_entities:
+        return model_entities
+    starts = np.array([entity["start"] for entity in rule_entities])
+    ends = np.array([entity["end"] for entity in rule_entities])
+    kept = [
+        entity for entity in model_entities
+        if not np.any((starts < entity["end"]) & (ends > entity["start"]))
+    ]
+    return sorted(kept + rule_entities, key=lambda entity: entity["start"])
+
+
+# run_documents with the rule engine in front of the model (see RULE_MODES).
+# Extra keyword arguments go to run_documents. In "skip" mode the model only
+# sees windows that still need it; pass a PredictionCache only if its settings
+# include the mode, since skipped windows are cached as all-O.
+def run_with_rules(texts, model, tokenizer, tagger, mode="hybrid", **kwargs):
+    from ner_engine import run_documents
+
+    if mode not in RULE_MODES:
+        raise ValueError(f"Unknown rule mode '{mode}', expected one of {RULE_MODES}")
+    if mode == "model":
+        return run_documents(texts, model, tokenizer, **kwargs)
+    rule_results = tagger.tag(texts)
+    if mode == "rules":
+        return rule_results
+
+    skip_window = (
+        lambda doc_idx, start, end: not tagger.needs_model(texts[doc_idx], start, end, rule_results[doc_idx])
+    ) if mode == "skip" else None
+    model_results = run_documents(texts, model, tokenizer, skip_window=skip_window, **kwargs)
+    return [merge_entities(found, rules) for found, rules in zip(model_results, rule_results)]
@@ -0,0 +1,253 @@
+import argparse
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+from transformers import AutoTokenizer
+
+from ner_backends import BACKEND_PATHS, load_backend
+from ner_decode import AGGREGATIONS
+from ner_engine import MAX_TOKENS_PER_BATCH
+from ner_rules import RULE_MODES, RuleTagger, collect_entity_bank, run_with_rules
+
+# === CONFIG ===
+BATCH_WINDOW_MS = 20        # How long the first request in a batch waits for company
+MAX_BATCH_DOCUMENTS = 32    # Documents per forward batch, and per request (more are turned away with 413)
+MAX_QUEUE_DEPTH = 256       # Pending requests before new ones are turned away with 503 (or answered by the rules)
+REQUEST_TIMEOUT_S = 120
+
+
+# A request waiting in the queue: its documents and, once done, its result
+class PendingRequest:
+    def __init__(self, texts):
+        self.texts = texts
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+# Collects incoming requests for up to BATCH_WINDOW_MS (or until the batch is
+# full) and runs them through the model together in one worker thread
+class MicroBatcher:
+    def __init__(self, model, tokenizer, batch_window_ms=BATCH_WINDOW_MS, max_batch_documents=MAX_BATCH_DOCUMENTS,
+                 max_queue_depth=MAX_QUEUE_DEPTH, max_tokens=MAX_TOKENS_PER_BATCH, aggregation="first", thresholds=None,
+                 tagger=None, rule_mode="model"):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.tagger = tagger
+        self.rule_mode = rule_mode
+        self.aggregation = aggregation
+        self.thresholds = thresholds
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch_documents = max_batch_documents
+        self.max_tokens = max_tokens
+        self.requests = queue.Queue(maxsize=max_queue_depth)
+        self.held_back = None  # A request that would have overflowed the last batch; it starts the next one
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    # Queue a request; raises queue.Full when the server is saturated
+    def submit(self, texts):
+        request = PendingRequest(texts)
+        self.requests.put_nowait(request)
+        return request
+
+    def depth(self):
+        return self.requests.qsize()
+
+    # A batch never holds more than max_batch_documents documents (requests are capped at that many)
+    def _collect(self):
+        batch = [self.held_back or self.requests.get()]
+        self.held_back = None
+        documents = len(batch[0].texts)
+        deadline = time.monotonic() + self.batch_window
+        while documents < self.max_batch_documents:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if documents + len(request.texts) > self.max_batch_documents:
+                self.held_back = request
+                break
+            batch.append(request)
+            documents += len(request.texts)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+            try:
+                results = run_with_rules(
+                    texts, self.model, self.tokenizer, self.tagger, self.rule_mode, max_tokens=self.max_tokens,
+                    aggregation=self.aggregation, thresholds=self.thresholds
+                )
+            except Exception as e:
+                for request in batch:
+                    request.error = str(e)
+                    request.done.set()
+                continue
+            offset = 0
+            for request in batch:
+                request.result = results[offset:offset + len(request.texts)]
+                offset += len(request.texts)
+                request.done.set()
+
+
+# POST /ner  {"text": "..."} or {"texts": ["...", ...]}  ->  {"entities": [...]} / {"documents": [[...], ...]}
+# GET /health  ->  {"status": "ok", "queue_depth": n}
+# With a fallback tagger, requests that find the queue full get the rule engine's
+# entities right away (marked "fallback": "rules") instead of a 503.
+class NERRequestHandler(BaseHTTPRequestHandler):
+    batcher = None
+    fallback_tagger = None
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self._send_json(404, {"error": "not found"})
+            return
+        self._send_json(200, {"status": "ok", "queue_depth": self.batcher.depth()})
+
+    def do_POST(self):
+        if self.path != "/ner":
+            self._send_json(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {"error": "invalid JSON body"})
+            return
+
+        if not isinstance(payload, dict):
+            self._send_json(400, {"error": "expected a JSON object"})
+            return
+        single = "text" in payload
+        texts = [payload["text"]] if single else payload.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            self._send_json(400, {"error": "expected 'text' (string) or 'texts' (list of strings)"})
+            return
+        # The queue counts requests, so one request may not hold more than a batch of documents
+        if len(texts) > self.batcher.max_batch_documents:
+            self._send_json(413, {"error": f"at most {self.batcher.max_batch_documents} texts per request"})
+            return
+
+        try:
+            request = self.batcher.submit(texts)
+        except queue.Full:
+            if self.fallback_tagger is None:
+                self._send_json(503, {"error": "queue full"}, headers={"Retry-After": "1"})
+                return
+            results = self.fallback_tagger.tag(texts)
+            payload = {"entities": results[0]} if single else {"documents": results}
+            self._send_json(200, dict(payload, fallback="rules"))
+            return
+
+        if not request.done.wait(REQUEST_TIMEOUT_S):
+            self._send_json(504, {"error": "timed out waiting for the model"})
+            return
+        if request.error is not None:
+            self._send_json(500, {"error": request.error})
+            return
+        if single:
+            self._send_json(200, {"entities": request.result[0]})
+        else:
+            self._send_json(200, {"documents": request.result})
+
+    # Unix socket peers have no (host, port) address
+    def address_string(self):
+        return self.client_address[0] if self.client_address else "unix"
+
+
+# --threshold TYPE=SCORE as a (type, score) pair
+def threshold_arg(value):
+    entity_type, _, score = value.partition("=")
+    try:
+        if not entity_type:
+            raise ValueError(value)
+        return entity_type, float(score)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected TYPE=SCORE, e.g. PERSON=0.6, got '{value}'")
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the fine-tuned legal NER model over HTTP.")
+    parser.add_argument("--backend", choices=list(BACKEND_PATHS), default="torch")
+    parser.add_argument("--model", help="Model directory (defaults to the backend's usual location)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--unix-socket", help="Listen on this Unix socket path instead of host:port")
+    parser.add_argument("--batch-window-ms", type=float, default=BATCH_WINDOW_MS)
+    parser.add_argument("--max-batch-documents", type=int, default=MAX_BATCH_DOCUMENTS)
+    parser.add_argument("--max-queue-depth", type=int, default=MAX_QUEUE_DEPTH)
+    parser.add_argument("--max-tokens", type=int, default=MAX_TOKENS_PER_BATCH)
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--aggregation", choices=AGGREGATIONS, default="first", help="How subword labels become word labels")
+    parser.add_argument("--threshold", type=threshold_arg, action="append", default=[], metavar="TYPE=SCORE",
+                        help="Drop entities of TYPE scoring below SCORE (repeatable)")
+    parser.add_argument("--rules", choices=RULE_MODES, default="model",
+                        help="Rule engine for CASE_NUM/PROM_DATE/RA (see ner_rules.py)")
+    parser.add_argument("--rule-bank", help="Also match recurring entity phrases from this .iob folder or packed corpus")
+    parser.add_argument("--rule-fallback", action="store_true",
+                        help="Answer with rule-only entities instead of 503 when the queue is full")
+    args = parser.parse_args()
+    thresholds = dict(args.threshold)
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    model_path = args.model or BACKEND_PATHS[args.backend]
+    model = load_backend(args.backend, model_path, args.threads)
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    print(f"✅ Model and tokenizer loaded from {model_path} ({args.backend})")
+    tagger = RuleTagger(collect_entity_bank(args.rule_bank) if args.rule_bank else None)
+
+    NERRequestHandler.batcher = MicroBatcher(
+        model, tokenizer, args.batch_window_ms, args.max_batch_documents, args.max_queue_depth, args.max_tokens,
+        args.aggregation, thresholds, tagger, args.rules
+    )
+    if args.rule_fallback:
+        NERRequestHandler.fallback_tagger = tagger
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = ThreadingUnixHTTPServer(args.unix_socket, NERRequestHandler)
+        print(f"🚀 Serving NER on unix:{args.unix_socket}")
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), NERRequestHandler)
+        print(f"🚀 Serving NER on http://{args.host}:{args.port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+MAX_LENGTH = 512
+STRIDE = 128
+
+
+# Start positions of fixed-size windows over a sequence of n subwords. Windows
+# overlap by `stride` subwords and the last one is pulled back to end exactly at
+# the end of the sequence, so only sequences shorter than a window need padding.
+def window_starts(n, size, stride):
+    if n <= size:
+        return [0]
+    step = size - stride
+    starts = list(range(0, n - size, step))
+    starts.append(n - size)
+    return starts
+
+
+# Subword range [lo, hi) that each window is responsible for. Inside an overlap
+# the split happens halfway, so every subword is scored by the window in which
+# it has the most context on both sides.
+def owned_ranges(starts, size, n):
+    ranges = []
+    for k, start in enumerate(starts):
+        lo = 0 if k == 0 else ranges[-1][1]
+        if k == len(starts) - 1:
+            hi = n
+        else:
+            hi = (starts[k + 1] + min(start + size, n)) // 2
+        ranges.append((lo, hi))
+    return ranges
+
+
+# Label every subword of a document: the first subword of a word gets the word's
+# label, the following subwords get the I- version of it
+def align_labels(word_ids, word_labels, label2id):
+    label_ids = []
+    previous_word_idx = None
+    for word_idx in word_ids:
+        if word_idx != previous_word_idx:
+            label_ids.append(label2id[word_labels[word_idx]])
+        elif word_labels[word_idx].startswith("B-"):
+            label_ids.append(label2id[word_labels[word_idx].replace("B-", "I-")])
+        else:
+            label_ids.append(label2id[word_labels[word_idx]])
+        previous_word_idx = word_idx
+    return label_ids
+
+
+# Split every document into overlapping windows of at most max_length subwords
+# (special tokens included) instead of truncating it. Each window keeps its
+# labels, the word index of every subword (-1 for special/pad tokens), the
+# document it came from and its source file.
+#
+# With mask_overlap=True, subwords outside the range a window owns get the label
+# -100, so every subword of a document is counted exactly once in evaluation.
+def build_windowed_examples(documents, documents_labels, sources, tokenizer, label2id,
+                            max_length=MAX_LENGTH, stride=STRIDE, mask_overlap=False, padding="max_length"):
+    size = max_length - 2  # Room for [CLS] and [SEP]
+    encodings = tokenizer(documents, is_split_into_words=True, add_special_tokens=False)
+
+    examples = {"input_ids": [], "attention_mask": [], "labels": [], "word_ids": [], "doc_index": [], "source": []}
+    for doc_idx in range(len(documents)):
+        ids = encodings["input_ids"][doc_idx]
+        word_ids = encodings.word_ids(doc_idx)
+        label_ids = align_labels(word_ids, documents_labels[doc_idx], label2id)
+
+        starts = window_starts(len(ids), size, stride)
+        for start, (lo, hi) in zip(starts, owned_ranges(starts, size, len(ids))):
+            end = min(start + size, len(ids))
+            window_labels = label_ids[start:end]
+            if mask_overlap:
+                window_labels = [
+                    label if lo <= pos < hi else -100
+                    for pos, label in enumerate(window_labels, start=start)
+                ]
+
+            window_ids = [tokenizer.cls_token_id] + ids[start:end] + [tokenizer.sep_token_id]
+            window_word_ids = [-1] + word_ids[start:end] + [-1]
+            window_labels = [-100] + window_labels + [-100]
+
+            pad = max_length - len(window_ids) if padding == "max_length" else 0
+            examples["input_ids"].append(window_ids + [tokenizer.pad_token_id] * pad)
+            examples["attention_mask"].append([1] * len(window_ids) + [0] * pad)
+            examples["labels"].append(window_labels + [-100] * pad)
+            examples["word_ids"].append(window_word_ids + [-1] * pad)
+            examples["doc_index"].append(doc_idx)
+            examples["source"].append(sources[doc_idx])
+    return examples
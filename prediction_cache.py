@@ -0,0 +1,156 @@
+import hashlib
+import json
+import os
+import zipfile
+
+import numpy as np
+
+CACHE_DIR = ".cache/predictions"
+CACHE_VERSION = 1  # Bump when what is stored per document changes
+MAX_CACHE_BYTES = 512 * 1024 * 1024  # Least recently used entries are evicted past this size
+LOW_WATER = 0.9  # ... down to this share of it, so eviction doesn't run again on the next write
+
+# Files whose content is the model: weights, plus the config (it holds the label mapping) and the
+# tokenizer files. Other files in the folder, like quantize_model.py's accuracy_report.json, don't count.
+WEIGHT_SUFFIXES = (".safetensors", ".bin", ".pt", ".onnx")
+MODEL_FILES = ("config.json", "tokenizer.json", "tokenizer_config.json", "special_tokens_map.json", "vocab.txt")
+FINGERPRINTS_FILE = "fingerprints.json"
+
+
+def _hash_files(file_paths):
+    digest = hashlib.sha256()
+    for file_path in file_paths:
+        digest.update(os.path.basename(file_path).encode("utf-8") + b"\0")
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+# Commit a hub model id was downloaded at: the name of its snapshot folder in the
+# local hub cache (None when it isn't there)
+def hub_commit(model_path):
+    from huggingface_hub import try_to_load_from_cache
+    try:
+        resolved = try_to_load_from_cache(model_path, "config.json")
+    except ValueError:
+        return None  # Not a valid repo id
+    return os.path.basename(os.path.dirname(resolved)) if isinstance(resolved, str) else None
+
+
+# Hash of the model weights. For a local model folder this hashes its weight and
+# config files, remembering the result per (size, mtime) so an unchanged
+# checkpoint is not reread on every run. A hub id is identified by the commit it
+# was resolved to; only without one are the parameters hashed.
+def model_fingerprint(model, model_path, cache_dir=CACHE_DIR):
+    if not os.path.isdir(model_path):
+        commit = hub_commit(model_path)
+        if commit:
+            return hashlib.sha256(f"{model_path}\0{commit}".encode("utf-8")).hexdigest()
+        digest = hashlib.sha256(model_path.encode("utf-8"))
+        for name, tensor in model.state_dict().items():
+            digest.update(name.encode("utf-8"))
+            digest.update(tensor.detach().cpu().numpy().tobytes())
+        return digest.hexdigest()
+
+    file_paths = sorted(
+        os.path.join(model_path, f) for f in os.listdir(model_path)
+        if (f.endswith(WEIGHT_SUFFIXES) or f in MODEL_FILES) and os.path.isfile(os.path.join(model_path, f))
+    )
+    stamp = json.dumps([[p, os.path.getsize(p), os.path.getmtime(p)] for p in file_paths])
+    known_path = os.path.join(cache_dir, FINGERPRINTS_FILE)
+    known = {}
+    if os.path.exists(known_path):
+        with open(known_path, "r", encoding="utf-8") as f:
+            known = json.load(f)
+    if stamp not in known:
+        known[stamp] = _hash_files(file_paths)
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{known_path}.tmp{os.getpid()}"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(known, f)
+        os.replace(tmp_path, known_path)
+    return known[stamp]
+
+
+# Everything about the tokenizer that changes the ids it produces
+def tokenizer_fingerprint(tokenizer):
+    if getattr(tokenizer, "is_fast", False):
+        config = tokenizer.backend_tokenizer.to_str()
+    else:
+        config = json.dumps([sorted(tokenizer.get_vocab().items()), tokenizer.init_kwargs], default=str)
+    return hashlib.sha256(f"{type(tokenizer).__name__}\0{config}".encode("utf-8")).hexdigest()
+
+
+# Per-token predictions (label id and its probability) stored on disk, one small
+# .npz per document. Entries are keyed by the model weights, the tokenizer, the
+# caller's `settings` (window size, stride, ...) and the document's content, so
+# an unchanged document is never run through the model twice and only a new
+# checkpoint (or new settings) misses. Reading an entry marks it as recently
+# used; once the folder grows past max_bytes the least recently used go first,
+# until it is down to LOW_WATER of max_bytes.
+class PredictionCache:
+    def __init__(self, model, tokenizer, model_path, settings, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.prefix = hashlib.sha256("\0".join([
+            str(CACHE_VERSION),
+            model_fingerprint(model, model_path, cache_dir),
+            tokenizer_fingerprint(tokenizer),
+            json.dumps(settings, sort_keys=True),
+        ]).encode("utf-8")).hexdigest()
+        self.entries_dir = os.path.join(cache_dir, "entries")
+        os.makedirs(self.entries_dir, exist_ok=True)
+        self.total_bytes = sum(entry.stat().st_size for entry in os.scandir(self.entries_dir) if entry.is_file())
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, document):
+        key = hashlib.sha256(f"{self.prefix}\0{document}".encode("utf-8")).hexdigest()
+        return os.path.join(self.entries_dir, f"{key[:40]}.npz")
+
+    # (label_ids, scores) for a document, or None on a miss
+    def get(self, document):
+        path = self._path(document)
+        try:
+            with np.load(path) as entry:
+                label_ids, scores = entry["label_ids"], entry["scores"]
+            os.utime(path)  # Recently used
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):  # Missing, truncated or corrupt entry
+            self.misses += 1
+            return None
+        self.hits += 1
+        return label_ids, scores
+
+    # Store a document's predictions; returns them as stored (uint8 ids, float32 scores)
+    def put(self, document, label_ids, scores):
+        label_ids, scores = np.asarray(label_ids, dtype=np.uint8), np.asarray(scores, dtype=np.float32)
+        path = self._path(document)
+        tmp_path = f"{path}.tmp{os.getpid()}.npz"
+        np.savez(tmp_path, label_ids=label_ids, scores=scores)
+        self.total_bytes += os.path.getsize(tmp_path)
+        try:
+            self.total_bytes -= os.path.getsize(path)  # Overwriting an entry (e.g. a corrupt one)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+        return label_ids, scores
+
+    # Drop least recently used entries until the cache is down to LOW_WATER of max_bytes
+    def evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.entries_dir) if entry.is_file() and ".tmp" not in entry.name),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        self.total_bytes = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if self.total_bytes <= self.max_bytes * LOW_WATER:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                continue  # Evicted by another process
+            self.total_bytes -= size
@@ -0,0 +1,124 @@
+import argparse
+import json
+import os
+import time
+
+import torch
+from transformers import AutoConfig, AutoTokenizer, AutoModelForTokenClassification
+
+from iob_pack import list_documents
+from ner_eval import evaluate_predictions, file_labels, predict_file
+
+# === CONFIG ===
+MODEL_PATH = "./bert-legal-ner"
+QUANTIZED_MODEL_PATH = "./bert-legal-ner-int8"
+QUANTIZED_WEIGHTS = "quantized_model.pt"
+REPORT_FILE = "accuracy_report.json"
+TEST_FOLDER = "./train_data/test"
+
+
+# Dynamic int8 quantization of every Linear layer: weights are stored as int8,
+# activations are quantized on the fly, so no calibration data is needed
+def quantize(model):
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def save_quantized_model(model_path=MODEL_PATH, output_path=QUANTIZED_MODEL_PATH):
+    model = AutoModelForTokenClassification.from_pretrained(model_path)
+    model.eval()
+    quantized = quantize(model)
+
+    os.makedirs(output_path, exist_ok=True)
+    model.config.save_pretrained(output_path)
+    AutoTokenizer.from_pretrained(model_path).save_pretrained(output_path)
+    torch.save(quantized.state_dict(), os.path.join(output_path, QUANTIZED_WEIGHTS))
+    return quantized
+
+
+# Rebuild the quantized module structure from the config, then load the int8 weights
+def load_quantized_model(path=QUANTIZED_MODEL_PATH):
+    config = AutoConfig.from_pretrained(path)
+    model = quantize(AutoModelForTokenClassification.from_config(config))
+    # Packed int8 weights are not plain tensors, so the artifact needs a full (trusted) unpickle
+    state_dict = torch.load(os.path.join(path, QUANTIZED_WEIGHTS), weights_only=False)
+    model.load_state_dict(state_dict)
+    model.eval()
+    return model
+
+
+# Scored exactly like test-model.py (same prediction path, one sequence per file), so the report
+# matches what test-model.py prints for either model
+def evaluate_model(model, tokenizer, test_files):
+    true_sentences, pred_sentences = [], []
+    start = time.perf_counter()
+    for file_path in test_files:
+        true_labels, pred_labels = file_labels(predict_file(model, tokenizer, file_path))
+        true_sentences.append(true_labels)
+        pred_sentences.append(pred_labels)
+    elapsed = time.perf_counter() - start
+    results = evaluate_predictions(true_sentences, pred_sentences)
+    results["seconds_per_document"] = elapsed / max(len(test_files), 1)
+    return results
+
+
+def model_size_mb(path, filenames):
+    return sum(os.path.getsize(os.path.join(path, f)) for f in filenames if os.path.exists(os.path.join(path, f))) / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize the fine-tuned NER model to int8 and report the accuracy delta.")
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--output", default=QUANTIZED_MODEL_PATH)
+    parser.add_argument("--test-folder", default=TEST_FOLDER, help="Test .iob folder, packed corpus or document list")
+    parser.add_argument("--skip-report", action="store_true", help="Only write the quantized model")
+    args = parser.parse_args()
+
+    quantized = save_quantized_model(args.model, args.output)
+    print(f"✅ Quantized model saved to {args.output}")
+    if args.skip_report:
+        return
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    fp32 = AutoModelForTokenClassification.from_pretrained(args.model)
+    fp32.eval()
+    test_files = sorted(list_documents(args.test_folder))
+
+    fp32_results = evaluate_model(fp32, tokenizer, test_files)
+    int8_results = evaluate_model(quantized, tokenizer, test_files)
+
+    print(f"\n📄 Documents tested: {len(test_files)}")
+    print(f"{'':<22}{'fp32':>10}{'int8':>10}{'delta':>10}")
+    for key in ["f1", "precision", "recall"]:
+        delta = int8_results[key] - fp32_results[key]
+        print(f"🔹 {key:<20}{fp32_results[key]:>10.4f}{int8_results[key]:>10.4f}{delta:>+10.4f}")
+    print(f"🔹 {'sec / document':<20}{fp32_results['seconds_per_document']:>10.3f}"
+          f"{int8_results['seconds_per_document']:>10.3f}"
+          f"{int8_results['seconds_per_document'] / max(fp32_results['seconds_per_document'], 1e-9):>9.2f}x")
+
+    matrix_delta = int8_results["confusion_matrix"] - fp32_results["confusion_matrix"]
+    print("\n📊 Confusion Matrix (Entity-Level), int8:")
+    print(int8_results["confusion_matrix"])
+    print("\n📊 Confusion Matrix delta (int8 - fp32):")
+    print(matrix_delta)
+
+    report = {
+        "documents": len(test_files),
+        "size_mb": {
+            "fp32": model_size_mb(args.model, ["model.safetensors", "pytorch_model.bin"]),
+            "int8": model_size_mb(args.output, [QUANTIZED_WEIGHTS]),
+        },
+    }
+    for name, results in [("fp32", fp32_results), ("int8", int8_results)]:
+        report[name] = {key: results[key] for key in ["f1", "precision", "recall", "seconds_per_document"]}
+        report[name]["confusion_matrix"] = results["confusion_matrix"].to_dict(orient="index")
+    report["delta"] = {key: int8_results[key] - fp32_results[key] for key in ["f1", "precision", "recall"]}
+    report["delta"]["confusion_matrix"] = matrix_delta.to_dict(orient="index")
+
+    report_path = os.path.join(args.output, REPORT_FILE)
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=int)
+    print(f"\n📝 Accuracy report saved to {report_path}")
+
+
+if __name__ == "__main__":
+    main()
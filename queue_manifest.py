@@ -0,0 +1,89 @@
+import hashlib
+import json
+import os
+
+MANIFEST_PATH = "queue_manifest.json"
+
+# Manifest layout:
+# {
+#   "converter_version": 2,
+#   "sources": {"052125.jsonl": {"file_hash": ..., "outputs": ["052125_1.iob", ...]}},
+#   "outputs": {"052125_1.iob": {"source": "052125.jsonl", "record_hash": ..., "output_hash": ...,
+#                                "size": ..., "mtime": ..., "errors": [...]}},
+#   "steps": {"split_balance": <digest of the inputs it last ran on>, ...},
+#   "stale_outputs": [...]  (only between a converter version bump and the end of the run that follows it)
+# }
+
+
+def empty_manifest(converter_version=None):
+    return {"converter_version": converter_version, "sources": {}, "outputs": {}, "steps": {}}
+
+
+def load_manifest(path=MANIFEST_PATH):
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    for key, value in empty_manifest().items():
+        manifest.setdefault(key, value)
+    return manifest
+
+
+def save_manifest(manifest, path=MANIFEST_PATH):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Manifest entry fields that describe an output file as it is on disk now
+def output_stat(file_path, content):
+    stat = os.stat(file_path)
+    return {"output_hash": text_hash(content), "size": stat.st_size, "mtime": stat.st_mtime}
+
+
+# Content hash of a queue file. Files the manifest knows about are trusted
+# without rereading them as long as their size and mtime still match.
+def current_hash(folder, filename, manifest):
+    file_path = os.path.join(folder, filename)
+    entry = manifest["outputs"].get(filename)
+    if entry is not None:
+        stat = os.stat(file_path)
+        if stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]:
+            return entry["output_hash"]
+    return file_hash(file_path)
+
+
+# One digest over the names and contents of the .iob files in a folder, used by
+# downstream steps to tell whether their inputs changed since they last ran
+def folder_digest(folder, manifest, include=lambda filename: True):
+    digest = hashlib.sha256()
+    for filename in sorted(os.listdir(folder)):
+        if filename.endswith(".iob") and include(filename):
+            digest.update(filename.encode("utf-8") + b"\0")
+            digest.update(current_hash(folder, filename, manifest).encode("ascii") + b"\0")
+    return digest.hexdigest()
+
+
+def step_is_current(manifest, step, digest):
+    return manifest["steps"].get(step) == digest
+
+
+# Record that a step ran on inputs with this digest (rereads the manifest so
+# concurrent edits by other steps are not lost)
+def mark_step_done(step, digest, path=MANIFEST_PATH):
+    manifest = load_manifest(path)
+    manifest["steps"][step] = digest
+    save_manifest(manifest, path)
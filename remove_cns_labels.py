@@ -1,27 +1,28 @@
 import os
 
+import numpy as np
+
+from iob_format import LABEL_IDS, read_iob, write_iob
+
 def clean_cns_tags_in_folder(folder_path):
+    cns_ids = [LABEL_IDS["B-CNS"], LABEL_IDS["I-CNS"]]
     updated_files = 0
     for filename in os.listdir(folder_path):
         if not filename.endswith(".iob"):
             continue
 
         filepath = os.path.join(folder_path, filename)
-        with open(filepath, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-
-        cleaned_lines = []
-        for line in lines:
-            if line.strip() == "":
-                cleaned_lines.append(line)  # preserve sentence boundary
-                continue
-
-            token, tag = line.strip().split('\t')
-            if tag not in ("B-CNS", "I-CNS"):
-                cleaned_lines.append(line)
+        document = read_iob(filepath)
+        tokens = document.tokens()
+        keep = ~np.isin(document.labels, cns_ids)
 
-        with open(filepath, 'w', encoding='utf-8') as f:
-            f.writelines(cleaned_lines)
+        # Drop CNS tokens sentence by sentence (sentence boundaries are preserved)
+        starts = document.sentence_starts.tolist()
+        sentences = []
+        for start, stop in zip(starts, starts[1:]):
+            kept = np.flatnonzero(keep[start:stop]) + start
+            sentences.append(([tokens[i] for i in kept.tolist()], document.labels[kept]))
+        write_iob(filepath, sentences)
         
         updated_files += 1
 
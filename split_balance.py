@@ -1,103 +1,206 @@
+import heapq
+import json
 import os
+import re
 import shutil
-from collections import defaultdict
 
-QUEUE_FOLDER = 'queue'         # Input folder
+import numpy as np
+
+from corpus_stats import ENTITY_KEYS as CORPUS_ENTITY_KEYS, collect_stats, entity_tally
+from iob_pack import (
+    LIST_SUFFIX, PACK_SUFFIX, export_document, is_list, is_pack, list_documents, pack_documents, read_document,
+    split_document_path, write_document_list
+)
+from queue_manifest import file_hash, folder_digest, load_manifest, mark_step_done, step_is_current
+
+QUEUE_FOLDER = 'queue'         # Input folder (or a packed corpus file, e.g. 'queue.iobpack')
 OUTPUT_ROOT = 'train_data'     # Output folder with train/eval/test
+PACK_SPLITS = False            # Write train/eval/test as packed files (train.iobpack, ...) instead of folders
+# How split folders get their files: 'link' (hard links to the queue files, falling back to copies where
+# linking isn't possible), 'copy', or 'list' (no folders; train.list, ... name the queue files instead)
+SPLIT_MODE = 'link'
 SPLIT_RATIOS = {'train': 0.7, 'eval': 0.2, 'test': 0.1}
+SPLITS = list(SPLIT_RATIOS)
+STEP_NAME = 'split_balance'     # Key in queue_manifest.json
+SPLIT_VERSION = 1               # Bump whenever grouping, stratification or assignment changes the splits
+
+ENTITY_KEYS = list(CORPUS_ENTITY_KEYS.values())
+AUG_SUFFIX = re.compile(r'_aug\d+$')  # data-augmentation.py names its copies <original>_aug<N>.iob
+WORKERS = os.cpu_count() or 1  # Files not in .cache/stats yet are read by this many processes
+
+# Files that must land in the same split: augmented copies with their original, and files holding the same
+# decision (same caption case number). Returns a list of groups, each a list of file indices.
+def group_files(filenames, case_numbers):
+    parent = list(range(len(filenames)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    first_seen = {}
+    for i, (filename, case_number) in enumerate(zip(filenames, case_numbers)):
+        stem = os.path.splitext(filename)[0]
+        keys = [('file', AUG_SUFFIX.sub('', stem))]
+        if case_number is not None and not AUG_SUFFIX.search(stem):
+            keys.append(('case', case_number))  # Not for copies: their case numbers were swapped in
+        for key in keys:
+            j = first_seen.setdefault(key, i)
+            parent[find(i)] = find(j)
+
+    groups = {}
+    for i in range(len(filenames)):
+        groups.setdefault(find(i), []).append(i)
+    return list(groups.values())
+
+# Multi-label iterative stratification (Sechidis et al., 2011) over file groups. One group is placed at a
+# time: the type with the fewest unassigned entities is picked (a lazy heap keyed by that count), and its
+# largest unplaced group goes to the split that still wants the most of that type, ties going to the split
+# that wants the most files. File counts only break ties, so split sizes follow the entity shares.
+# Groups without entities fill the splits that want the most files. Every group is placed exactly once,
+# so the whole pass is O(groups x types log types).
+def split_files(files_counts, ratios, groups=None):
+    names = [filename for filename, _ in files_counts]
+    counts = np.array([[c[k] for k in ENTITY_KEYS] for _, c in files_counts], dtype=np.int64).reshape(-1, len(ENTITY_KEYS))
+    groups = groups if groups is not None else [[i] for i in range(len(names))]
+    group_counts = np.array([counts[g].sum(axis=0) for g in groups], dtype=np.int64).reshape(-1, len(ENTITY_KEYS))
+    group_sizes = np.array([len(g) for g in groups])
+
+    splits = list(ratios)
+    shares = np.array([ratios[split] for split in splits])
+    wanted_files = shares * len(names)
+    wanted = shares[:, None] * group_counts.sum(axis=0)[None, :]  # [splits, types]
+    assignment = np.full(len(groups), -1)
+
+    def place(g, split):
+        assignment[g] = split
+        wanted_files[split] -= group_sizes[g]
+        wanted[split] -= group_counts[g]
+
+    # Largest groups first within a type, like the original splitter
+    order = np.argsort(-group_counts.sum(axis=1), kind='stable')
+    holders = [order[group_counts[order, t] > 0].tolist() for t in range(len(ENTITY_KEYS))]
+    next_holder = [0] * len(ENTITY_KEYS)  # Holders before this one are all placed
+    remaining = group_counts.sum(axis=0)
+    heap = [(int(remaining[t]), t) for t in range(len(ENTITY_KEYS)) if remaining[t] > 0]
+    heapq.heapify(heap)
+    while heap:
+        left, t = heapq.heappop(heap)
+        if left != remaining[t] or left == 0:
+            continue  # Outdated entry; the type's current count was pushed when it changed
+        while assignment[holders[t][next_holder[t]]] >= 0:
+            next_holder[t] += 1
+        g = holders[t][next_holder[t]]
+        # Most wanted of this type, then most wanted files, then most wanted entities overall
+        best = max(range(len(splits)), key=lambda s: (wanted[s, t], wanted_files[s], wanted[s].sum(), -s))
+        place(g, best)
+        # One group at a time: the rarest type is picked again after every placement
+        remaining -= group_counts[g]
+        for u in np.flatnonzero((group_counts[g] > 0) & (remaining > 0)).tolist():
+            heapq.heappush(heap, (int(remaining[u]), u))
+
+    file_heap = [(-wanted_files[s], s) for s in range(len(splits))]
+    heapq.heapify(file_heap)
+    for g in order:
+        if assignment[g] < 0:
+            _, s = heapq.heappop(file_heap)
+            place(g, s)
+            heapq.heappush(file_heap, (-wanted_files[s], s))
+
+    split_files = {split: [] for split in splits}
+    split_counts = {split: dict.fromkeys(ENTITY_KEYS, 0) for split in splits}
+    for g, s in enumerate(assignment.tolist()):
+        split_files[splits[s]].extend(names[i] for i in groups[g])
+        for k, key in enumerate(ENTITY_KEYS):
+            split_counts[splits[s]][key] += int(group_counts[g, k])
+    return split_files, split_counts
 
-ENTITY_KEYS = [
-    'case_nums', 'persons', 'institutions',
-    'prom_dates', 'republic_acts', 'statutes'
-]
-
-def count_in_file(file_path):
-    counters = dict.fromkeys(ENTITY_KEYS, 0)
-    entity_map = {
-        'CASE_NUM': 'case_nums', 'PERSON': 'persons', 'INS': 'institutions',
-        'PROM_DATE': 'prom_dates', 'RA': 'republic_acts', 'STA': 'statutes'
-        # CNS excluded
-    }
-
-    with open(file_path, 'r', encoding='utf-8') as file:
-        for line in file:
-            parts = line.strip().split()
-            if len(parts) < 2:
+def split_output(split):
+    if PACK_SPLITS:
+        return os.path.join(OUTPUT_ROOT, split + PACK_SUFFIX)
+    return os.path.join(OUTPUT_ROOT, split + LIST_SUFFIX if SPLIT_MODE == 'list' else split)
+
+# Remove the forms of a split this run doesn't write (a folder, packed file or document list)
+def clear_other_outputs(split):
+    split_path = os.path.join(OUTPUT_ROOT, split)
+    keep = split_output(split)
+    if split_path != keep and os.path.isdir(split_path):
+        shutil.rmtree(split_path)
+    for suffix in (PACK_SUFFIX, LIST_SUFFIX):
+        if split_path + suffix != keep and os.path.exists(split_path + suffix):
+            os.remove(split_path + suffix)
+
+# Make a split folder hold exactly the given documents. Files that are already links to the right queue
+# file are left alone, so re-splitting a grown corpus only touches the files that moved.
+def sync_folder(paths, split_path):
+    os.makedirs(split_path, exist_ok=True)
+    targets = {os.path.basename(path): path for path in paths}
+    for filename in os.listdir(split_path):
+        if filename not in targets:
+            os.remove(os.path.join(split_path, filename))
+    for filename, path in targets.items():
+        output_path = os.path.join(split_path, filename)
+        if SPLIT_MODE == 'link' and split_document_path(path) is None:
+            if os.path.exists(output_path):
+                if os.path.samefile(path, output_path):
+                    continue
+                os.remove(output_path)
+            try:
+                os.link(path, output_path)
                 continue
-            token, tag = parts
-            for ent_type, key in entity_map.items():
-                if tag == f'B-{ent_type}':
-                    counters[key] += 1
-    return counters
-
-def sum_entities(entity_dicts):
-    total = dict.fromkeys(ENTITY_KEYS, 0)
-    for d in entity_dicts:
-        for key in ENTITY_KEYS:
-            total[key] += d[key]
-    return total
-
-def split_files(files_counts, ratios):
-    files_counts.sort(key=lambda x: sum(x[1].values()), reverse=True)
-
-    split_files = {'train': [], 'eval': [], 'test': []}
-    split_counts = {'train': defaultdict(int), 'eval': defaultdict(int), 'test': defaultdict(int)}
-
-    total_files = len(files_counts)
-    target_counts = {
-        'train': int(ratios['train'] * total_files),
-        'eval': int(ratios['eval'] * total_files),
-        'test': total_files - int(ratios['train'] * total_files) - int(ratios['eval'] * total_files)
-    }
-
-    for filename, counts in files_counts:
-        best_split = None
-        min_entity_sum = float('inf')
+            except OSError:
+                pass  # Different file system, or no hard links there
+        export_document(path, output_path)
 
-        for split in ['train', 'eval', 'test']:
-            if len(split_files[split]) < target_counts[split]:
-                projected_sum = sum(split_counts[split][k] + counts[k] for k in ENTITY_KEYS)
-                if projected_sum < min_entity_sum:
-                    min_entity_sum = projected_sum
-                    best_split = split
-
-        split_files[best_split].append(filename)
-        for k in ENTITY_KEYS:
-            split_counts[best_split][k] += counts[k]
-
-    return split_files, split_counts
-
-def clear_previous_splits():
-    for split in ['train', 'eval', 'test']:
-        split_path = os.path.join(OUTPUT_ROOT, split)
-        if os.path.exists(split_path):
-            for f in os.listdir(split_path):
-                os.remove(os.path.join(split_path, f))
-        else:
-            os.makedirs(split_path)
+def splits_exist():
+    if PACK_SPLITS:
+        return all(is_pack(split_output(split)) for split in SPLITS)
+    if SPLIT_MODE == 'list':
+        return all(is_list(split_output(split)) for split in SPLITS)
+    return all(os.path.isdir(split_output(split)) and os.listdir(split_output(split)) for split in SPLITS)
 
 def main():
-    clear_previous_splits()
-
-    files_counts = []
-    for file in os.listdir(QUEUE_FOLDER):
-        file_path = os.path.join(QUEUE_FOLDER, file)
-        if file.endswith('.iob') and os.path.isfile(file_path):
-            counts = count_in_file(file_path)
-            files_counts.append((file, counts))
-
-    split_files_dict, split_counts = split_files(files_counts, SPLIT_RATIOS)
+    # Skip re-splitting when queue/ holds exactly the files the current split was made from, with the same settings
+    manifest = load_manifest()
+    digest = file_hash(QUEUE_FOLDER) if is_pack(QUEUE_FOLDER) else folder_digest(QUEUE_FOLDER, manifest)
+    settings = json.dumps({'ratios': SPLIT_RATIOS, 'output': 'packed' if PACK_SPLITS else SPLIT_MODE, 'version': SPLIT_VERSION},
+                          sort_keys=True)
+    digest = f"{digest}:{settings}"
+    if step_is_current(manifest, STEP_NAME, digest) and splits_exist():
+        print(f"⏭️ '{QUEUE_FOLDER}' is unchanged since the last split, skipping.")
+        return
+
+    # Counts and case numbers come from corpus_stats, so files already seen in an earlier split aren't read again
+    file_paths = [path for path in sorted(list_documents(QUEUE_FOLDER)) if is_pack(QUEUE_FOLDER) or os.path.isfile(path)]
+    all_stats = collect_stats(file_paths, workers=WORKERS)
+    files_counts = [(os.path.basename(path), entity_tally(stats)) for path, stats in zip(file_paths, all_stats)]
+    case_numbers = [stats['case_number'] for stats in all_stats]
+
+    groups = group_files([filename for filename, _ in files_counts], case_numbers)
+    split_files_dict, split_counts = split_files(files_counts, SPLIT_RATIOS, groups)
+
+    os.makedirs(OUTPUT_ROOT, exist_ok=True)
+    for split in SPLITS:
+        clear_other_outputs(split)
+        paths = [os.path.join(QUEUE_FOLDER, file) for file in split_files_dict[split]]
+        if PACK_SPLITS:
+            pack_documents((read_document(path) for path in paths), split_output(split))
+        elif SPLIT_MODE == 'list':
+            write_document_list(paths, split_output(split))
+        else:
+            sync_folder(paths, split_output(split))
 
-    for split in ['train', 'eval', 'test']:
-        split_path = os.path.join(OUTPUT_ROOT, split)
-        for file in split_files_dict[split]:
-            shutil.copy(os.path.join(QUEUE_FOLDER, file), os.path.join(split_path, file))
+    mark_step_done(STEP_NAME, digest)
 
     # 📊 Summary
-    for split in ['train', 'eval', 'test']:
+    totals = {key: sum(split_counts[split][key] for split in SPLITS) for key in ENTITY_KEYS}
+    print(f"🧩 {len(files_counts)} files in {len(groups)} groups (augmented copies and same-decision files stay together)")
+    for split in SPLITS:
         print(f"\n📁 {split.upper()} ({len(split_files_dict[split])} files):")
         for key in ENTITY_KEYS:
-            print(f"  {key}: {split_counts[split][key]}")
+            share = split_counts[split][key] / totals[key] if totals[key] else 0
+            print(f"  {key}: {split_counts[split][key]} ({share:.1%})")
     print("\n✅ Stratified re-split complete! (no CNS)")
 
 if __name__ == "__main__":
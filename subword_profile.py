@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from corpus_stats import collect_stats, describe
+from iob_pack import list_documents
+from ner_windows import MAX_LENGTH, STRIDE
+
+TOKENIZER = "dslim/bert-base-NER"  # Same checkpoint fine-tuning.py starts from
+BATCH_SIZE = 8  # per_device_train_batch_size in fine-tuning.py
+MEMORY_GB = 16  # Memory of one training device
+MEMORY_RESERVE = 0.1  # Share of it kept free (CUDA context, allocator fragmentation)
+MEGABATCH = 50  # group_by_length sorts by length within this many batches (like Trainer's LengthGroupedSampler)
+SEED = 42
+LINES_PER_BATCH = 256  # Raw JSONL texts tokenized at a time
+
+# Measures what fine-tuning.py's length settings cost on a real corpus:
+#   - subwords per document and per sentence (a sentence is one model input before windowing)
+#   - model inputs per document with sliding windows of MAX_LENGTH sharing `stride` subwords
+#   - padding waste with padding="max_length" versus dynamic padding (random batches and group_by_length)
+#   - the largest batch that fits in a memory ceiling, as examples and as a token budget
+# .iob corpora are profiled from corpus_stats (cached per file); raw JSONL is what BERT_NER.py sees:
+# each record's text as one sequence.
+
+
+# Subword counts of every record of a raw JSONL file (or a folder of them), one sequence per document
+def jsonl_subwords(path, tokenizer):
+    paths = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".jsonl")) if os.path.isdir(path) else [path]
+    texts = []
+    for file_path in paths:
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line) if line.strip() else None
+                except json.JSONDecodeError:
+                    continue  # cleaning-data.py logs and skips these
+                if not isinstance(record, dict):
+                    continue  # Valid JSON but not a record, skipped like decode errors
+                text = record.get("text")
+                if isinstance(text, str) and text.strip():
+                    texts.append(text)
+    lengths = []
+    for i in range(0, len(texts), LINES_PER_BATCH):
+        encodings = tokenizer(texts[i:i + LINES_PER_BATCH], add_special_tokens=False, verbose=False)
+        lengths.extend([n] for n in map(len, encodings["input_ids"]))
+    return lengths
+
+
+def is_jsonl(path):
+    if os.path.isdir(path):
+        names = os.listdir(path)
+        return any(f.endswith(".jsonl") for f in names) and not any(f.endswith(".iob") for f in names)
+    return path.endswith(".jsonl")
+
+
+# Windows per sequence, as ner_windows.window_starts cuts them: 1 up to max_length - 2 subwords,
+# then one more every max_length - 2 - stride subwords
+def windows_per_sequence(lengths, max_length=MAX_LENGTH, stride=STRIDE):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    size = max_length - 2
+    extra = -(-np.maximum(lengths - size, 0) // (size - stride))
+    return np.where(lengths <= size, 1, extra + 1)
+
+
+# Length of every model input (special tokens included) after windowing. Windows are
+# full except for sequences shorter than one window.
+def input_lengths(lengths, max_length=MAX_LENGTH, stride=STRIDE):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    counts = windows_per_sequence(lengths, max_length, stride)
+    return np.repeat(np.minimum(lengths, max_length - 2) + 2, counts)
+
+
+# Share of padded positions in the batches of one epoch
+def padding_waste(lengths, max_length=MAX_LENGTH, batch_size=BATCH_SIZE, seed=SEED):
+    lengths = np.asarray(lengths, dtype=np.int64)
+    if not len(lengths):
+        return {}
+    rng = np.random.default_rng(seed)
+
+    def padded(order):
+        batches = np.array_split(lengths[order], np.arange(batch_size, len(order), batch_size))
+        return sum(len(batch) * int(batch.max()) for batch in batches)
+
+    shuffled = rng.permutation(len(lengths))
+    grouped = np.concatenate([
+        megabatch[np.argsort(-lengths[megabatch], kind="stable")]
+        for megabatch in np.array_split(shuffled, np.arange(MEGABATCH * batch_size, len(shuffled), MEGABATCH * batch_size))
+    ])
+    real = int(lengths.sum())
+    return {
+        "real_tokens": real,
+        "max_length": round(1 - real / (len(lengths) * max_length), 4),
+        "dynamic": round(1 - real / padded(shuffled), 4),
+        "dynamic_grouped": round(1 - real / padded(grouped), 4),
+    }
+
+
+# Training memory of a BERT-style encoder, in bytes. Parameters, gradients and two Adam
+# moments in fp32 are 16 bytes per parameter; activations follow Korthikanti et al. (2022),
+# 34*s*h + 5*a*s^2 bytes per layer and sequence at 2 bytes per value, scaled to bytes_per_value.
+def parameter_count(config):
+    h, inner = config.hidden_size, config.intermediate_size
+    embeddings = (config.vocab_size + config.max_position_embeddings + config.type_vocab_size + 2) * h
+    layer = 4 * h * h + 2 * h * inner + inner + 9 * h
+    return embeddings + config.num_hidden_layers * layer + h * h + h + (config.num_labels + 1) * h
+
+
+def sequence_memory(config, length, bytes_per_value=4):
+    h, heads = config.hidden_size, config.num_attention_heads
+    return config.num_hidden_layers * length * (34 * h + 5 * heads * length) * bytes_per_value / 2
+
+
+# Largest batch of `length`-subword inputs that trains within memory_gb
+def recommend_batch(config, length, memory_gb=MEMORY_GB, reserve=MEMORY_RESERVE, bytes_per_value=4):
+    static = 16 * parameter_count(config)
+    available = memory_gb * 1024 ** 3 * (1 - reserve) - static
+    batch_size = max(int(available // sequence_memory(config, length, bytes_per_value)), 0)
+    return {
+        "static_gb": round(static / 1024 ** 3, 3),
+        "per_example_gb": round(sequence_memory(config, length, bytes_per_value) / 1024 ** 3, 4),
+        "batch_size": batch_size,
+        "tokens_per_batch": batch_size * length,
+    }
+
+
+def profile(documents, config, max_length=MAX_LENGTH, strides=(STRIDE,), batch_size=BATCH_SIZE, memory_gb=MEMORY_GB):
+    sentences = np.array([n for lengths in documents for n in lengths], dtype=np.int64)
+    report = {
+        "documents": len(documents),
+        "sentences": len(sentences),
+        "document_subwords": describe([sum(lengths) for lengths in documents]),
+        "sentence_subwords": describe(sentences),
+        "truncated": {
+            "sentences_over_max_length": round(float((sentences > max_length - 2).mean()), 4) if len(sentences) else 0.0,
+            "padding_waste": padding_waste(np.minimum(sentences, max_length - 2) + 2, max_length, batch_size),
+        },
+        "windows": {},
+    }
+    for stride in strides:
+        per_document = [int(windows_per_sequence(lengths, max_length, stride).sum()) for lengths in documents]
+        inputs = input_lengths(sentences, max_length, stride)
+        report["windows"][str(stride)] = {
+            "per_document": describe(per_document),
+            "total": int(sum(per_document)),
+            "subword_overhead": round(float(inputs.sum() - 2 * len(inputs)) / max(int(sentences.sum()), 1) - 1, 4),
+            "padding_waste": padding_waste(inputs, max_length, batch_size),
+        }
+    if config is not None:
+        longest = int(min(sentences.max() + 2, max_length)) if len(sentences) else max_length
+        report["memory"] = {"memory_gb": memory_gb, "sequence_length": longest, **recommend_batch(config, longest, memory_gb)}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Subword-length profile of .iob corpora and raw JSONL, to size max_length, stride and batch size.")
+    parser.add_argument("corpora", nargs="+", help=".iob folders, packed corpora, document lists, .jsonl files or folders of them")
+    parser.add_argument("--tokenizer", default=TOKENIZER, help="Model folder or hub id; its config is used for the memory estimate")
+    parser.add_argument("--max-length", type=int, default=MAX_LENGTH)
+    parser.add_argument("--stride", type=int, nargs="+", default=[STRIDE], help="One or more window strides to compare")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="Batch size the padding waste is measured at")
+    parser.add_argument("--memory-gb", type=float, default=MEMORY_GB, help="Memory ceiling the batch size is recommended for")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--output", help="Write the JSON here instead of to stdout")
+    args = parser.parse_args()
+    if any(not 0 <= stride < args.max_length - 2 for stride in args.stride):
+        parser.error(f"--stride must be at least 0 and below --max-length - 2 ({args.max_length - 2})")
+
+    from transformers import AutoConfig, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+    try:
+        config = AutoConfig.from_pretrained(args.tokenizer)
+    except (OSError, ValueError):
+        config = None  # A tokenizer without a model config: no memory estimate
+
+    report = {
+        "settings": {"tokenizer": args.tokenizer, "max_length": args.max_length, "batch_size": args.batch_size},
+        "corpora": {},
+    }
+    for corpus in args.corpora:
+        if is_jsonl(corpus):
+            documents = jsonl_subwords(corpus, tokenizer)
+        else:
+            paths = sorted(list_documents(corpus))
+            documents = [stats["sentence_subwords"] for stats in collect_stats(paths, args.tokenizer, args.workers)]
+        report["corpora"][corpus] = profile(documents, config, args.max_length, args.stride, args.batch_size, args.memory_gb)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"📏 Subword profile of {len(args.corpora)} corpora saved to {args.output}", file=sys.stderr)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
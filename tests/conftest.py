@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The project is a folder of flat scripts; make its modules importable from the tests
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
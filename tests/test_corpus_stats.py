@@ -0,0 +1,99 @@
+import os
+
+import corpus_stats
+from corpus_stats import collect_stats, document_stats, entity_tally, evict, summarize
+from iob_format import parse_iob_text, write_iob
+
+document_stats_of = corpus_stats.document_stats
+
+TEXT = """[\tO
+G.R.\tB-CASE_NUM
+No.\tI-CASE_NUM
+242353\tI-CASE_NUM
+]\tO
+
+Republic\tB-RA
+Act\tI-RA
+No.\tI-RA
+6713\tI-RA
+and\tO
+Senate\tB-INS
+"""
+
+
+def test_document_stats():
+    stats = document_stats(parse_iob_text(TEXT, "a.iob"))
+    assert stats["tokens"] == 11 and stats["sentences"] == 2
+    assert stats["sentence_tokens"] == [5, 6]
+    assert stats["entities"] == {"CASE_NUM": 1, "RA": 1, "INS": 1}
+    assert stats["spans"] == {"CASE_NUM": 1, "RA": 1, "INS": 1}
+    assert stats["span_lengths"] == {"CASE_NUM": [0, 0, 0, 1], "RA": [0, 0, 0, 0, 1], "INS": [0, 1]}
+    assert stats["case_number"] == "GRNO242353"
+    assert entity_tally(stats) == {
+        "case_nums": 1, "persons": 0, "institutions": 1, "prom_dates": 0, "republic_acts": 1, "statutes": 0,
+    }
+
+
+def test_entities_count_b_tags():
+    # An I- run without a B- tag is a decoded span but not a counted entity, as in count.py's tally
+    stats = document_stats(parse_iob_text("of\tI-INS\nCourt\tI-INS\nx\tO\nSenate\tB-INS\n", "a.iob"))
+    assert stats["entities"] == {"INS": 1}
+    assert stats["spans"] == {"INS": 2}
+    assert entity_tally(stats)["institutions"] == 1
+    assert summarize([stats])["tally"]["institutions"] == 1 and summarize([stats])["spans"] == {"INS": 2}
+
+
+def test_summarize():
+    first = document_stats(parse_iob_text(TEXT, "a.iob"))
+    second = document_stats(parse_iob_text("Senate\tB-INS\nof\tI-INS\nx\tO\n", "b.iob"))
+    summary = summarize([first, second])
+    assert summary["files"] == 2 and summary["tokens"] == 14 and summary["sentences"] == 3
+    assert summary["entities"] == {"CASE_NUM": 1, "INS": 2, "RA": 1}
+    assert summary["span_lengths"]["INS"] == [0, 1, 1]
+    assert summary["sentence_tokens"]["max"] == 6
+    assert summarize([])["files"] == 0
+
+
+def write_corpus(folder, n):
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(n):
+        path = os.path.join(folder, f"{i}.iob")
+        write_iob(path, [([f"token{i}", "Senate"], ["O", "B-INS"])])
+        paths.append(path)
+    return paths
+
+
+def test_collect_stats_cache(tmp_path, monkeypatch):
+    cache_dir = str(tmp_path / "cache")
+    paths = write_corpus(str(tmp_path / "queue"), 4)
+    stats = collect_stats(paths, cache_dir=cache_dir)
+    assert [s["entities"] for s in stats] == [{"INS": 1}] * 4
+
+    # Entries are keyed by content: only the edited file is parsed again
+    parsed = []
+    monkeypatch.setattr(corpus_stats, "document_stats",
+                        lambda document, tokenizer=None: parsed.append(document.source) or document_stats_of(document, tokenizer))
+    write_iob(paths[1], [(["x"], ["O"])])
+    stats = collect_stats(paths, cache_dir=cache_dir)
+    assert parsed == [paths[1]]
+    assert [s["entities"] for s in stats] == [{"INS": 1}, {}, {"INS": 1}, {"INS": 1}]
+    assert collect_stats(paths, cache_dir=cache_dir, use_cache=False) == stats
+
+
+def test_evict_least_recently_used(tmp_path):
+    cache_dir = str(tmp_path / "cache")
+    paths = write_corpus(str(tmp_path / "queue"), 6)
+    collect_stats(paths, cache_dir=cache_dir)
+    entries = [entry.path for folder, _, _ in os.walk(cache_dir) for entry in os.scandir(folder) if entry.is_file()]
+    assert len(entries) == 6
+    size = os.path.getsize(entries[0])
+    for age, path in enumerate(sorted(entries)):
+        os.utime(path, (1000 + age, 1000 + age))
+
+    evict(cache_dir, max_bytes=size * 6)  # Not past the cap: nothing goes
+    left = lambda: sorted(entry.path for folder, _, _ in os.walk(cache_dir) for entry in os.scandir(folder) if entry.is_file())
+    assert left() == sorted(entries)
+
+    evict(cache_dir, max_bytes=size * 3)  # Down to 90% of the cap, so the next write doesn't evict again
+    assert left() == sorted(entries)[4:]
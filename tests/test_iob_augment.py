@@ -0,0 +1,107 @@
+import numpy as np
+import pytest
+
+from iob_augment import AugmentedTrainingSet, SpanBank, augment_document, is_original
+from iob_format import entity_spans, parse_iob_text
+
+TEXT = """the\tO
+Senate\tB-INS
+upheld\tO
+Republic\tB-RA
+Act\tI-RA
+9165\tI-RA
+and\tO
+consolidation\tO
+
+per\tO
+Congress\tB-INS
+Rizal\tB-CNS
+"""
+OTHER = """the\tO
+House\tB-INS
+Republic\tB-RA
+Act\tI-RA
+6713\tI-RA
+Cebu\tB-CNS
+"""
+
+
+def make_bank():
+    return SpanBank.from_documents([parse_iob_text(TEXT, "a.iob"), parse_iob_text(OTHER, "b.iob")])
+
+
+def test_span_bank():
+    bank = make_bank()
+    assert bank.types == ["INS", "RA"]  # CNS is excluded
+    assert len(bank) == 5
+    assert sorted(map(tuple, bank.phrases[("RA", 3)])) == [("Republic", "Act", "6713"), ("Republic", "Act", "9165")]
+
+
+def test_augment_document_keeps_labels():
+    document = parse_iob_text(TEXT, "queue/a.iob")
+    variants = augment_document(document, make_bank(), 6)
+    assert [variant.source for variant in variants] == [f"a_aug{n}.iob" for n in range(1, 7)]
+    assert not any(is_original(variant.source) for variant in variants)
+    assert {tuple(variant.tokens(3, 6)) for variant in variants} == {("Republic", "Act", "6713"), ("Republic", "Act", "9165")}
+    for variant in variants:
+        assert variant.label_names() == document.label_names()
+        assert entity_spans(variant) == entity_spans(document)
+        assert variant.tokens(10, 11) == ["Rizal"]  # CNS is never swapped
+        assert [token for token, label in zip(variant.tokens(), variant.label_names()) if label == "O"] == \
+            [token for token, label in zip(document.tokens(), document.label_names()) if label == "O"]
+
+    # Seeded by the document name, not by call order
+    again = augment_document(parse_iob_text(TEXT, "elsewhere/a.iob"), make_bank(), 6)
+    assert [variant.tokens() for variant in again] == [variant.tokens() for variant in variants]
+
+
+def make_tokenizer(tmp_path):
+    transformers = pytest.importorskip("transformers")
+    words = ["the", "Senate", "upheld", "Republic", "Act", "9165", "6713", "and", "consolidation", "per", "Congress",
+             "Rizal", "House", "Cebu"]
+    vocab = ["[PAD]", "[UNK]", "[CLS]", "[SEP]", "[MASK]", "con", "##sol", "##ida", "##tion"] + words[:8] + words[9:]
+    vocab_path = tmp_path / "vocab.txt"
+    vocab_path.write_text("\n".join(vocab) + "\n", encoding="utf-8")
+    return transformers.BertTokenizerFast(str(vocab_path), do_lower_case=False)
+
+
+@pytest.mark.parametrize("windowed", [True, False])
+def test_augmented_training_set_lengths(tmp_path, windowed):
+    datasets = pytest.importorskip("datasets")
+    tokenizer = make_tokenizer(tmp_path)
+    labels = ["O", "B-INS", "I-INS", "B-RA", "I-RA", "B-CNS", "I-CNS"]
+    label2id = {label: i for i, label in enumerate(labels)}
+    base = datasets.Dataset.from_dict({"input_ids": [[2, 10, 3], [2, 3]], "labels": [[-100, 0, -100], [-100, -100]]})
+    document = parse_iob_text(TEXT, "a.iob")
+
+    training_set = AugmentedTrainingSet(base, [document], make_bank(), tokenizer, label2id, 3, max_length=8, stride=2,
+                                        windowed=windowed, padding=False)
+    assert len(training_set.lengths) == len(training_set)
+    assert training_set.lengths[:2] == [3, 2]
+    # Swapped entities have the same number of subwords here, so the planned lengths are exact
+    assert [len(training_set[i]["input_ids"]) for i in range(len(training_set))] == training_set.lengths
+    if windowed:
+        assert max(training_set.lengths) == 8 and len(training_set) > 2 + 2 * 3
+
+    padded = AugmentedTrainingSet(base, [document], make_bank(), tokenizer, label2id, 3, max_length=8, stride=2,
+                                  windowed=windowed)
+    assert padded.lengths[2:] == [8] * (len(padded) - 2)
+
+
+def test_augmented_copies_change_per_epoch(tmp_path):
+    datasets = pytest.importorskip("datasets")
+    tokenizer = make_tokenizer(tmp_path)
+    label2id = {label: i for i, label in enumerate(["O", "B-INS", "I-INS", "B-RA", "I-RA", "B-CNS", "I-CNS"])}
+    base = datasets.Dataset.from_dict({"input_ids": [[2, 3]], "labels": [[-100, -100]]})
+    training_set = AugmentedTrainingSet(base, [parse_iob_text(TEXT, "a.iob")], make_bank(), tokenizer, label2id, 4,
+                                        windowed=False, padding=False)
+
+    def epoch(number):
+        training_set.set_epoch(number)
+        return [training_set[i]["input_ids"] for i in range(1, len(training_set))]
+
+    first = epoch(0)
+    assert epoch(0) == first
+    assert any(epoch(number) != first for number in range(1, 5))
+    # Copies of one window keep its labels
+    assert all(np.array_equal(training_set[i]["labels"], training_set[1]["labels"]) for i in range(1, 5))
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+pytest.importorskip("datasets")
+
+import iob_cache
+from iob_cache import load_or_build
+
+
+def build(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return {"text": [f.read()]}
+
+
+def entries(cache_dir, folder):
+    path = os.path.join(cache_dir, folder)
+    return sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+
+
+def test_edited_files_leave_no_entries_behind(tmp_path, monkeypatch):
+    monkeypatch.setattr(iob_cache, "MAX_SPLITS", 1)
+    cache_dir = str(tmp_path / "cache")
+    paths = [str(tmp_path / f"{i}.iob") for i in range(3)]
+    for path in paths:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(path)
+
+    assert load_or_build(paths, {}, build, cache_dir)["text"] == paths
+    first = entries(cache_dir, "files")
+    assert len(first) == 3
+
+    with open(paths[1], "w", encoding="utf-8") as f:
+        f.write("edited")
+    assert load_or_build(paths, {}, build, cache_dir)["text"] == [paths[0], "edited", paths[2]]
+    second = entries(cache_dir, "files")
+    assert len(second) == 3 and len(set(first) & set(second)) == 2
+    assert len(entries(cache_dir, "splits")) == 1
@@ -0,0 +1,44 @@
+import random
+
+from iob_format import entity_spans, format_iob, iter_sentences, parse_iob_text, read_sentences
+
+
+def test_lines_without_two_fields_are_skipped():
+    document = parse_iob_text("a B-X\nb c d\ne\nf O\n  g\tO ")
+    assert document.tokens() == ["a", "f", "g"]
+    assert document.label_names() == ["B-X", "O", "O"]
+
+
+def test_blank_line_runs_and_empty_sentences():
+    document = parse_iob_text("\n\na\tO\nb\tB-INS\n\n \n\nlonely\n\nc\tI-INS\n")
+    assert [tokens for tokens, _ in document.sentences()] == [["a", "b"], ["c"]]
+
+
+def test_block_parser_matches_line_reader(tmp_path):
+    rng = random.Random(0)
+    words = ["x", "y", "B-INS", "O", "I-STA"]
+    lines = []
+    for _ in range(2000):
+        kind = rng.random()
+        if kind < 0.15:
+            lines.append(rng.choice(["", " ", "\t"]))
+        else:
+            n_fields = rng.choice([2, 2, 2, 2, 1, 3, 4])
+            line = rng.choice([" ", "\t", "  "]).join(rng.choice(words) for _ in range(n_fields))
+            lines.append(rng.choice(["", "", " "]) + line + rng.choice(["", "", "\t"]))
+    path = tmp_path / "mixed.iob"
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+    tokens, labels = read_sentences(path)
+    assert list(zip(tokens, labels)) == list(iter_sentences(path))
+
+
+def test_format_round_trip():
+    sentences = [(["Republic", "Act", "No.", "6713"], ["B-RA", "I-RA", "I-RA", "I-RA"]), (["ok"], ["O"])]
+    document = parse_iob_text(format_iob(sentences))
+    assert list(document.sentences()) == sentences
+
+
+def test_entity_spans_repair_orphan_inside_tags():
+    text = "a\tB-PERSON\nb\tI-PERSON\nc\tI-INS\nd\tO\ne\tI-INS\n\nf\tI-INS\n"
+    assert entity_spans(parse_iob_text(text)) == [("PERSON", 0, 2), ("INS", 2, 3), ("INS", 4, 5), ("INS", 5, 6)]
@@ -0,0 +1,69 @@
+import os
+
+from iob_format import read_iob, write_iob
+from iob_pack import (
+    document_hash, export_document, list_documents, pack_folder, read_document, read_document_sentences, unpack,
+    write_document_list
+)
+
+DOCUMENTS = {
+    "a.iob": [(["Republic", "Act", "No.", "6713"], ["B-RA", "I-RA", "I-RA", "I-RA"]), (["ñ", "ok"], ["O", "O"])],
+    "b.iob": [(["Senate", "ok", "Senate"], ["B-INS", "O", "B-INS"])],
+    "empty.iob": [],
+}
+
+
+def make_folder(folder):
+    os.makedirs(folder)
+    for name, sentences in DOCUMENTS.items():
+        write_iob(os.path.join(folder, name), sentences)
+    return str(folder)
+
+
+def test_pack_round_trip(tmp_path):
+    folder = make_folder(tmp_path / "queue")
+    pack_path = str(tmp_path / "queue.iobpack")
+    pack_folder(folder, pack_path)
+
+    documents = sorted(list_documents(pack_path))
+    assert [os.path.basename(path) for path in documents] == sorted(DOCUMENTS)
+    for path in documents:
+        plain = os.path.join(folder, os.path.basename(path))
+        assert list(read_document(path).sentences()) == list(read_iob(plain).sentences())
+        assert read_document_sentences(path) == read_document_sentences(plain)
+
+    assert unpack(pack_path, str(tmp_path / "unpacked")) == len(DOCUMENTS)
+    for name in DOCUMENTS:
+        with open(os.path.join(folder, name), "rb") as original, open(tmp_path / "unpacked" / name, "rb") as copy:
+            assert original.read() == copy.read()
+
+
+def test_document_hash_matches_between_formats(tmp_path):
+    folder = make_folder(tmp_path / "queue")
+    pack_path = str(tmp_path / "queue.iobpack")
+    pack_folder(folder, pack_path)
+    for name in DOCUMENTS:
+        assert document_hash(os.path.join(pack_path, name)) == document_hash(os.path.join(folder, name))
+    assert document_hash(os.path.join(folder, "a.iob")) != document_hash(os.path.join(folder, "b.iob"))
+
+
+def test_list_documents_of_folder_and_list(tmp_path):
+    folder = make_folder(tmp_path / "queue")
+    (tmp_path / "queue" / "notes.txt").write_text("not a document", encoding="utf-8")
+    assert sorted(os.path.basename(path) for path in list_documents(folder)) == sorted(DOCUMENTS)
+
+    pack_path = str(tmp_path / "queue.iobpack")
+    pack_folder(folder, pack_path)
+    paths = [os.path.join(folder, "a.iob"), os.path.join(pack_path, "b.iob")]
+    list_path = str(tmp_path / "splits" / "train.list")
+    os.makedirs(tmp_path / "splits")
+    write_document_list(paths, list_path)
+    assert list_documents(list_path) == [os.path.normpath(path) for path in paths]
+
+
+def test_export_document(tmp_path):
+    folder = make_folder(tmp_path / "queue")
+    pack_path = str(tmp_path / "queue.iobpack")
+    pack_folder(folder, pack_path)
+    export_document(os.path.join(pack_path, "b.iob"), str(tmp_path / "b.iob"))
+    assert document_hash(str(tmp_path / "b.iob")) == document_hash(os.path.join(folder, "b.iob"))
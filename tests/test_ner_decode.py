@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from ner_decode import aggregate_batch, aggregate_subwords, aggregate_words, decode_spans, spans_to_entities, word_id_array
+
+ID2LABEL = {0: "O", 1: "B-RA", 2: "I-RA", 3: "B-INS", 4: "I-INS"}
+
+
+# [CLS] word0 (two subwords) word1 [SEP]
+WORD_IDS = word_id_array([None, 0, 0, 1, None])
+DOC_IDS = np.zeros(5, dtype=np.int64)
+PROBS = np.array([
+    [1.0, 0.0, 0.0, 0.0, 0.0],
+    [0.1, 0.5, 0.1, 0.3, 0.0],
+    [0.1, 0.0, 0.1, 0.8, 0.0],
+    [0.9, 0.1, 0.0, 0.0, 0.0],
+    [1.0, 0.0, 0.0, 0.0, 0.0],
+])
+
+
+@pytest.mark.parametrize("aggregation, labels, scores", [
+    ("first", [1, 0], [0.5, 0.9]),
+    ("average", [3, 0], [0.55, 0.9]),
+    ("max", [3, 0], [0.8, 0.9]),
+])
+def test_aggregate_words(aggregation, labels, scores):
+    word_labels, word_scores = aggregate_words(PROBS, WORD_IDS, DOC_IDS, aggregation)
+    assert word_labels.tolist() == labels
+    assert np.allclose(word_scores, scores)
+
+
+def test_aggregate_subwords_spreads_word_values():
+    label_ids, scores = aggregate_subwords(PROBS, WORD_IDS, DOC_IDS, "average")
+    assert label_ids.tolist() == [0, 3, 3, 0, 0]
+    assert np.allclose(scores[1:3], 0.55)
+
+
+def test_aggregate_batch_matches_rows():
+    probs = np.stack([PROBS, PROBS[::-1]])
+    word_ids = np.stack([WORD_IDS, word_id_array([None, 0, 1, 1, None])])
+    label_ids, scores = aggregate_batch(probs, word_ids, "max")
+    for row in range(2):
+        expected = aggregate_subwords(probs[row], word_ids[row], np.zeros(5, dtype=np.int64), "max")
+        assert label_ids[row].tolist() == expected[0].tolist()
+        assert np.allclose(scores[row], expected[1])
+
+
+def test_unknown_aggregation():
+    with pytest.raises(ValueError):
+        aggregate_words(PROBS, WORD_IDS, DOC_IDS, "mean")
+
+
+def test_decode_spans_repairs_bio():
+    # doc 0: "RA 9165 x Senate Act", the last word subword-split; doc 1: "Court"
+    texts = ["RA 9165 x Senate Act", "Court"]
+    word_ids = word_id_array([None, 0, 1, 2, 3, 4, 4, None, None, 0, None])
+    doc_ids = np.array([0] * 8 + [1] * 3)
+    offsets = np.array([[0, 0], [0, 2], [3, 7], [8, 9], [10, 16], [17, 19], [19, 20], [0, 0], [0, 0], [0, 5], [0, 0]])
+    # Orphan I-RA, I-RA, O, B-INS, I-RA (wrong type), then an orphan I-INS in the next document
+    label_ids = np.array([0, 2, 2, 0, 3, 2, 4, 0, 0, 4, 0])
+    scores = np.array([1, 0.9, 0.7, 1, 0.6, 0.4, 0.1, 1, 1, 0.95, 1])
+
+    spans, type_names = decode_spans(label_ids, scores, word_ids, doc_ids, offsets, ID2LABEL)
+    entities = spans_to_entities(spans, type_names, texts)
+    assert [(e["entity_group"], e["word"]) for e in entities[0]] == [("RA", "RA 9165"), ("INS", "Senate"), ("RA", "Act")]
+    assert [(e["entity_group"], e["word"]) for e in entities[1]] == [("INS", "Court")]
+    assert np.allclose(spans["score"], [0.8, 0.6, 0.4, 0.95])
+
+    spans, type_names = decode_spans(label_ids, scores, word_ids, doc_ids, offsets, ID2LABEL, {"RA": 0.5, "INS": 0.9})
+    assert [type_names[t] for t in spans["type"]] == ["RA", "INS"]
+    assert spans["doc"].tolist() == [0, 1]
+
@@ -0,0 +1,59 @@
+import os
+
+from iob_format import write_iob
+from ner_rules import RuleTagger, collect_entity_bank, merge_entities
+
+
+def found(tagger, text):
+    return [(entity_type, text[start:end]) for entity_type, start, end in tagger.find(text)]
+
+
+def test_caption_case_number_and_date():
+    text = "[ G.R. No. 242353, February 4, 2020 ] PEOPLE v. CRUZ"
+    assert found(RuleTagger(), text) == [("CASE_NUM", "G.R. No. 242353"), ("PROM_DATE", "February 4, 2020")]
+
+
+def test_case_numbers_and_republic_acts():
+    tagger = RuleTagger()
+    assert found(tagger, "A.M. No. RTJ-09-2183 dated 5 June 2001") == [("CASE_NUM", "A.M. No. RTJ-09-2183")]
+    assert found(tagger, "in G.R. Nos. 0166 and 0169, under Republic Act No. 6713.") == [
+        ("CASE_NUM", "G.R. Nos. 0166 and 0169"), ("RA", "Republic Act No. 6713"),
+    ]
+    # A date outside a caption is not a promulgation date, and matches don't start inside words
+    assert found(tagger, "decided on March 3, 2015 by XRA 9165") == []
+
+
+def test_bank_phrases(tmp_path):
+    folder = tmp_path / "queue"
+    os.makedirs(folder)
+    sentence = (["the", "Anti-Graft", "Law", "and", "Senate"], ["O", "B-RA", "I-RA", "O", "B-INS"])
+    write_iob(str(folder / "a.iob"), [sentence])
+    write_iob(str(folder / "b.iob"), [sentence, (["Anti-Graft", "Law"], ["B-RA", "I-RA"])])
+    bank = collect_entity_bank(str(folder))
+    assert bank == {"RA": [("Anti-Graft", "Law")]}  # INS is not a rule type
+    assert found(RuleTagger(bank), "under the Anti-Graft  Law") == [("RA", "Anti-Graft  Law")]
+
+
+def test_merge_entities_prefers_rules():
+    model = [
+        {"entity_group": "CASE_NUM", "start": 2, "end": 9, "score": 0.5},
+        {"entity_group": "PERSON", "start": 40, "end": 45, "score": 0.9},
+    ]
+    rules = [{"entity_group": "CASE_NUM", "start": 2, "end": 17, "score": 1.0}]
+    assert merge_entities(model, rules) == [rules[0], model[1]]
+    assert merge_entities(model, []) == model
+
+
+def test_needs_model():
+    tagger = RuleTagger()
+    text = "The law cited is Republic Act No. 6713. Juan Cruz appealed."
+    entities = tagger.tag([text])[0]
+    assert not tagger.needs_model(text, 0, text.index("Juan"), entities)
+    assert tagger.needs_model(text, 0, len(text), entities)
+
+
+def test_fingerprint_follows_bank():
+    bank = {"RA": [("Anti-Graft", "Law")]}
+    assert RuleTagger().fingerprint() == RuleTagger({}).fingerprint()
+    assert RuleTagger(bank).fingerprint() == RuleTagger(dict(bank)).fingerprint()
+    assert RuleTagger(bank).fingerprint() != RuleTagger().fingerprint()
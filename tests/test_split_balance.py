@@ -0,0 +1,55 @@
+import numpy as np
+
+from split_balance import ENTITY_KEYS, group_files, split_files
+
+RATIOS = {'train': 0.7, 'eval': 0.2, 'test': 0.1}
+
+
+def synthetic_corpus(n_files, presence, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        (f"doc{i}.iob", {key: int(rng.integers(1, 6)) if rng.random() < presence else 0 for key in ENTITY_KEYS})
+        for i in range(n_files)
+    ]
+
+
+def shares(files_counts, split_counts):
+    totals = {key: sum(counts[key] for _, counts in files_counts) for key in ENTITY_KEYS}
+    return {split: {key: split_counts[split][key] / totals[key] for key in ENTITY_KEYS} for split in split_counts}
+
+
+def test_every_type_is_split_at_the_target_ratios():
+    files_counts = synthetic_corpus(1000, presence=0.5)
+    split_files_dict, split_counts = split_files(files_counts, RATIOS)
+    for split, type_shares in shares(files_counts, split_counts).items():
+        for key, share in type_shares.items():
+            assert abs(share - RATIOS[split]) < 0.015, (split, key, share)
+    assert sorted(f for files in split_files_dict.values() for f in files) == sorted(f for f, _ in files_counts)
+
+
+def test_rare_type_is_stratified():
+    files_counts = synthetic_corpus(600, presence=0.6, seed=1)
+    for i, (_, counts) in enumerate(files_counts):
+        counts['prom_dates'] = 1 if i % 20 == 0 else 0  # 30 files
+    _, split_counts = split_files(files_counts, RATIOS)
+    assert [split_counts[split]['prom_dates'] for split in RATIOS] == [21, 6, 3]
+
+
+def test_files_without_entities_still_fill_the_splits():
+    files_counts = [(f"empty{i}.iob", dict.fromkeys(ENTITY_KEYS, 0)) for i in range(100)]
+    split_files_dict, _ = split_files(files_counts, RATIOS)
+    assert {split: len(files) for split, files in split_files_dict.items()} == {'train': 70, 'eval': 20, 'test': 10}
+
+
+def test_groups_stay_in_one_split():
+    filenames = ["a.iob", "a_aug1.iob", "a_aug2.iob", "b.iob", "c.iob", "c_aug1.iob"]
+    case_numbers = ["GR1", "GR9", "GR8", "GR1", "GR2", "GR3"]
+    groups = group_files(filenames, case_numbers)
+    # a and its copies, b (same decision as a); the copies' swapped case numbers don't join anything
+    assert sorted(map(sorted, groups)) == [[0, 1, 2, 3], [4, 5]]
+
+    files_counts = [(f, dict.fromkeys(ENTITY_KEYS, 1)) for f in filenames]
+    split_files_dict, _ = split_files(files_counts, RATIOS, groups)
+    where = {f: split for split, files in split_files_dict.items() for f in files}
+    assert len({where[filenames[i]] for i in groups[0]}) == 1
+    assert len({where[filenames[i]] for i in groups[1]}) == 1